@@ -1,7 +1,10 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, BackgroundTasks
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from app.db.session import get_db
+from app.db.session import session_scope
 from app.db import models
 from app.schemas.auth import (
     AuthResponse,
@@ -9,70 +12,89 @@ from app.schemas.auth import (
     LoginRequest,
     ResetPasswordRequest,
 )
-from app.core.security import hash_password, verify_password, create_access_token
+from app.core.security import (
+    create_access_token,
+    hash_password_async,
+    needs_rehash,
+    verify_password_async,
+)
 
 
 router = APIRouter()
 
 
-@router.post("/register", response_model=AuthResponse)
-def register_user(payload: RegisterRequest, db: Session = Depends(get_db)):
-    # ¿Existe ya el username?
-    existing_username = (
-        db.query(models.User)
-        .filter(models.User.username == payload.username)
-        .first()
+def _find_user_query(db: Session, identifier: str):
+    """Un solo lookup indexado: username (único) o lower(email) (único)."""
+    return db.query(models.User.id, models.User.password_hash).filter(
+        (models.User.username == identifier)
+        | (func.lower(models.User.email) == identifier.lower())
     )
-    if existing_username:
-        return AuthResponse(
-            ok=False,
-            message="El nombre de usuario ya está en uso.",
-        )
 
-    # ¿Existe ya el email?
-    existing_email = (
-        db.query(models.User)
-        .filter(models.User.email == payload.email)
-        .first()
-    )
-    if existing_email:
+
+@router.post("/register", response_model=AuthResponse)
+async def register_user(payload: RegisterRequest):
+    password_hash = await hash_password_async(payload.password)
+
+    def insert_user():
+        # Los índices únicos (username, lower(email)) deciden: sin SELECT previos
+        with session_scope() as db:
+            user_id = db.execute(
+                insert(models.User)
+                .values(
+                    name=payload.name,
+                    email=payload.email,
+                    username=payload.username,
+                    password_hash=password_hash,
+                )
+                .on_conflict_do_nothing()
+                .returning(models.User.id)
+            ).scalar()
+            if user_id is not None:
+                return user_id, None
+
+            # Conflicto: solo entonces averiguamos cuál de los dos
+            username_taken = db.query(
+                db.query(models.User.id).filter(models.User.username == payload.username).exists()
+            ).scalar()
+            return None, username_taken
+
+    user_id, username_taken = await run_in_threadpool(insert_user)
+    if user_id is None:
         return AuthResponse(
             ok=False,
-            message="El correo electrónico ya está registrado.",
+            message=(
+                "El nombre de usuario ya está en uso."
+                if username_taken
+                else "El correo electrónico ya está registrado."
+            ),
         )
 
-    # Crear usuario
-    user = models.User(
-        name=payload.name,
-        email=payload.email,
-        username=payload.username,
-        password_hash=hash_password(payload.password),
-    )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-
-    token = create_access_token(user_id=user.id)
+    token = create_access_token(user_id=user_id)
 
     return AuthResponse(
         ok=True,
         message="Usuario registrado correctamente.",
-        user_id=user.id,
+        user_id=user_id,
         token=token,
     )
 
 
+def _rehash_password(user_id: int, old_hash: str, new_hash: str) -> None:
+    """Guarda el hash nuevo salvo que la contraseña haya cambiado mientras tanto."""
+    with session_scope() as db:
+        db.query(models.User).filter(
+            models.User.id == user_id,
+            models.User.password_hash == old_hash,
+        ).update({models.User.password_hash: new_hash}, synchronize_session=False)
+
+
 @router.post("/login", response_model=AuthResponse)
-def login_user(payload: LoginRequest, db: Session = Depends(get_db)):
-    # Buscar por username o email
-    user = (
-        db.query(models.User)
-        .filter(
-            (models.User.username == payload.identifier)
-            | (models.User.email == payload.identifier)
-        )
-        .first()
-    )
+async def login_user(payload: LoginRequest, background_tasks: BackgroundTasks):
+    def find_user():
+        with session_scope() as db:
+            return _find_user_query(db, payload.identifier).first()
+
+    user = await run_in_threadpool(find_user)
 
     if not user or not user.password_hash:
         return AuthResponse(
@@ -80,12 +102,20 @@ def login_user(payload: LoginRequest, db: Session = Depends(get_db)):
             message="Usuario o contraseña incorrectos.",
         )
 
-    if not verify_password(payload.password, user.password_hash):
+    if not await verify_password_async(payload.password, user.password_hash):
         return AuthResponse(
             ok=False,
             message="Usuario o contraseña incorrectos.",
         )
 
+    if needs_rehash(user.password_hash):
+        # Hash antiguo (SHA-256): se migra a scrypt después de responder
+        async def rehash():
+            new_hash = await hash_password_async(payload.password)
+            await run_in_threadpool(_rehash_password, user.id, user.password_hash, new_hash)
+
+        background_tasks.add_task(rehash)
+
     token = create_access_token(user_id=user.id)
 
     return AuthResponse(
@@ -97,30 +127,29 @@ def login_user(payload: LoginRequest, db: Session = Depends(get_db)):
 
 
 @router.post("/reset", response_model=AuthResponse)
-def reset_password(payload: ResetPasswordRequest, db: Session = Depends(get_db)):
-    # Buscar usuario por username o email
-    user = (
-        db.query(models.User)
-        .filter(
-            (models.User.username == payload.identifier)
-            | (models.User.email == payload.identifier)
-        )
-        .first()
-    )
-
-    if not user:
+async def reset_password(payload: ResetPasswordRequest):
+    password_hash = await hash_password_async(payload.new_password)
+
+    def update_password():
+        with session_scope() as db:
+            user = _find_user_query(db, payload.identifier).first()
+            if not user:
+                return None
+            db.query(models.User).filter(models.User.id == user.id).update(
+                {models.User.password_hash: password_hash}, synchronize_session=False
+            )
+            return user.id
+
+    user_id = await run_in_threadpool(update_password)
+
+    if user_id is None:
         return AuthResponse(
             ok=False,
             message="No se encontró un usuario con ese identificador.",
         )
 
-    user.password_hash = hash_password(payload.new_password)
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-
     return AuthResponse(
         ok=True,
         message="Contraseña actualizada correctamente.",
-        user_id=user.id,
+        user_id=user_id,
     )
@@ -1,22 +1,61 @@
 # app/api/chat.py
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Tuple
 
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, status
+from fastapi import (
+    APIRouter, BackgroundTasks, Depends, HTTPException, UploadFile, File, Form, Header, Request, status,
+)
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from app.db.session import get_db
+from app.api.deps import CurrentUser, current_user, optional_current_user, resolve_user_id
+from app.db.session import get_db, get_read_db, mark_written, session_scope
 from app.db import models
+from app.core.metrics import chat_stage
+from app.core.rate_limit import client_ip, limiter
+from app.core.responses import list_response
 from app.core.vertex_client import (
-    generate_gemini_response,
-    analyze_user_message,
-    generate_gemini_response_with_images,  # NUEVO
+    generate_gemini_response_async,
+    analyze_user_message_async,
+    generate_gemini_response_with_images_async,  # NUEVO
+    track_usage,
+)
+from app.services.chat_turns import (
+    SessionBusy,
+    acquire_turn_lease,
+    claim_idempotency_key,
+    complete_idempotency_key,
+    release_idempotency_key,
+    release_turn_lease,
+    request_fingerprint,
+    scoped_key,
+    session_lock,
+    stored_reply,
+    wait_for_turn,
+)
+from app.services.chat_cleanup import delete_session_images, delete_sessions
+from app.services.chat_context import environment_patch, update_session_context
+from app.services.chat_export import export_chunks
+from app.services.llm_usage import (
+    add_daily_usage,
+    check_daily_budget,
+    note_daily_usage,
+    summarize_usage,
+    usage_tokens,
 )
-from app.services.care_plans import ensure_care_plan_for_plant
-from app.services.plants import ensure_plant_for_user
-from app.services.storage import upload_chat_image
+from app.services.care_plans import (
+    find_care_plan,
+    find_care_plan_locked,
+    new_care_plan,
+    shared_care_plan_json_async,
+)
+from app.services.care_tasks import schedule_care_tasks
+from app.services.plants import ensure_plant_for_user, find_active_plant
+from app.services.image_urls import read_urls
+from app.services.storage import retain_uris, upload_chat_image
 
 router = APIRouter()
 
@@ -53,53 +92,67 @@ class MessageOut(BaseModel):
     content: str | None
     message_type: str
     image_gcs_uris: List[str] | None
+    # URLs firmadas (de corta duración) de image_gcs_uris, en el mismo orden
+    image_urls: List[str] | None = None
     created_at: datetime
 
     class Config:
         orm_mode = True
 
 
-# ------------ Mensaje de chat (texto + imágenes ya subidas) ------------
-
-@router.post("/message", response_model=ChatResponse)
-def chat_message(payload: ChatRequest, db: Session = Depends(get_db)):
-    # 1. Obtener o crear sesión
-    session: Optional[models.ChatSession] = None
-    if payload.session_id is not None:
-        session = db.query(models.ChatSession).get(payload.session_id)
-        if session is None:
-            raise HTTPException(status_code=404, detail="Session not found")
-    else:
-        session = models.ChatSession(user_id=payload.user_id)
-        db.add(session)
-        db.commit()
-        db.refresh(session)
-
-    # 2. Guardar mensaje del usuario
-    user_msg = models.ChatMessage(
-        session_id=session.id,
-        sender="user",
-        content=payload.message,
-        message_type="text" if not payload.image_uris else "mixed",
-        image_gcs_uris=payload.image_uris or None,
-    )
-    db.add(user_msg)
+# Columnas de MessageOut que salen de la base (image_urls se calcula aparte)
+MESSAGE_COLUMNS = (
+    models.ChatMessage.id,
+    models.ChatMessage.session_id,
+    models.ChatMessage.sender,
+    models.ChatMessage.content,
+    models.ChatMessage.message_type,
+    models.ChatMessage.image_gcs_uris,
+    models.ChatMessage.created_at,
+)
 
-    session.last_activity_at = datetime.utcnow()
-    db.add(session)
-    db.commit()
-    db.refresh(user_msg)
 
-    # 3. Historial reciente de la sesión (incluye nota de imágenes)
-    last_messages = (
-        db.query(models.ChatMessage)
-        .filter(models.ChatMessage.session_id == session.id)
-        .order_by(models.ChatMessage.created_at.asc())
-        .all()
-    )
+# ------------ Mensaje de chat (texto + imágenes ya subidas) ------------
 
+MODE_INSTRUCTIONS = {
+    "general": (
+        "Responde como un asistente experto en plantas, contestando dudas generales "
+        "sobre plantas, cuidado y recomendaciones."
+    ),
+    "recommend": (
+        "El usuario quiere recomendaciones de plantas que se adapten a sus condiciones "
+        "de ubicación y ambiente. Propón varias opciones y explica por qué son adecuadas."
+    ),
+    "care_plan": (
+        "El usuario quiere un plan de cuidado detallado para una planta concreta, "
+        "adaptado a su ubicación y condiciones."
+    ),
+    "identify": (
+        "El usuario quiere identificar qué planta tiene usando la información de texto "
+        "y especialmente las imágenes adjuntas. Describe tu razonamiento de forma clara "
+        "y si no estás seguro dilo explícitamente, ofrece candidatos probables y la razón."
+    ),
+}
+
+
+# Parte fija de la respuesta: va como instrucciones de sistema (o caché de
+# contexto); el prompt de cada turno solo trae modo, contexto e historial.
+REPLY_INSTRUCTIONS = "\n".join([
+    "Eres un asistente experto en plantas y jardinería. Siempre respondes en español, "
+    "de forma clara y estructurada.",
+    "",
+    "Cada petición indica el modo de la conversación y su instrucción. Modos posibles:",
+    *(f"- {mode}: {text}" for mode, text in MODE_INSTRUCTIONS.items()),
+    "",
+    "Responde solo con el mensaje que le dirías al usuario, en un tono cercano pero profesional.",
+    "No menciones que hiciste un análisis de intención ni que convertiste nada a JSON.",
+])
+
+
+def _history_text(messages: List[models.ChatMessage]) -> str:
+    """Historial reciente de la sesión (incluye nota de imágenes)."""
     history_text_parts = []
-    for m in last_messages[-6:]:
+    for m in messages:
         role = "Usuario" if m.sender == "user" else "Asistente"
 
         img_note = ""
@@ -110,15 +163,268 @@ def chat_message(payload: ChatRequest, db: Session = Depends(get_db)):
         if img_note or text:
             history_text_parts.append(f"{role}: {img_note}{text}")
 
-    history_text = "\n".join(history_text_parts)
+    return "\n".join(history_text_parts)
+
+
+def _build_reply_prompt(
+    mode: str,
+    analysis: dict,
+    history_text: str,
+    message: str,
+    image_uris: Optional[list[str]],
+) -> str:
+    mode_instruction = MODE_INSTRUCTIONS.get(mode, "Responde como un asistente experto en plantas.")
+
+    context_lines = []
+    if analysis["location"]:
+        context_lines.append(f"Ubicación del usuario: {analysis['location']}")
+    if analysis["light"]:
+        context_lines.append(f"Condiciones de luz: {analysis['light']}")
+    if analysis["humidity"]:
+        context_lines.append(f"Condiciones de humedad: {analysis['humidity']}")
+    if analysis["temperature"]:
+        context_lines.append(f"Temperatura típica: {analysis['temperature']}")
+    if analysis["time"]:
+        context_lines.append(f"Marco temporal relevante: {analysis['time']}")
+    if analysis["plant_name"]:
+        context_lines.append(f"Planta objetivo: {analysis['plant_name']}")
+
+    context_block = "\n".join(context_lines)
+
+    # Nota textual sobre imágenes del mensaje actual (opcional, solo contexto semántico)
+    images_line = ""
+    if image_uris:
+        images_line = (
+            f"\nEl usuario adjuntó {len(image_uris)} imagen(es) de su planta."
+        )
+
+    return f"""
+Modo: {mode}
+Instrucción de modo:
+{mode_instruction}
+
+Información del contexto:
+{context_block}
+
+Historial reciente de la conversación:
+{history_text}
+
+Mensaje actual del usuario:
+Usuario: {message}{images_line}
+"""
 
-    # 4. Contexto de sesión: lo que ya sabemos
+
+def _update_session_context(db: Session, session: models.ChatSession, analysis: dict) -> None:
+    """Ubicación y entorno nuevos en un solo UPDATE; libera el turno (sin commit)."""
+    location = analysis["location"]
+    update_session_context(
+        db,
+        session.id,
+        location=location if location and session.location != location else None,
+        env_patch=environment_patch(analysis, session.environment_json),
+        release_turn=True,
+    )
+
+
+def _turn_owner(payload: ChatRequest, user: Optional[CurrentUser]) -> Tuple[Optional[int], bool]:
+    """
+    (user_id del turno, verificado). Verificado = viene del token o es el
+    dueño guardado de la sesión; el user_id del cuerpo solo cuenta para una
+    sesión nueva sin token.
+    """
+    session_owner = None
+    if payload.session_id is not None:
+        with session_scope() as db:
+            session_owner = (
+                db.query(models.ChatSession.user_id)
+                .filter(models.ChatSession.id == payload.session_id)
+                .scalar()
+            )
+
+    if user is not None:
+        owner_id = resolve_user_id(payload.user_id, user)
+        if session_owner is not None and session_owner != owner_id:
+            raise HTTPException(status_code=403, detail="La sesión no pertenece al usuario.")
+        return owner_id, True
+    if payload.session_id is not None:
+        if payload.user_id is not None and session_owner is not None and payload.user_id != session_owner:
+            raise HTTPException(status_code=403, detail="user_id no coincide con la sesión.")
+        return session_owner, session_owner is not None
+    return payload.user_id, False
+
+
+def _check_idempotency(key: str, request_hash: str) -> Optional[ChatResponse]:
+    """None si la clave es nueva; la respuesta guardada si ya se completó."""
+    with session_scope() as db:
+        record = claim_idempotency_key(db, key, request_hash)
+        if record is None:
+            return None
+        if record.request_hash != request_hash:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key ya usada con un cuerpo de petición distinto.",
+            )
+        if record.status == "done":
+            return ChatResponse(session_id=record.session_id, reply=stored_reply(db, record) or "")
+    raise HTTPException(
+        status_code=409,
+        detail="Esta petición todavía se está procesando.",
+        headers={"Retry-After": "2"},
+    )
+
+
+def _save_assistant_message(
+    db: Session,
+    session_id: int,
+    content: str,
+    idem_key: Optional[str],
+    usage: Optional[List[dict]] = None,
+    user_id: Optional[int] = None,
+) -> models.ChatMessage:
+    """Guarda la respuesta con el uso de Gemini del turno y lo suma al día del usuario."""
+    summary = summarize_usage(usage or [])
+    msg = models.ChatMessage(
+        session_id=session_id,
+        sender="assistant",
+        content=content,
+        message_type="text",
+        vertex_model_name=summary["model"] if summary else None,
+        vertex_response_json=summary,
+    )
+    db.add(msg)
+    mark_written(db, user_id=user_id, session_id=session_id)
+    add_daily_usage(db, user_id, summary)
+    if idem_key:
+        db.flush()
+        complete_idempotency_key(db, idem_key, session_id, msg.id)
+    return msg
+
+
+@router.post("/message", response_model=ChatResponse)
+async def chat_message(
+    payload: ChatRequest,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    user: Optional[CurrentUser] = Depends(optional_current_user),
+):
+    """
+    Turnos ordenados por sesión (lock en proceso + lease en la base) y
+    reintentos con la misma Idempotency-Key devuelven la respuesta guardada
+    sin volver a llamar a Gemini. Los reintentos no cuentan para los límites
+    de uso (rate_limit_chat / rate_limit_identify / presupuesto diario).
+    """
+    owner_id, verified = await run_in_threadpool(_turn_owner, payload, user)
+    # Límites, presupuesto y sesión nueva van al dueño resuelto, no al cuerpo
+    payload = payload.model_copy(update={"user_id": owner_id})
+    idem_key = None
+    # Sin dueño verificado (sesión nueva sin token) la clave se ignora: otro
+    # cliente podría reproducir la respuesta guardada con la misma clave
+    if idempotency_key and verified:
+        idem_key = scoped_key(owner_id, idempotency_key)
+        replay = await run_in_threadpool(
+            _check_idempotency, idem_key, request_fingerprint(payload.model_dump())
+        )
+        if replay is not None:
+            return replay
+
+    try:
+        ip = client_ip(request)
+        await limiter.hit("chat", owner_id, ip)
+        if payload.image_uris:
+            await limiter.hit("identify", owner_id, ip)
+        await check_daily_budget(owner_id)
+
+        if payload.session_id is None:
+            return await _chat_turn(payload, idem_key)
+        async with session_lock(payload.session_id):
+            return await _chat_turn(payload, idem_key)
+    except BaseException:
+        if idem_key:
+            await run_in_threadpool(release_idempotency_key, idem_key)
+        raise
+
+
+async def _chat_turn(payload: ChatRequest, idem_key: Optional[str]) -> ChatResponse:
+    """
+    Un turno de chat = dos transacciones cortas de escritura:
+      1. entrada: sesión (si es nueva) + mensaje del usuario + last_activity_at
+      2. salida: contexto de la sesión + planta + plan + respuesta del asistente
+    Entre medias solo hay una lectura corta (planta/plan existentes).
+
+    Cada bloque de base abre su propia sesión (session_scope) en el threadpool y
+    la cierra al terminar: mientras se espera a Gemini no hay conexión del pool
+    retenida ni hilo ocupado (las llamadas a Vertex son async).
+    """
+    # 1. Transacción de entrada: sesión + mensaje del usuario + historial
+    def inbound():
+        with chat_stage("inbound"), session_scope() as db:
+            if payload.session_id is not None:
+                # Toma el turno y actualiza last_activity_at en un solo UPDATE
+                session = acquire_turn_lease(db, payload.session_id)
+                if session is None:
+                    raise HTTPException(status_code=404, detail="Session not found")
+            else:
+                session = models.ChatSession(user_id=payload.user_id)
+                db.add(session)
+                db.flush()
+
+            db.add(models.ChatMessage(
+                session_id=session.id,
+                sender="user",
+                content=payload.message,
+                message_type="text" if not payload.image_uris else "mixed",
+                image_gcs_uris=payload.image_uris or None,
+            ))
+            mark_written(db, user_id=session.user_id, session_id=session.id)
+            # Este mensaje guarda las URIs: su propia referencia, que suelta al borrarse
+            retain_uris(db, payload.image_uris or ())
+            db.flush()
+
+            # Historial reciente (los últimos 6, incluido el que acabamos de guardar)
+            last_messages = (
+                db.query(models.ChatMessage)
+                .filter(models.ChatMessage.session_id == session.id)
+                .order_by(models.ChatMessage.created_at.desc())
+                .limit(6)
+                .all()
+            )
+            return session, _history_text(list(reversed(last_messages)))
+
+    try:
+        session, history_text = await wait_for_turn(inbound)
+    except SessionBusy:
+        raise HTTPException(
+            status_code=409,
+            detail="La sesión está procesando otro mensaje.",
+            headers={"Retry-After": "2"},
+        )
+
+    try:
+        with track_usage() as usage:
+            response = await _answer_turn(payload, idem_key, session, history_text, usage)
+        note_daily_usage(payload.user_id or session.user_id, usage_tokens(usage))
+        return response
+    except BaseException:
+        if payload.session_id is not None:
+            await run_in_threadpool(release_turn_lease, session.id)
+        raise
+
+
+async def _answer_turn(
+    payload: ChatRequest,
+    idem_key: Optional[str],
+    session: models.ChatSession,
+    history_text: str,
+    usage: List[dict],
+) -> ChatResponse:
+
+    # Contexto de sesión: lo que ya sabemos
     session_context = {
         "location": session.location,
         "environment": session.environment_json,
     }
 
-    # 5. Análisis con Gemini: intención + extracción
+    # 2. Análisis con Gemini: intención + extracción
     #    Le contamos explícitamente si este mensaje trae fotos
     if payload.image_uris:
         new_message_for_analysis = (
@@ -128,185 +434,132 @@ def chat_message(payload: ChatRequest, db: Session = Depends(get_db)):
     else:
         new_message_for_analysis = payload.message
 
-    analysis = analyze_user_message(
-        history_text=history_text,
-        session_context=session_context,
-        new_message=new_message_for_analysis,
-    )
-
+    with chat_stage("analysis"):
+        analysis = await analyze_user_message_async(
+            history_text=history_text,
+            session_context=session_context,
+            new_message=new_message_for_analysis,
+        )
 
     mode = analysis["mode"]
-    location = analysis["location"]
-    time_info = analysis["time"]
-    humidity = analysis["humidity"]
-    light = analysis["light"]
-    temperature = analysis["temperature"]
     plant_name = analysis["plant_name"]
     need_clarification = analysis["need_clarification"]
-    missing_fields = analysis["missing_fields"]
     clarification_question = analysis["clarification_question"]
 
-    # Actualizar sesión con info nueva si no la teníamos
-    updated = False
-    if location and session.location != location:
-        session.location = location
-        updated = True
-
-    env = session.environment_json or {}
-    changed_env = False
-    if humidity and env.get("humidity") != humidity:
-        env["humidity"] = humidity
-        changed_env = True
-    if light and env.get("light") != light:
-        env["light"] = light
-        changed_env = True
-    if temperature and env.get("temperature") != temperature:
-        env["temperature"] = temperature
-        changed_env = True
-    if time_info and env.get("time") != time_info:
-        env["time"] = time_info
-        changed_env = True
-
-    if changed_env:
-        session.environment_json = env
-        updated = True
-
-    if updated:
-        db.add(session)
-        db.commit()
-
-    # 6. Si falta información crítica: hacemos pregunta de aclaración
+    # 3. Si falta información crítica: hacemos pregunta de aclaración
     if need_clarification and clarification_question:
         reply_text = clarification_question
 
-        assistant_msg = models.ChatMessage(
-            session_id=session.id,
-            sender="assistant",
-            content=reply_text,
-            message_type="text",
-        )
-        db.add(assistant_msg)
-        db.commit()
-        db.refresh(assistant_msg)
+        def save_clarification():
+            with chat_stage("outbound"), session_scope() as db:
+                _update_session_context(db, session, analysis)
+                _save_assistant_message(
+                    db, session.id, reply_text, idem_key, usage, payload.user_id or session.user_id
+                )
 
+        await run_in_threadpool(save_clarification)
         return ChatResponse(session_id=session.id, reply=reply_text)
 
-    # 6.5 Auto-crear planta (y opcionalmente el care plan) ANTES de generar la respuesta
-    created_plant = None
-    created_plan = None
-
+    # 4. Planta y plan: lectura corta de lo que ya existe; el plan nuevo (si
+    #    hace falta) se genera con Gemini sin conexión retenida.
     owner_user_id = payload.user_id or session.user_id
-    if owner_user_id and plant_name and not need_clarification:
-        created_plant = ensure_plant_for_user(
-            db=db,
-            user_id=owner_user_id,
-            common_name=plant_name,
-            source="chat",
-            light=light,
-            humidity=humidity,
-            temperature=temperature,
-            location=location,
-        )
-
-        if mode == "care_plan":
+    plant_fields = dict(
+        light=analysis["light"],
+        humidity=analysis["humidity"],
+        temperature=analysis["temperature"],
+        location=analysis["location"],
+    )
+    want_plant = bool(owner_user_id and plant_name and not need_clarification)
+    plan_json = None
+    has_plan = False
+
+    if want_plant and mode == "care_plan":
+        def lookup_plant():
+            with chat_stage("plant_lookup"), session_scope() as db:
+                plant = find_active_plant(db, owner_user_id, plant_name)
+                return plant, bool(plant and find_care_plan(db, owner_user_id, plant.id))
+
+        existing_plant, has_plan = await run_in_threadpool(lookup_plant)
+
+        if not has_plan:
+            # Mismos datos que tendrá la planta tras ensure_plant_for_user
+            merged = {
+                k: (getattr(existing_plant, k, None) or v) for k, v in plant_fields.items()
+            }
             try:
-                created_plan = ensure_care_plan_for_plant(
-                    db=db,
-                    user_id=owner_user_id,
-                    plant=created_plant,
-                    session_id=session.id,
-                )
+                # Sin saldo de planes no se corta el turno: se responde sin plan
+                await limiter.hit("care_plan", owner_user_id, None)
+                with chat_stage("care_plan"):
+                    # Turnos concurrentes para la misma planta comparten la generación
+                    plan_json = await shared_care_plan_json_async(
+                        owner_user_id,
+                        existing_plant.id if existing_plant else plant_name,
+                        existing_plant.common_name if existing_plant else plant_name,
+                        **merged,
+                    )
             except Exception:
-                created_plan = None
-
-    # 7. Construir el prompt especializado
-    mode_instruction = {
-        "general": (
-            "Responde como un asistente experto en plantas, contestando dudas generales "
-            "sobre plantas, cuidado y recomendaciones."
-        ),
-        "recommend": (
-            "El usuario quiere recomendaciones de plantas que se adapten a sus condiciones "
-            "de ubicación y ambiente. Propón varias opciones y explica por qué son adecuadas."
-        ),
-        "care_plan": (
-            "El usuario quiere un plan de cuidado detallado para una planta concreta, "
-            "adaptado a su ubicación y condiciones."
-        ),
-        "identify": (
-            "El usuario quiere identificar qué planta tiene usando la información de texto "
-            "y especialmente las imágenes adjuntas. Describe tu razonamiento de forma clara "
-            "y si no estás seguro dilo explícitamente, ofrece candidatos probables y la razón."
-        ),
-    }.get(mode, "Responde como un asistente experto en plantas.")
-
-    context_lines = []
-    if location:
-        context_lines.append(f"Ubicación del usuario: {location}")
-    if light:
-        context_lines.append(f"Condiciones de luz: {light}")
-    if humidity:
-        context_lines.append(f"Condiciones de humedad: {humidity}")
-    if temperature:
-        context_lines.append(f"Temperatura típica: {temperature}")
-    if time_info:
-        context_lines.append(f"Marco temporal relevante: {time_info}")
-    if plant_name:
-        context_lines.append(f"Planta objetivo: {plant_name}")
-
-    context_block = "\n".join(context_lines)
-
-    # Nota textual sobre imágenes del mensaje actual (opcional, solo contexto semántico)
-    images_line = ""
-    if payload.image_uris:
-        images_line = (
-            f"\nEl usuario adjuntó {len(payload.image_uris)} imagen(es) de su planta."
-        )
-
-    full_prompt = f"""
-Eres un asistente experto en plantas y jardinería. Siempre respondes en español, de forma clara y estructurada.
-
-Instrucción de modo:
-{mode_instruction}
-
-Información del contexto:
-{context_block}
+                plan_json = None
 
-Historial reciente de la conversación:
-{history_text}
-
-Mensaje actual del usuario:
-Usuario: {payload.message}{images_line}
-
-Responde solo con el mensaje que le dirías al usuario, en un tono cercano pero profesional.
-No menciones que hiciste un análisis de intención ni que convertiste nada a JSON.
-"""
+    # 5. Respuesta del asistente
+    full_prompt = _build_reply_prompt(
+        mode, analysis, history_text, payload.message, payload.image_uris
+    )
 
     # Si hay imágenes y el modo es "identify", usamos la función multimodal.
-    if payload.image_uris and mode == "identify":
-        reply_text = generate_gemini_response_with_images(
-            full_prompt,
-            image_gcs_uris=payload.image_uris,  
-        )
-    else:
-        reply_text = generate_gemini_response(full_prompt)
+    with chat_stage("reply"):
+        if payload.image_uris and mode == "identify":
+            reply_text = await generate_gemini_response_with_images_async(
+                full_prompt,
+                image_gcs_uris=payload.image_uris,
+                instructions=REPLY_INSTRUCTIONS,
+            )
+        else:
+            reply_text = await generate_gemini_response_async(
+                full_prompt, instructions=REPLY_INSTRUCTIONS
+            )
 
-    # 7.5 Anexar confirmación visible al usuario sobre la creación
-    if created_plan:
-        reply_text += "... guardé su plan de cuidado ..."
-    elif created_plant:
-        reply_text += "... Si quieres el plan de cuidado, especificame tu ubicación, donde tienes la planta y las condiciones ambientales (luz, humedad, etc). Entre más detalles sobre la planta mejor podré ayudarte ..."
+    # 6. Transacción de salida: contexto + planta + plan + respuesta
+    def outbound() -> str:
+        final_text = reply_text
+        with chat_stage("outbound"), session_scope() as db:
+            _update_session_context(db, session, analysis)
+
+            created_plant = None
+            created_plan = None
+            plan_exists = has_plan
+            if want_plant:
+                created_plant = ensure_plant_for_user(
+                    db=db,
+                    user_id=owner_user_id,
+                    common_name=plant_name,
+                    source="chat",
+                    commit=False,
+                    **plant_fields,
+                )
+                if plan_json is not None:
+                    # Otro turno (u otra instancia) pudo guardar el plan mientras se generaba
+                    plan_exists = find_care_plan_locked(db, owner_user_id, created_plant.id) is not None
+                if plan_json is not None and not plan_exists:
+                    created_plan = new_care_plan(
+                        owner_user_id, created_plant, plan_json, session_id=session.id
+                    )
+                    db.add(created_plan)
+                    schedule_care_tasks(db, created_plan)
+                if created_plant is not None:
+                    mark_written(db, plant_id=created_plant.id)
+
+            # Anexar confirmación visible al usuario sobre la creación
+            if created_plan or plan_exists:
+                final_text += "... guardé su plan de cuidado ..."
+            elif created_plant:
+                final_text += "... Si quieres el plan de cuidado, especificame tu ubicación, donde tienes la planta y las condiciones ambientales (luz, humedad, etc). Entre más detalles sobre la planta mejor podré ayudarte ..."
+
+            _save_assistant_message(
+                db, session.id, final_text, idem_key, usage, owner_user_id
+            )
+        return final_text
 
-    # 8. Guardar respuesta del asistente
-    assistant_msg = models.ChatMessage(
-        session_id=session.id,
-        sender="assistant",
-        content=reply_text,
-        message_type="text",
-    )
-    db.add(assistant_msg)
-    db.commit()
-    db.refresh(assistant_msg)
+    reply_text = await run_in_threadpool(outbound)
 
     return ChatResponse(session_id=session.id, reply=reply_text)
 
@@ -314,7 +567,12 @@ No menciones que hiciste un análisis de intención ni que convertiste nada a JS
 # ------------ Listado de sesiones y mensajes ------------
 
 @router.get("/sessions", response_model=List[ConversationSummary])
-def list_user_sessions(user_id: int, db: Session = Depends(get_db)):
+def list_user_sessions(
+    user_id: Optional[int] = None,
+    user: Optional[CurrentUser] = Depends(optional_current_user),
+    db: Session = Depends(get_read_db),
+):
+    user_id = resolve_user_id(user_id, user)
     sessions = (
         db.query(models.ChatSession)
         .filter(models.ChatSession.user_id == user_id)
@@ -354,91 +612,173 @@ def list_user_sessions(user_id: int, db: Session = Depends(get_db)):
 
 
 @router.get("/sessions/{session_id}/messages", response_model=List[MessageOut])
-def get_session_messages(session_id: int, db: Session = Depends(get_db)):
-    session = db.query(models.ChatSession).get(session_id)
-    if not session:
+def get_session_messages(
+    session_id: int,
+    user: CurrentUser = Depends(current_user),
+    db: Session = Depends(get_read_db),
+):
+    """
+    Mensajes de una sesión del usuario del token (exige token: las URLs de
+    imagen dan acceso a las fotos). Una sesión ajena responde 404, igual que
+    una inexistente.
+    """
+    owner_id = (
+        db.query(models.ChatSession.user_id)
+        .filter(models.ChatSession.id == session_id)
+        .scalar()
+    )
+    if owner_id is None or owner_id != user.id:
         raise HTTPException(status_code=404, detail="Session not found")
 
+    # Solo las columnas de MessageOut (sin vertex_response_json)
     msgs = (
-        db.query(models.ChatMessage)
+        db.query(*MESSAGE_COLUMNS)
         .filter(models.ChatMessage.session_id == session_id)
         .order_by(models.ChatMessage.created_at.asc())
         .all()
     )
 
-    return msgs
+    # Un solo lote de firmas para todas las imágenes de la conversación
+    urls = read_urls(uri for m in msgs for uri in m.image_gcs_uris or ())
+    return list_response(
+        MessageOut,
+        (
+            {**m._mapping, "image_urls": [urls[u] for u in m.image_gcs_uris if u in urls]}
+            if m.image_gcs_uris else m
+            for m in msgs
+        ),
+    )
+
+
+@router.get("/export")
+def export_chat_history(
+    request: Request,
+    gzip: bool = False,
+    user: CurrentUser = Depends(current_user),
+):
+    """
+    Todas las sesiones y mensajes del usuario del token en NDJSON (gzip=true:
+    .ndjson.gz), en streaming y con memoria constante (ver services.chat_export).
+    Exporta conversaciones privadas completas: exige token, no acepta user_id.
+    """
+    owner_id = user.id
+    filename = f"chat-export-{owner_id}.ndjson" + (".gz" if gzip else "")
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if gzip:
+        # Ya va comprimido: que GZip/Brotli middleware no lo vuelvan a comprimir
+        headers["Content-Encoding"] = "identity"
+    return StreamingResponse(
+        export_chunks(owner_id, gzip=gzip, request=request),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers=headers,
+    )
 
 
 # ------------ Upload de imágenes (GCS) ------------
 
 @router.post("/upload-images")
 async def upload_chat_images(
+    request: Request,
     user_id: int = Form(...),
     session_id: int | None = Form(None),
     files: list[UploadFile] = File(...),
-    db: Session = Depends(get_db),
+    user: Optional[CurrentUser] = Depends(optional_current_user),
 ):
     """
     Sube hasta 3 imágenes al bucket y crea un ChatMessage con esas imágenes.
     Devuelve: session_id, lista de URLs y id del mensaje.
+    La conexión a la base no se retiene mientras se sube a GCS.
+    Cada imagen consume del límite rate_limit_upload (usuario e IP).
     """
     if len(files) == 0:
         raise HTTPException(status_code=400, detail="Debes enviar al menos 1 imagen.")
     if len(files) > 3:
         raise HTTPException(status_code=400, detail="Máximo 3 imágenes por mensaje.")
+    user_id = resolve_user_id(user_id, user)
+    await limiter.hit("upload", user_id, client_ip(request), cost=len(files))
 
     # 1) Asegurar existencia de sesión (igual que en /chat/message)
-    if session_id is not None:
-        session = db.query(models.ChatSession).get(session_id)
-        if session is None:
-            raise HTTPException(status_code=404, detail="Session not found")
-    else:
-        session = models.ChatSession(user_id=user_id)
-        db.add(session)
-        db.commit()
-        db.refresh(session)
+    def ensure_session() -> int:
+        with session_scope() as db:
+            if session_id is not None:
+                session = db.get(models.ChatSession, session_id)
+                if session is None:
+                    raise HTTPException(status_code=404, detail="Session not found")
+            else:
+                session = models.ChatSession(user_id=user_id)
+                db.add(session)
+                db.flush()
+            mark_written(db, user_id=session.user_id, session_id=session.id)
+            return session.id
+
+    chat_session_id = await run_in_threadpool(ensure_session)
 
     # 2) Subir todas las imágenes
     image_urls: list[str] = []
     for idx, f in enumerate(files):
         content = await f.read()
-        url = upload_chat_image(
+        url = await run_in_threadpool(
+            upload_chat_image,
             data=content,
             content_type=f.content_type or "image/jpeg",
             user_id=user_id,
-            session_id=session.id,
+            session_id=chat_session_id,
             idx=idx,
         )
         image_urls.append(url)
 
     # 3) Crear ChatMessage “solo imágenes”
-    msg = models.ChatMessage(
-        session_id=session.id,
-        sender="user",
-        content=None,
-        message_type="image",
-        image_gcs_uris=image_urls,
-    )
-    db.add(msg)
+    def save_message() -> int:
+        with session_scope() as db:
+            msg = models.ChatMessage(
+                session_id=chat_session_id,
+                sender="user",
+                content=None,
+                message_type="image",
+                image_gcs_uris=image_urls,
+            )
+            db.add(msg)
+            db.query(models.ChatSession).filter(
+                models.ChatSession.id == chat_session_id
+            ).update({models.ChatSession.last_activity_at: datetime.utcnow()})
+            mark_written(db, user_id=user_id, session_id=chat_session_id)
+            db.flush()
+            return msg.id
 
-    session.last_activity_at = datetime.utcnow()
-    db.add(session)
-    db.commit()
-    db.refresh(msg)
+    message_id = await run_in_threadpool(save_message)
 
     return {
-        "session_id": session.id,
+        "session_id": chat_session_id,
         "image_urls": image_urls,
-        "message_id": msg.id,
+        "message_id": message_id,
     }
 
 @router.delete("/sessions/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_session(session_id: int, db: Session = Depends(get_db)):
-    session = db.query(models.ChatSession).get(session_id)
-    if not session:
+def delete_session(
+    session_id: int,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+):
+    # Mensajes y predicciones se borran por ON DELETE CASCADE en la base
+    deleted = delete_sessions(db, session_ids=[session_id])
+    if not deleted:
         raise HTTPException(status_code=404, detail="Session not found")
+    db.commit()
+    background_tasks.add_task(delete_session_images, deleted)
+    return
 
 
-    db.delete(session)
+@router.delete("/sessions")
+def delete_user_sessions(
+    background_tasks: BackgroundTasks,
+    user: CurrentUser = Depends(current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Borra todas las conversaciones del usuario del token (exige token, no
+    acepta user_id); las imágenes se borran en segundo plano.
+    """
+    deleted = delete_sessions(db, user_id=user.id)
     db.commit()
-    return
\ No newline at end of file
+    background_tasks.add_task(delete_session_images, deleted)
+    return {"deleted": len(deleted)}
\ No newline at end of file
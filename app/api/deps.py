@@ -0,0 +1,118 @@
+# app/api/deps.py
+"""
+Dependencias de autenticación.
+
+current_user verifica el Bearer token (claims cacheados en
+core.security.decode_access_token) y devuelve el usuario mínimo, cacheado
+auth_user_cache_seconds en memoria: una petición autenticada normalmente no
+toca la base.
+
+Mientras el frontend no envíe siempre el token, optional_current_user +
+resolve_user_id permiten migrar endpoints que hoy reciben user_id: si hay
+token manda el token, y un user_id distinto es 403.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.security import InvalidToken, decode_access_token
+from app.db import models
+from app.db.session import session_scope
+
+_bearer = HTTPBearer(auto_error=False)
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    id: int
+    username: Optional[str]
+    email: Optional[str]
+    name: Optional[str]
+
+
+# user_id -> (usuario, expira en monotonic). LRU acotado a auth_claims_cache_size.
+_users: "OrderedDict[int, Tuple[Optional[CurrentUser], float]]" = OrderedDict()
+_users_lock = threading.Lock()
+
+
+def _unauthorized(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+def _load_user(user_id: int) -> Optional[CurrentUser]:
+    with session_scope() as db:
+        row = (
+            db.query(models.User.id, models.User.username, models.User.email, models.User.name)
+            .filter(models.User.id == user_id)
+            .first()
+        )
+    user = CurrentUser(*row) if row else None
+    with _users_lock:
+        _users[user_id] = (user, time.monotonic() + settings.auth_user_cache_seconds)
+        _users.move_to_end(user_id)
+        while len(_users) > settings.auth_claims_cache_size:
+            _users.popitem(last=False)
+    return user
+
+
+async def _user_for_token(token: str) -> CurrentUser:
+    try:
+        claims = decode_access_token(token)
+    except InvalidToken:
+        raise _unauthorized("Token inválido o caducado.")
+
+    user_id = int(claims["sub"])
+    with _users_lock:
+        cached = _users.get(user_id)
+        if cached is not None:
+            if cached[1] > time.monotonic():
+                _users.move_to_end(user_id)
+            else:
+                del _users[user_id]
+                cached = None
+    if cached is not None:
+        user = cached[0]
+    else:
+        user = await run_in_threadpool(_load_user, user_id)
+    if user is None:
+        raise _unauthorized("El usuario del token no existe.")
+    return user
+
+
+async def current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer),
+) -> CurrentUser:
+    if credentials is None:
+        raise _unauthorized("Falta el token de acceso.")
+    return await _user_for_token(credentials.credentials)
+
+
+async def optional_current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer),
+) -> Optional[CurrentUser]:
+    """Como current_user, pero sin token devuelve None (un token inválido sigue siendo 401)."""
+    if credentials is None:
+        return None
+    return await _user_for_token(credentials.credentials)
+
+
+def resolve_user_id(claimed_user_id: Optional[int], user: Optional[CurrentUser]) -> int:
+    """user_id efectivo: el del token si lo hay (y debe coincidir con el enviado)."""
+    if user is not None:
+        if claimed_user_id is not None and claimed_user_id != user.id:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="user_id no coincide con el token.")
+        return user.id
+    if claimed_user_id is None:
+        raise _unauthorized("Falta el token de acceso o user_id.")
+    return claimed_user_id
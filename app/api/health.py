@@ -0,0 +1,91 @@
+# app/api/health.py
+"""
+Probes y estado del servicio.
+
+- /livez: el proceso responde (sin E/S). Para el liveness probe.
+- /readyz: hay conexión libre en el pool y la base contesta SELECT 1. Si el
+  pool está agotado responde 503 enseguida, sin esperar DB_POOL_TIMEOUT.
+- /health: compatibilidad con el probe anterior. El conteo de usuarios es la
+  estimación de pg_class.reltuples (lo que mantiene ANALYZE/autovacuum),
+  cacheada health_stats_ttl_seconds, en vez de un COUNT(*) por llamada.
+- /health/pool: métricas del pool y lag de réplicas.
+"""
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from fastapi import APIRouter, HTTPException
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
+
+from app.core.config import settings
+from app.db.session import DB_MAX_OVERFLOW, get_engine, get_pool_stats, get_replica_status
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+STATS_TABLES = ("users", "plants", "chat_sessions", "chat_messages", "orders")
+
+# reltuples es -1 (PG14+) o 0 si la tabla nunca se analizó
+_ESTIMATES_SQL = text(
+    """
+    SELECT c.relname, c.reltuples::bigint
+    FROM pg_class c
+    WHERE c.oid = ANY(ARRAY[{}]::regclass[])
+    """.format(", ".join(f"to_regclass('{t}')" for t in STATS_TABLES))
+)
+
+_stats: Dict[str, Optional[int]] = {}
+_stats_at = 0.0
+_stats_lock = threading.Lock()
+
+
+def _row_estimates() -> Dict[str, Optional[int]]:
+    """Estimaciones por tabla, refrescadas como mucho cada health_stats_ttl_seconds."""
+    global _stats, _stats_at
+    stale = time.monotonic() - _stats_at >= settings.health_stats_ttl_seconds
+    # Un solo hilo refresca; el resto devuelve el último valor
+    if stale and _stats_lock.acquire(blocking=False):
+        try:
+            with get_engine().connect() as conn:
+                rows = conn.execute(_ESTIMATES_SQL).all()
+            _stats = {name: (count if count >= 0 else None) for name, count in rows}
+        except Exception:
+            logger.warning("No se pudieron leer las estimaciones de pg_class", exc_info=True)
+        finally:
+            _stats_at = time.monotonic()
+            _stats_lock.release()
+    return _stats
+
+
+@router.get("/livez", include_in_schema=False)
+def livez():
+    return {"status": "ok"}
+
+
+@router.get("/readyz", include_in_schema=False)
+def readyz():
+    pool = get_engine().pool
+    if isinstance(pool, QueuePool) and pool.checkedout() >= pool.size() + DB_MAX_OVERFLOW:
+        raise HTTPException(status_code=503, detail="Pool de conexiones agotado.")
+    try:
+        with get_engine().connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception:
+        logger.warning("readyz: la base no responde", exc_info=True)
+        raise HTTPException(status_code=503, detail="Base de datos no disponible.")
+    return {"status": "ok"}
+
+
+@router.get("/health")
+def health():
+    estimates = _row_estimates()
+    return {"status": "ok", "users": estimates.get("users"), "estimates": estimates}
+
+
+@router.get("/health/pool")
+def pool_health():
+    # Métricas del pool de conexiones (checked-out, overflow, espera) y lag de réplicas
+    return {**get_pool_stats(), "replicas": get_replica_status()}
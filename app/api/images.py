@@ -0,0 +1,57 @@
+# app/api/images.py
+"""
+GET /images/<clave>: URL estable de una imagen guardada por contenido
+(fotos_chat/, foto_planta/, marketplace_items/).
+
+- Backend GCS: redirige (307) a la URL firmada cacheada de
+  app/services/image_urls.py. El navegador guarda la redirección como mucho
+  REFRESH_MARGIN_SECONDS, lo que le queda de vida mínima a la URL.
+- Backend local: sirve el archivo. La clave es el sha256 del contenido, así
+  que la respuesta no cambia nunca y se cachea como inmutable.
+
+La clave (sha256) no se puede adivinar sin tener la imagen, igual que la
+URL firmada que sustituye.
+"""
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, RedirectResponse
+
+from app.db import models
+from app.db.session import read_session_scope
+from app.services.image_urls import REFRESH_MARGIN_SECONDS, read_url
+from app.services.storage import CHAT_IMAGES, MARKETPLACE_IMAGES, PLANT_IMAGES
+from app.services.storage_backends import LocalBackend, get_backend
+
+router = APIRouter()
+
+IMAGE_FOLDERS = (CHAT_IMAGES, PLANT_IMAGES, MARKETPLACE_IMAGES)
+
+
+@router.get("/{key:path}")
+def get_image(key: str, request: Request):
+    if key.split("/", 1)[0] not in IMAGE_FOLDERS:
+        raise HTTPException(status_code=404, detail="Image not found")
+    backend = get_backend()
+    if not isinstance(backend, LocalBackend):
+        return RedirectResponse(
+            read_url(backend.uri(key)),
+            headers={"Cache-Control": f"private, max-age={REFRESH_MARGIN_SECONDS}"},
+        )
+
+    try:
+        path = backend.path(key)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Image not found")
+    # Solo el backend local toca la base; la redirección a GCS no abre sesión
+    with read_session_scope(request) as db:
+        content_type = (
+            db.query(models.StoredObject.content_type)
+            .filter(models.StoredObject.key == key)
+            .scalar()
+        )
+    return FileResponse(
+        path,
+        media_type=content_type or "application/octet-stream",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
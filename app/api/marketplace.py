@@ -1,7 +1,9 @@
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query, File, UploadFile
 from sqlalchemy.orm import Session
-from app.db.session import get_db
+from starlette.concurrency import run_in_threadpool
+from app.core.responses import list_response
+from app.db.session import get_db, get_read_db
 from app.schemas.marketplace import (
     MarketplaceItemCreate,
     MarketplaceItemResponse,
@@ -10,11 +12,24 @@ from app.schemas.marketplace import (
     ItemRequestCreate,
     ItemRequestResponse
 )
+from app.services.image_urls import read_urls
 from app.services.marketplace import MarketplaceService
-from app.services.storage import upload_marketplace_item_image
+from app.services.storage import release_uris, upload_marketplace_item_image
 
 router = APIRouter()
 
+
+def _items_out(items) -> List[MarketplaceItemResponse]:
+    """image_url guardada (gs://) -> URL firmada de lectura, en un lote."""
+    urls = read_urls(item.image_url for item in items)
+    out = []
+    for item in items:
+        response = MarketplaceItemResponse.model_validate(item)
+        response.image_url = urls.get(item.image_url)
+        out.append(response)
+    return out
+
+
 # --- Items ---
 
 @router.get("/items", response_model=List[MarketplaceItemResponse])
@@ -22,16 +37,17 @@ def list_items(
     skip: int = 0,
     limit: int = 100,
     category: Optional[str] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    return MarketplaceService.get_items(db, skip=skip, limit=limit, category=category)
+    items = MarketplaceService.get_items(db, skip=skip, limit=limit, category=category)
+    return list_response(MarketplaceItemResponse, _items_out(items))
 
 @router.post("/items", response_model=MarketplaceItemResponse)
 def create_item(
     item: MarketplaceItemCreate,
     db: Session = Depends(get_db)
 ):
-    return MarketplaceService.create_item(db, item)
+    return _items_out([MarketplaceService.create_item(db, item)])[0]
 
 @router.post("/items/{item_id}/image", response_model=MarketplaceItemResponse)
 async def upload_item_image(
@@ -52,18 +68,22 @@ async def upload_item_image(
     data = await file.read()
     content_type = file.content_type or "image/jpeg"
 
-    gcs_uri = upload_marketplace_item_image(
+    gcs_uri = await run_in_threadpool(
+        upload_marketplace_item_image,
         data=data,
         content_type=content_type,
         item_id=item.id,
     )
 
+    # Como en plants: la referencia que se suelta es la de la imagen anterior
+    # (la duplicada si se vuelve a subir la misma foto)
+    release_uris(db, [item.image_url])
     item.image_url = gcs_uri
     db.add(item)
     db.commit()
     db.refresh(item)
 
-    return item
+    return _items_out([item])[0]
 
 # --- Orders ---
 
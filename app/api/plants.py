@@ -1,13 +1,19 @@
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File
 from pydantic import BaseModel, ConfigDict
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from app.db.session import get_db
+from app.api.deps import CurrentUser, optional_current_user, resolve_user_id
+from app.core.responses import list_response
+from app.db.session import get_db, get_read_db, mark_written
 from app.db import models
-from app.services.storage import upload_plant_image  # NUEVO
+from app.services.care_tasks import complete_task, drop_care_tasks, due_tasks
+from app.services.image_urls import read_url, read_urls
+from app.services.plants import latest_care_plans, list_active_plants
+from app.services.storage import release_uris, retain_uris, upload_plant_image  # NUEVO
 
 router = APIRouter()
 
@@ -54,11 +60,19 @@ class PlantOut(BaseModel):
     temperature: Optional[str]
     notes: Optional[str]
     image_gcs_uri: Optional[str]  # NUEVO
+    # URL firmada (de corta duración) de image_gcs_uri para mostrarla
+    image_url: Optional[str] = None
     status: str
     source: str
     created_at: datetime
 
 
+def _plant_out(plant: models.Plant) -> PlantOut:
+    out = PlantOut.model_validate(plant)
+    out.image_url = read_url(plant.image_gcs_uri)
+    return out
+
+
 # NUEVO: esquema para responder el plan
 class CarePlanOut(BaseModel):
     model_config = ConfigDict(from_attributes=True)
@@ -69,32 +83,87 @@ class CarePlanOut(BaseModel):
     plan_json: dict
 
 
+class CareTaskOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    id: int
+    plant_id: int
+    plant_name: str
+    plant_nickname: Optional[str] = None
+    kind: str
+    frequency_text: str
+    interval_hours: int
+    next_due_at: datetime
+    last_done_at: Optional[datetime] = None
+
+
 # -------- Endpoints --------
 @router.post("/", response_model=PlantOut)
 def create_plant(payload: PlantCreate, db: Session = Depends(get_db)):
     plant = models.Plant(**payload.dict())
+    retain_uris(db, [plant.image_gcs_uri])
     db.add(plant)
+    db.flush()
+    mark_written(db, user_id=plant.user_id, plant_id=plant.id)
     db.commit()
     db.refresh(plant)
-    return plant
+    return _plant_out(plant)
 
 
 @router.get("/", response_model=List[PlantOut])
-def list_plants(user_id: int, db: Session = Depends(get_db)):
-    q = (
-        db.query(models.Plant)
-        .filter(models.Plant.user_id == user_id, models.Plant.status == "active")
-        .order_by(models.Plant.created_at.desc())
+def list_plants(
+    user_id: Optional[int] = None,
+    user: Optional[CurrentUser] = Depends(optional_current_user),
+    db: Session = Depends(get_read_db),
+):
+    # Con Bearer token el usuario sale del token; user_id queda por compatibilidad
+    owner_id = resolve_user_id(user_id, user)
+    rows = list_active_plants(db, owner_id)
+    # Todas las URLs de la lista en un lote (las ya firmadas salen de caché)
+    urls = read_urls(row.image_gcs_uri for row in rows)
+    return list_response(
+        PlantOut,
+        ({**row._mapping, "image_url": urls.get(row.image_gcs_uri)} for row in rows),
     )
-    return q.all()
+
+
+# Antes de /{plant_id} para que "due-tasks" no se interprete como id
+@router.get("/due-tasks", response_model=List[CareTaskOut])
+def list_due_tasks(
+    user_id: Optional[int] = None,
+    within_hours: int = Query(0, ge=0, le=24 * 30),
+    limit: int = Query(100, ge=1, le=500),
+    user: Optional[CurrentUser] = Depends(optional_current_user),
+    db: Session = Depends(get_read_db),
+):
+    """Riegos y abonados vencidos (o que vencen en las próximas within_hours horas)."""
+    owner_id = resolve_user_id(user_id, user)
+    until = datetime.utcnow() + timedelta(hours=within_hours)
+    return list_response(CareTaskOut, due_tasks(db, owner_id, until, limit))
+
+
+@router.post("/tasks/{task_id}/done", response_model=CareTaskOut)
+def mark_task_done(
+    task_id: int,
+    user_id: Optional[int] = None,
+    user: Optional[CurrentUser] = Depends(optional_current_user),
+    db: Session = Depends(get_db),
+):
+    """Marca la tarea como hecha y la reprograma según su frecuencia."""
+    owner_id = resolve_user_id(user_id, user)
+    row = complete_task(db, owner_id, task_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    mark_written(db, user_id=owner_id, plant_id=row.plant_id)
+    db.commit()
+    return row
 
 
 @router.get("/{plant_id}", response_model=PlantOut)
-def get_plant(plant_id: int, db: Session = Depends(get_db)):
+def get_plant(plant_id: int, db: Session = Depends(get_read_db)):
     plant = db.query(models.Plant).get(plant_id)
     if not plant:
         raise HTTPException(status_code=404, detail="Plant not found")
-    return plant
+    return _plant_out(plant)
 
 
 @router.patch("/{plant_id}", response_model=PlantOut)
@@ -103,12 +172,18 @@ def update_plant(plant_id: int, payload: PlantPatch, db: Session = Depends(get_d
     if not plant:
         raise HTTPException(status_code=404, detail="Plant not found")
     data = payload.dict(exclude_unset=True)
+    if "image_gcs_uri" in data and data["image_gcs_uri"] != plant.image_gcs_uri:
+        retain_uris(db, [data["image_gcs_uri"]])
+        release_uris(db, [plant.image_gcs_uri])
     for k, v in data.items():
         setattr(plant, k, v)
+    if data.get("status", "active") != "active":
+        drop_care_tasks(db, plant.id)
     db.add(plant)
+    mark_written(db, user_id=plant.user_id, plant_id=plant.id)
     db.commit()
     db.refresh(plant)
-    return plant
+    return _plant_out(plant)
 
 
 @router.delete("/{plant_id}")
@@ -117,7 +192,9 @@ def archive_plant(plant_id: int, db: Session = Depends(get_db)):
     if not plant:
         raise HTTPException(status_code=404, detail="Plant not found")
     plant.status = "archived"
+    drop_care_tasks(db, plant.id)
     db.add(plant)
+    mark_written(db, user_id=plant.user_id, plant_id=plant.id)
     db.commit()
     return {"ok": True}
 
@@ -140,36 +217,36 @@ async def upload_plant_photo(
     data = await file.read()
     content_type = file.content_type or "image/jpeg"
 
-    gcs_uri = upload_plant_image(
+    # store_image hace red y base de forma síncrona: fuera del event loop
+    gcs_uri = await run_in_threadpool(
+        upload_plant_image,
         data=data,
         content_type=content_type,
         user_id=plant.user_id,
         plant_id=plant.id,
     )
 
+    # store_image ya sumó la referencia de gcs_uri: se suelta la de la imagen
+    # anterior, que si es la misma foto es la referencia duplicada
+    release_uris(db, [plant.image_gcs_uri])
     plant.image_gcs_uri = gcs_uri
     db.add(plant)
+    mark_written(db, user_id=plant.user_id, plant_id=plant.id)
     db.commit()
     db.refresh(plant)
 
-    return plant
+    return _plant_out(plant)
 
 
 # NUEVO: último CarePlan de la planta
 @router.get("/{plant_id}/care-plan", response_model=Optional[CarePlanOut])
-def get_latest_care_plan(plant_id: int, db: Session = Depends(get_db)):
+def get_latest_care_plan(plant_id: int, db: Session = Depends(get_read_db)):
     """
     Devuelve el plan de cuidado más reciente para la planta.
     Si no hay plan, devuelve null (200 con body null).
     """
-    plant = db.query(models.Plant).get(plant_id)
-    if not plant:
+    exists = db.query(models.Plant.id).filter(models.Plant.id == plant_id).first()
+    if not exists:
         raise HTTPException(status_code=404, detail="Plant not found")
 
-    cp = (
-        db.query(models.CarePlan)
-        .filter(models.CarePlan.plant_id == plant_id)
-        .order_by(models.CarePlan.created_at.desc())
-        .first()
-    )
-    return cp
+    return latest_care_plans(db, [plant_id]).get(plant_id)
@@ -1,12 +1,30 @@
 # app/core/config.py
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
+class VertexStage(BaseModel):
+    """Modelo y generación de una etapa del chat; None = valor por defecto de la etapa."""
+    model: str | None = None
+    temperature: float | None = None
+    max_output_tokens: int | None = None
+    response_mime_type: str | None = None
+
+
 class Settings(BaseSettings):
     # Proyecto y Vertex AI
     project_id: str
     vertex_location: str
     vertex_model_name: str
+    # Por etapa (analysis, reply, identify, care_plan): modelo y generation config.
+    # Solo lo que cambie respecto a los valores por defecto de app/core/vertex_client.py, p. ej.
+    # VERTEX_STAGES='{"analysis": {"model": "gemini-2.0-flash-lite", "max_output_tokens": 512}}'
+    vertex_stages: dict[str, VertexStage] = {}
+    # Caché de contexto para las instrucciones fijas de cada etapa (app/core/vertex_cache.py)
+    vertex_context_cache_enabled: bool = True
+    vertex_context_cache_ttl_seconds: int = 3600
+    # Por debajo de este tamaño (tokens estimados) Vertex no acepta crear la caché
+    vertex_context_cache_min_tokens: int = 4096
 
     # Cloud SQL (para Cloud Run)
     instance_connection_name: str | None = None
@@ -15,9 +33,50 @@ class Settings(BaseSettings):
     region: str | None = None
     gcs_bucket: str | None = None
 
+    # Chat: un turno a la vez por sesión
+    chat_turn_lease_seconds: int = 120  # máx. que un turno puede tener la sesión tomada
+    chat_turn_wait_seconds: float = 30  # espera máxima por el turno anterior antes de 409
+    # Antigüedad a partir de la cual python -m app.services.chat_turns --purge-idempotency borra claves
+    chat_idempotency_ttl_hours: int = 24
+
+    # Límites de uso de los endpoints con LLM ("N/second|minute|hour|day").
+    # Cada límite se aplica por user_id y, multiplicado por
+    # rate_limit_ip_multiplier, por IP del cliente.
+    rate_limit_enabled: bool = True
+    rate_limit_chat: str = "20/minute"
+    rate_limit_identify: str = "5/minute"  # /chat/message con imágenes
+    rate_limit_care_plan: str = "10/hour"  # planes de cuidado generados
+    rate_limit_upload: str = "30/minute"  # imágenes subidas a /chat/upload-images
+    rate_limit_ip_multiplier: float = 3.0
+    # Proxies de confianza que añaden X-Forwarded-For (Cloud Run: 1). 0 = usar la IP del socket.
+    rate_limit_proxy_hops: int = 0
+    # Backend compartido entre instancias (redis://...). Sin él, estado en memoria por proceso.
+    rate_limit_redis_url: str | None = None
+    # Tokens de Gemini (prompt + salida) por usuario y día UTC. 0 = sin límite.
+    llm_daily_token_budget: int = 200_000
+
+    # Imágenes: "gcs" (gcs_bucket) o "local" (directorio storage_local_root, para pruebas sin red)
+    storage_backend: str = "gcs"
+    storage_local_root: str = ".storage"
+    # Objetos sin referencias se borran pasado este tiempo (python -m app.services.storage --sweep)
+    storage_sweep_grace_seconds: float = 3600
+    # URLs firmadas de lectura (V4, máx. 7 días) y cuántas se guardan en memoria por proceso
+    image_url_ttl_seconds: int = 3600
+    image_url_cache_size: int = 10_000
+
+    # Cada cuánto se refrescan las estimaciones de filas de /health (pg_class.reltuples)
+    health_stats_ttl_seconds: float = 60
+
+    # Respuestas más pequeñas que esto no se comprimen (gzip / brotli)
+    response_compression_min_bytes: int = 1024
+
     # Auth sencilla
     auth_secret: str = "change_me"
     password_salt: str = "change_me"
+    auth_claims_cache_size: int = 10_000  # tokens verificados en memoria (LRU)
+    auth_user_cache_seconds: float = 60  # TTL del usuario autenticado en memoria
+    auth_kdf_workers: int = 0  # procesos para scrypt (0 = uno por CPU)
+    auth_kdf_max_pending: int = 64  # hashes en vuelo por proceso antes de esperar turno
 
     # Configuración de Pydantic Settings
     model_config = SettingsConfigDict(
@@ -0,0 +1,261 @@
+# app/core/metrics.py
+"""
+Métricas Prometheus (/metrics) y trazas OpenTelemetry.
+
+Histogramas:
+- http_request_seconds{method, route, status}
+- chat_stage_seconds{stage}: etapas de POST /chat/message (inbound, analysis,
+  plant_lookup, care_plan, reply, outbound)
+- vertex_request_seconds{call, outcome} y vertex_tokens_total{call, kind}
+  (prompt / candidates / cached, de response.usage_metadata)
+- db_query_seconds{engine, statement} y db_pool_wait_seconds
+- gcs_upload_seconds{kind, outcome} y gcs_upload_bytes{kind}
+
+Trazas: solo si está instalado opentelemetry-sdk + exporter OTLP y hay
+OTEL_EXPORTER_OTLP_ENDPOINT (o OTEL_EXPORTER_OTLP_TRACES_ENDPOINT). El resto de
+opciones (OTEL_SERVICE_NAME, headers, ...) las lee el SDK del entorno. Para un
+collector local:
+    OTEL_EXPORTER_OTLP_ENDPOINT=http://localhost:4318
+
+Con varios workers de uvicorn, definir PROMETHEUS_MULTIPROC_DIR (directorio
+vacío y escribible) para que /metrics agregue todos los procesos.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from fastapi import Request
+from fastapi.responses import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Latencias de API/DB (ms a segundos) y de LLM (segundos a decenas de segundos)
+_FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+_SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "Duración de las peticiones HTTP",
+    ["method", "route", "status"], buckets=_SLOW_BUCKETS,
+)
+CHAT_STAGE_SECONDS = Histogram(
+    "chat_stage_seconds", "Duración de cada etapa de un turno de chat",
+    ["stage"], buckets=_SLOW_BUCKETS,
+)
+VERTEX_REQUEST_SECONDS = Histogram(
+    "vertex_request_seconds", "Duración de las llamadas a Gemini",
+    ["call", "model", "outcome"], buckets=_SLOW_BUCKETS,
+)
+VERTEX_TOKENS = Counter(
+    "vertex_tokens", "Tokens consumidos en Gemini (usage_metadata)",
+    ["call", "model", "kind"],
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds", "Duración de las sentencias SQL",
+    ["engine", "statement"], buckets=_FAST_BUCKETS,
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "db_pool_wait_seconds", "Espera por una conexión libre del pool",
+    buckets=_FAST_BUCKETS,
+)
+GCS_UPLOAD_SECONDS = Histogram(
+    "gcs_upload_seconds", "Duración de las subidas a Cloud Storage",
+    ["kind", "outcome"], buckets=_SLOW_BUCKETS,
+)
+GCS_UPLOAD_BYTES = Histogram(
+    "gcs_upload_bytes", "Tamaño de las subidas a Cloud Storage",
+    ["kind"], buckets=(16e3, 64e3, 256e3, 1e6, 4e6, 16e6),
+)
+STORAGE_DEDUP = Counter(
+    "storage_dedup", "Subidas de imágenes evitadas porque el mismo contenido ya estaba guardado",
+    ["kind"],
+)
+SINGLE_FLIGHT_SHARED = Counter(
+    "single_flight_shared", "Llamadas que esperaron el resultado de una idéntica en curso",
+    ["name"],
+)
+
+
+# --------- Trazas (opcional) ---------
+_tracer = None
+
+
+def setup_tracing() -> None:
+    """Activa el exportador OTLP si hay endpoint configurado y el SDK está instalado."""
+    global _tracer
+    if _tracer is not None:
+        return
+    if not (os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT") or os.getenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT")):
+        return
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logger.warning("OTEL_EXPORTER_OTLP_ENDPOINT definido pero opentelemetry-sdk no está instalado")
+        return
+
+    service_name = os.getenv("OTEL_SERVICE_NAME", "plant-care-backend")
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("app")
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Span de OpenTelemetry; no hace nada si las trazas no están activas."""
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.start_as_current_span(
+        name, attributes={k: v for k, v in attributes.items() if v is not None}
+    ) as current:
+        yield current
+
+
+@contextmanager
+def chat_stage(stage: str):
+    """Mide una etapa del turno de chat (histograma + span)."""
+    start = time.perf_counter()
+    try:
+        with span(f"chat.{stage}"):
+            yield
+    finally:
+        CHAT_STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+# --------- Vertex ---------
+_TOKEN_FIELDS = (
+    ("prompt", "prompt_token_count"),
+    ("candidates", "candidates_token_count"),
+    ("cached", "cached_content_token_count"),
+)
+
+
+def observe_vertex(call: str, seconds: float, response=None, current_span=None, model: str = "") -> None:
+    """Registra duración y tokens de una llamada (etapa + modelo); response=None indica error."""
+    VERTEX_REQUEST_SECONDS.labels(call, model, "ok" if response is not None else "error").observe(seconds)
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    for kind, field in _TOKEN_FIELDS:
+        count = getattr(usage, field, 0) or 0
+        if count:
+            VERTEX_TOKENS.labels(call, model, kind).inc(count)
+        if current_span is not None:
+            current_span.set_attribute(f"gen_ai.usage.{kind}_tokens", count)
+
+
+# --------- Base de datos ---------
+def _statement_kind(statement: str) -> str:
+    word = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return word if word in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH") else "OTHER"
+
+
+def instrument_engine(engine: Engine, name: str = "primary") -> None:
+    """Histograma (y span, si hay trazas) por sentencia SQL ejecutada en `engine`."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        query_span = None
+        if _tracer is not None:
+            query_span = _tracer.start_span(
+                "db.query",
+                attributes={"db.system": "postgresql", "db.statement": statement[:500]},
+            )
+        conn.info.setdefault("_metrics_query", []).append((time.perf_counter(), query_span))
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        _finish_query(conn, name, statement)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        if conn is not None:
+            _finish_query(conn, name, exception_context.statement or "")
+
+
+def _finish_query(conn, engine_name: str, statement: str) -> None:
+    stack = conn.info.get("_metrics_query")
+    if not stack:
+        return
+    start, query_span = stack.pop()
+    DB_QUERY_SECONDS.labels(engine_name, _statement_kind(statement)).observe(
+        time.perf_counter() - start
+    )
+    if query_span is not None:
+        query_span.end()
+
+
+# --------- Cloud Storage ---------
+@contextmanager
+def gcs_upload(kind: str, size: int):
+    """Mide una subida a GCS (duración, tamaño y span)."""
+    GCS_UPLOAD_BYTES.labels(kind).observe(size)
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        with span("gcs.upload", **{"gcs.kind": kind, "gcs.bytes": size}):
+            yield
+        outcome = "ok"
+    finally:
+        GCS_UPLOAD_SECONDS.labels(kind, outcome).observe(time.perf_counter() - start)
+
+
+# --------- HTTP ---------
+async def http_metrics_middleware(request: Request, call_next):
+    """Span raíz por petición + http_request_seconds con la plantilla de ruta."""
+    start = time.perf_counter()
+    status = 500
+    with span(f"{request.method} {request.url.path}", **{"http.method": request.method}) as current:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            if current is not None:
+                current.update_name(f"{request.method} {route_path}")
+                current.set_attribute("http.route", route_path)
+                current.set_attribute("http.status_code", status)
+            HTTP_REQUEST_SECONDS.labels(request.method, route_path, str(status)).observe(
+                time.perf_counter() - start
+            )
+
+
+def metrics_response() -> Response:
+    """Exposición en formato Prometheus (agrega workers si hay PROMETHEUS_MULTIPROC_DIR)."""
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+def _pool_checked_out() -> float:
+    from app.db.session import get_pool_stats
+
+    return get_pool_stats()["checked_out"]
+
+
+# Gauge con función: no se soporta en modo multiproceso
+if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    Gauge("db_pool_checked_out", "Conexiones del pool en uso").set_function(_pool_checked_out)
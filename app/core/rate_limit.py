@@ -0,0 +1,183 @@
+# app/core/rate_limit.py
+"""
+Rate limiting con token buckets para los endpoints que llaman a Gemini o
+suben imágenes.
+
+Cada ámbito (chat, identify, care_plan, upload) tiene un bucket por user_id y otro por
+IP; una petición solo consume si todos sus buckets tienen saldo, y si no se
+lanza RateLimited con los segundos hasta que lo haya (main.py lo convierte en
+429 + Retry-After).
+
+El estado vive en memoria del proceso (OrderedDict acotado, un lock). Con
+RATE_LIMIT_REDIS_URL se comparte entre instancias mediante un script Lua
+atómico; si Redis falla se vuelve al bucket en memoria.
+"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+from fastapi import Request
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+class RateLimited(Exception):
+    """Se superó un límite; retry_after en segundos."""
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(scope, retry_after)
+        self.scope = scope
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def parse_limit(spec: str) -> Tuple[float, float]:
+    """'20/minute' -> (capacidad 20, recarga 20/60 tokens por segundo)."""
+    count, _, period = spec.partition("/")
+    seconds = _PERIODS[period.strip().lower().rstrip("s")]
+    capacity = float(count)
+    return capacity, capacity / seconds
+
+
+# (clave, capacidad, recarga por segundo)
+Limit = Tuple[str, float, float]
+
+
+class _MemoryBuckets:
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, limits: Sequence[Limit], cost: float = 1) -> float:
+        """0 si se consumió en todos los buckets; si no, segundos a esperar (no consume nada)."""
+        now = time.monotonic()
+        with self._lock:
+            wait = 0.0
+            levels = []
+            for key, capacity, rate in limits:
+                tokens, updated = self._buckets.get(key, (capacity, now))
+                tokens = min(capacity, tokens + (now - updated) * rate)
+                if tokens < cost:
+                    wait = max(wait, (cost - tokens) / rate)
+                levels.append((key, tokens))
+            if wait:
+                return wait
+            for key, tokens in levels:
+                self._buckets[key] = (tokens - cost, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return 0.0
+
+
+# KEYS: buckets; ARGV: coste, luego capacidad y recarga de cada key
+_REDIS_TAKE = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local cost = tonumber(ARGV[1])
+local wait = 0
+local levels = {}
+for i, key in ipairs(KEYS) do
+  local capacity = tonumber(ARGV[i * 2])
+  local rate = tonumber(ARGV[i * 2 + 1])
+  local b = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(b[1]) or capacity
+  local ts = tonumber(b[2]) or now
+  tokens = math.min(capacity, tokens + (now - ts) * rate)
+  if tokens < cost then wait = math.max(wait, (cost - tokens) / rate) end
+  levels[i] = tokens
+end
+if wait > 0 then return tostring(wait) end
+for i, key in ipairs(KEYS) do
+  local capacity = tonumber(ARGV[i * 2])
+  local rate = tonumber(ARGV[i * 2 + 1])
+  redis.call('HSET', key, 'tokens', levels[i] - cost, 'ts', now)
+  redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+end
+return '0'
+"""
+
+
+class _RedisBuckets:
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self._client = redis.from_url(url)
+        self._script = self._client.register_script(_REDIS_TAKE)
+
+    async def take(self, limits: Sequence[Limit], cost: float = 1) -> float:
+        args: list = [cost]
+        for _, capacity, rate in limits:
+            args += [capacity, rate]
+        keys = [f"ratelimit:{key}" for key, _, _ in limits]
+        return float(await self._script(keys=keys, args=args))
+
+
+class RateLimiter:
+    def __init__(self):
+        self._memory = _MemoryBuckets()
+        self._redis: Optional[_RedisBuckets] = None
+        if settings.rate_limit_redis_url:
+            try:
+                self._redis = _RedisBuckets(settings.rate_limit_redis_url)
+            except ImportError:
+                logger.warning("RATE_LIMIT_REDIS_URL definido pero falta el paquete redis; límites en memoria")
+
+    def _limits(self, scope: str, user_id: Optional[int], client_ip: Optional[str]) -> List[Limit]:
+        capacity, rate = parse_limit(getattr(settings, f"rate_limit_{scope}"))
+        limits = []
+        if user_id is not None:
+            limits.append((f"{scope}:user:{user_id}", capacity, rate))
+        if client_ip:
+            factor = settings.rate_limit_ip_multiplier
+            limits.append((f"{scope}:ip:{client_ip}", capacity * factor, rate * factor))
+        return limits
+
+    async def hit(
+        self,
+        scope: str,
+        user_id: Optional[int],
+        client_ip: Optional[str],
+        cost: float = 1,
+    ) -> None:
+        """Consume `cost` en los buckets del ámbito o lanza RateLimited."""
+        if not settings.rate_limit_enabled:
+            return
+        limits = self._limits(scope, user_id, client_ip)
+        if not limits:
+            return
+        wait = None
+        if self._redis is not None:
+            try:
+                wait = await self._redis.take(limits, cost)
+            except Exception:
+                logger.warning("Redis de rate limiting no disponible; usando memoria", exc_info=True)
+        if wait is None:
+            wait = self._memory.take(limits, cost)
+        if wait > 0:
+            raise RateLimited(scope, wait)
+
+
+def client_ip(request: Request) -> Optional[str]:
+    """IP del cliente; con rate_limit_proxy_hops > 0 se toma de X-Forwarded-For."""
+    hops = settings.rate_limit_proxy_hops
+    forwarded = request.headers.get("x-forwarded-for")
+    if hops > 0 and forwarded:
+        chain = [h.strip() for h in forwarded.split(",") if h.strip()]
+        if chain:
+            return chain[max(0, len(chain) - hops)]
+    return request.client.host if request.client else None
+
+
+limiter = RateLimiter()
@@ -0,0 +1,27 @@
+# app/core/responses.py
+"""
+Serialización JSON de respuestas grandes.
+
+FastAPI, con response_model, valida el valor, lo pasa a dict (model_dump),
+luego por jsonable_encoder y al final a json.dumps. Para listados largos
+list_response() hace validación y serialización en el núcleo de Pydantic v2
+(TypeAdapter.dump_json) y devuelve los bytes tal cual. El response_model del
+endpoint se mantiene para la documentación OpenAPI.
+"""
+from functools import lru_cache
+from typing import Any, Iterable, List, Type
+
+from fastapi.responses import Response
+from pydantic import BaseModel, TypeAdapter
+
+
+@lru_cache(maxsize=None)
+def _list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+
+def list_response(model: Type[BaseModel], items: Iterable[Any]) -> Response:
+    """Lista de ORM/Row/dicts -> JSON con el esquema de `model`, sin doble codificación."""
+    adapter = _list_adapter(model)
+    validated = adapter.validate_python(list(items), from_attributes=True)
+    return Response(adapter.dump_json(validated), media_type="application/json")
@@ -1,21 +1,112 @@
+import asyncio
+import base64
 import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from typing import Optional
 import jwt
 
 from app.core.config import settings
 
 
-def hash_password(password: str) -> str:
-    """
-    Hash muy simple con SHA256 + salt.
-    No es producción, pero suficiente para este proyecto.
-    """
+# --------- Contraseñas ---------
+# Formato actual: "scrypt$<n>$<r>$<p>$<salt b64>$<hash b64>" (hashlib.scrypt,
+# memory-hard). Formato antiguo: sha256(password + PASSWORD_SALT) en hex; se
+# sigue aceptando y se re-hashea al iniciar sesión (needs_rehash).
+#
+# scrypt cuesta decenas de ms de CPU: en los endpoints se usa la versión
+# async, que lo ejecuta en un ProcessPoolExecutor acotado (no bloquea el
+# event loop ni acapara el threadpool, y no compite por el GIL).
+_SCRYPT_N = 2 ** 14
+_SCRYPT_R = 8
+_SCRYPT_P = 1
+_SCRYPT_DKLEN = 32
+
+
+def _legacy_hash(password: str) -> str:
     salted = password + settings.password_salt
     return hashlib.sha256(salted.encode("utf-8")).hexdigest()
 
 
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int, dklen: int = _SCRYPT_DKLEN) -> bytes:
+    return hashlib.scrypt(
+        password.encode("utf-8"), salt=salt, n=n, r=r, p=p, dklen=dklen,
+        maxmem=256 * n * r,
+    )
+
+
+def hash_password(password: str) -> str:
+    """Hash scrypt con salt aleatorio (síncrono; en endpoints usar hash_password_async)."""
+    salt = os.urandom(16)
+    digest = _scrypt(password, salt, _SCRYPT_N, _SCRYPT_R, _SCRYPT_P)
+    return "$".join((
+        "scrypt", str(_SCRYPT_N), str(_SCRYPT_R), str(_SCRYPT_P),
+        base64.b64encode(salt).decode("ascii"), base64.b64encode(digest).decode("ascii"),
+    ))
+
+
 def verify_password(password: str, password_hash: str) -> bool:
-    return hash_password(password) == password_hash
+    if not password_hash.startswith("scrypt$"):
+        return hmac.compare_digest(_legacy_hash(password), password_hash)
+    try:
+        _, n, r, p, salt, digest = password_hash.split("$")
+        expected = base64.b64decode(digest)
+        actual = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p), len(expected))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """True si el hash es del formato antiguo o con parámetros distintos a los actuales."""
+    return not password_hash.startswith(f"scrypt${_SCRYPT_N}${_SCRYPT_R}${_SCRYPT_P}$")
+
+
+_kdf_pool: Optional[ProcessPoolExecutor] = None
+_kdf_pool_lock = threading.Lock()
+_kdf_slots: Optional[asyncio.Semaphore] = None
+
+
+def _get_kdf_pool() -> ProcessPoolExecutor:
+    """
+    Pool creado en el primer hash. Con "spawn": al crearlo el proceso ya tiene
+    hilos y pools de conexiones, y un fork podría heredar locks tomados.
+    """
+    global _kdf_pool
+    if _kdf_pool is None:
+        with _kdf_pool_lock:
+            if _kdf_pool is None:
+                _kdf_pool = ProcessPoolExecutor(
+                    max_workers=settings.auth_kdf_workers or os.cpu_count(),
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _kdf_pool
+
+
+async def _run_kdf(fn, *args):
+    """Ejecuta fn en el pool; como mucho auth_kdf_max_pending trabajos en cola por proceso."""
+    global _kdf_slots
+    if _kdf_slots is None:
+        _kdf_slots = asyncio.Semaphore(settings.auth_kdf_max_pending)
+    async with _kdf_slots:
+        return await asyncio.get_running_loop().run_in_executor(_get_kdf_pool(), fn, *args)
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_kdf(hash_password, password)
+
+
+async def verify_password_async(password: str, password_hash: str) -> bool:
+    if not password_hash.startswith("scrypt$"):
+        # Formato antiguo: un SHA-256, no compensa el viaje al pool
+        return verify_password(password, password_hash)
+    return await _run_kdf(verify_password, password, password_hash)
 
 
 def create_access_token(user_id: int, expires_minutes: int = 60 * 24) -> str:
@@ -30,3 +121,45 @@ def create_access_token(user_id: int, expires_minutes: int = 60 * 24) -> str:
     }
     token = jwt.encode(payload, settings.auth_secret, algorithm="HS256")
     return token
+
+
+# --------- Verificación de tokens ---------
+# Claims ya verificados, por hash del token, hasta su exp. Así una petición
+# autenticada no repite el HMAC ni el parseo del JWT.
+_claims_cache: "OrderedDict[str, tuple[dict, float]]" = OrderedDict()
+_claims_lock = threading.Lock()
+
+
+class InvalidToken(Exception):
+    """Token ausente, mal formado, con firma inválida o caducado."""
+
+
+def decode_access_token(token: str) -> dict:
+    """Devuelve los claims de un token válido (con caché LRU) o lanza InvalidToken."""
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    now = time.time()
+    with _claims_lock:
+        cached = _claims_cache.get(key)
+        if cached is not None:
+            claims, exp = cached
+            if exp > now:
+                _claims_cache.move_to_end(key)
+                return claims
+            del _claims_cache[key]
+
+    try:
+        claims = jwt.decode(
+            token,
+            settings.auth_secret,
+            algorithms=["HS256"],
+            options={"require": ["exp", "sub"]},
+        )
+        int(claims["sub"])
+    except (jwt.InvalidTokenError, ValueError) as exc:
+        raise InvalidToken(str(exc)) from exc
+
+    with _claims_lock:
+        _claims_cache[key] = (claims, float(claims["exp"]))
+        while len(_claims_cache) > settings.auth_claims_cache_size:
+            _claims_cache.popitem(last=False)
+    return claims
@@ -0,0 +1,46 @@
+# app/core/single_flight.py
+"""
+Single-flight: llamadas concurrentes con la misma clave comparten una sola
+ejecución y reciben el mismo resultado (o la misma excepción). No es una
+caché: en cuanto la ejecución termina, la siguiente llamada vuelve a ejecutar.
+
+SingleFlight es para corrutinas (un event loop por proceso). La ejecución
+corre en una Task propia; si quien la inició se cancela (cliente que se
+desconecta) el resto sigue esperando el resultado.
+
+Solo coalesce dentro del proceso; entre instancias hace falta un guard en la
+base (ver services.care_plans.find_care_plan_locked).
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+from app.core import metrics
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            # La Task copia el contexto de quien la crea (track_usage, spans)
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+        else:
+            metrics.SINGLE_FLIGHT_SHARED.labels(self.name).inc()
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # evita "Task exception was never retrieved" si nadie esperaba ya
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
@@ -0,0 +1,144 @@
+# app/core/vertex_cache.py
+"""
+Registro de cachés de contexto de Vertex AI (CachedContent) para las
+instrucciones de sistema fijas de cada etapa (análisis, plan, respuesta).
+
+Con una caché, cada llamada manda solo la parte variable del prompt y Vertex
+cobra los tokens cacheados a precio reducido. Por (modelo, instrucciones):
+- se reutiliza una caché existente con el mismo display_name (otras
+  instancias de Cloud Run) o se crea una nueva con TTL
+  vertex_context_cache_ttl_seconds,
+- se le amplía el TTL cuando le queda menos de REFRESH_MARGIN y se sigue usando,
+- si la creación falla (p. ej. instrucciones por debajo del mínimo de tokens
+  que acepta Vertex) se reintenta tras FAILURE_BACKOFF_SECONDS; mientras
+  tanto la llamada va con system_instruction normal.
+
+Instrucciones con menos de vertex_context_cache_min_tokens (estimado) no se
+cachean: Vertex las rechazaría. Aun así van como system_instruction, al
+principio de la petición, donde el caché implícito de Gemini las aprovecha.
+"""
+import hashlib
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+REFRESH_MARGIN_SECONDS = 300
+FAILURE_BACKOFF_SECONDS = 3600
+
+
+def instructions_digest(instructions: str) -> str:
+    return hashlib.sha256(instructions.encode("utf-8")).hexdigest()[:16]
+
+
+def _estimate_tokens(text: str) -> int:
+    # ~4 caracteres por token; basta para decidir si vale la pena intentarlo
+    return len(text) // 4
+
+
+@dataclass
+class _Entry:
+    name: Optional[str] = None  # resource name de la CachedContent
+    expires_at: float = 0.0  # time.time()
+    failed_until: float = 0.0
+
+
+class ContextCacheRegistry:
+    def __init__(self):
+        self._entries: Dict[Tuple[str, str], _Entry] = {}
+        self._locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cacheable(instructions: Optional[str]) -> bool:
+        return bool(
+            settings.vertex_context_cache_enabled
+            and instructions
+            and _estimate_tokens(instructions) >= settings.vertex_context_cache_min_tokens
+        )
+
+    def peek(self, model_name: str, instructions: str) -> Tuple[bool, Optional[str]]:
+        """(resuelto sin E/S, nombre). Si no está resuelto hay que llamar a get() en un hilo."""
+        if not self.cacheable(instructions):
+            return True, None
+        entry = self._entries.get((model_name, instructions_digest(instructions)))
+        now = time.time()
+        if entry is None:
+            return False, None
+        if entry.name and entry.expires_at - now > REFRESH_MARGIN_SECONDS:
+            return True, entry.name
+        if not entry.name and entry.failed_until > now:
+            return True, None
+        return False, None
+
+    def get(self, model_name: str, instructions: str) -> Optional[str]:
+        """Nombre de la caché para (modelo, instrucciones), creándola o renovándola si hace falta."""
+        resolved, name = self.peek(model_name, instructions)
+        if resolved:
+            return name
+        key = (model_name, instructions_digest(instructions))
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        # Una sola creación / renovación por clave; el resto espera y reutiliza
+        with key_lock:
+            resolved, name = self.peek(model_name, instructions)
+            if resolved:
+                return name
+            entry = self._entries.setdefault(key, _Entry())
+            try:
+                if entry.name and entry.expires_at > time.time():
+                    self._refresh(entry)
+                else:
+                    self._attach(entry, model_name, instructions, key[1])
+            except Exception:
+                logger.warning(
+                    "Caché de contexto no disponible para %s (%s); se usa system_instruction",
+                    model_name, key[1], exc_info=True,
+                )
+                entry.name = None
+                entry.failed_until = time.time() + FAILURE_BACKOFF_SECONDS
+            return entry.name
+
+    def invalidate(self, model_name: str, instructions: str) -> None:
+        """Olvida la caché (p. ej. Vertex respondió que ya no existe); la próxima llamada la recrea."""
+        self._entries.pop((model_name, instructions_digest(instructions)), None)
+
+    def _refresh(self, entry: _Entry) -> None:
+        from vertexai.preview import caching
+
+        cached = caching.CachedContent(cached_content_name=entry.name)
+        cached.update(ttl=timedelta(seconds=settings.vertex_context_cache_ttl_seconds))
+        entry.expires_at = time.time() + settings.vertex_context_cache_ttl_seconds
+
+    def _attach(self, entry: _Entry, model_name: str, instructions: str, digest: str) -> None:
+        from vertexai.preview import caching
+
+        display_name = f"plantcare-{digest}"
+        now = time.time()
+        # Otra instancia ya pudo crearla: reutilizar si le queda vida
+        for cached in caching.CachedContent.list():
+            if cached.display_name != display_name or not cached.model_name.endswith(model_name):
+                continue
+            expires_at = cached.expire_time.timestamp()
+            if expires_at - now > REFRESH_MARGIN_SECONDS:
+                entry.name, entry.expires_at = cached.resource_name, expires_at
+                return
+
+        cached = caching.CachedContent.create(
+            model_name=model_name,
+            system_instruction=instructions,
+            ttl=timedelta(seconds=settings.vertex_context_cache_ttl_seconds),
+            display_name=display_name,
+        )
+        entry.name = cached.resource_name
+        entry.expires_at = now + settings.vertex_context_cache_ttl_seconds
+        logger.info("Caché de contexto creada: %s (%s)", entry.name, model_name)
+
+
+registry = ContextCacheRegistry()
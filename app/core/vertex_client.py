@@ -1,26 +1,114 @@
 # app/core/vertex_client.py
+import hashlib
 import json
-from typing import Iterable, List, Optional
-
-import vertexai
-from vertexai.generative_models import GenerativeModel, Part
-from app.core.config import settings
-
-# Init global
-vertexai.init(
-    project=settings.project_id,
-    location=settings.vertex_location,
-)
-model = GenerativeModel(settings.vertex_model_name)
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+from app.core import metrics
+from app.core.config import VertexStage, settings
+from app.core.single_flight import SingleFlight
+from app.core.vertex_cache import instructions_digest, registry as context_caches
+
+if TYPE_CHECKING:
+    from vertexai.generative_models import GenerativeModel
+
+# El SDK de Vertex AI (y todo google-cloud que arrastra) tarda bastante en
+# importarse, así que lo inicializamos en la primera llamada y no al importar
+# el módulo. Así /auth/login o /marketplace/items no pagan ese coste en frío.
+_vertex_ready = False
+_vertex_lock = threading.Lock()
+
+# Un GenerativeModel por (modelo, caché de contexto o instrucciones de sistema).
+# Las instrucciones fijas de cada etapa van como system_instruction o, si son
+# lo bastante grandes, como CachedContent (ver app/core/vertex_cache.py); el
+# prompt de cada llamada lleva solo la parte variable.
+_models: Dict[Tuple[str, Optional[str]], "GenerativeModel"] = {}
+_models_lock = threading.Lock()
+
+
+# Etapas del chat y su configuración por defecto. settings.vertex_stages la
+# sobrescribe campo a campo; sin modelo, la etapa usa settings.vertex_model_name.
+# Clasificar y extraer JSON no necesita el modelo de la respuesta final: con
+# VERTEX_STAGES se puede mandar "analysis" (o "care_plan") a un modelo más rápido.
+# Sin max_output_tokens por defecto: en Gemini 2.5 incluye los tokens de
+# razonamiento y un JSON cortado acabaría en _analysis_defaults(). Si hace
+# falta acotarlo, con VERTEX_STAGES.
+STAGE_DEFAULTS: Dict[str, VertexStage] = {
+    "analysis": VertexStage(temperature=0.0, response_mime_type="application/json"),
+    "care_plan": VertexStage(temperature=0.2, response_mime_type="application/json"),
+    "reply": VertexStage(),
+    "identify": VertexStage(),  # respuesta con imágenes
+}
+
+
+def stage_config(stage: str) -> VertexStage:
+    """Modelo y generation config efectivos de una etapa."""
+    merged = STAGE_DEFAULTS.get(stage, VertexStage()).model_dump(exclude_none=True)
+    override = settings.vertex_stages.get(stage)
+    if override is not None:
+        merged.update(override.model_dump(exclude_none=True))
+    merged.setdefault("model", settings.vertex_model_name)
+    return VertexStage(**merged)
+
+
+def _generation_config(stage: VertexStage) -> Optional[dict]:
+    # generate_content acepta un dict con los campos de GenerationConfig
+    return stage.model_dump(exclude_none=True, exclude={"model"}) or None
+
+
+def _init_vertex() -> None:
+    global _vertex_ready
+    if not _vertex_ready:
+        with _vertex_lock:
+            if not _vertex_ready:
+                import vertexai
+
+                vertexai.init(
+                    project=settings.project_id,
+                    location=settings.vertex_location,
+                )
+                _vertex_ready = True
+
+
+def _new_model(
+    model_name: str,
+    instructions: Optional[str] = None,
+    cached_content: Optional[str] = None,
+) -> "GenerativeModel":
+    from vertexai.generative_models import GenerativeModel
+
+    if cached_content:
+        # Las instrucciones ya están dentro de la caché
+        return GenerativeModel.from_cached_content(cached_content=cached_content)
+    return GenerativeModel(model_name, system_instruction=instructions)
+
+
+def _model_for(model_name: str, instructions: Optional[str], cached: Optional[str]) -> "GenerativeModel":
+    key = (model_name, cached or (instructions_digest(instructions) if instructions else None))
+    model = _models.get(key)
+    if model is None:
+        with _models_lock:
+            model = _models.get(key)
+            if model is None:
+                model = _models[key] = _new_model(model_name, instructions, cached)
+    return model
+
+
+def _resolve_model(model_name: str, instructions: Optional[str]) -> Tuple["GenerativeModel", Optional[str]]:
+    """(modelo, nombre de la caché usada o None). Puede crear / renovar la caché."""
+    _init_vertex()
+    cached = context_caches.get(model_name, instructions) if instructions else None
+    return _model_for(model_name, instructions, cached), cached
 
 
 # -------------------------------------------------
-# 1. Texto plano
+# Utilidades comunes
 # -------------------------------------------------
-def generate_gemini_response(prompt: str) -> str:
-    """Llama a Gemini para generar una respuesta en texto plano (solo prompt de texto)."""
-    response = model.generate_content(prompt)
-
+def _response_text(response) -> str:
+    """Extrae el texto de una respuesta de Gemini (response.text o candidates/parts)."""
     # Intentar usar response.text
     try:
         if getattr(response, "text", None):
@@ -47,28 +135,18 @@ def generate_gemini_response(prompt: str) -> str:
     return "".join(texts)
 
 
-# -------------------------------------------------
-# 2. NUEVO: Texto + imágenes (GCS URIs)
-# -------------------------------------------------
-def generate_gemini_response_with_images(
-    prompt: str,
-    image_gcs_uris: Optional[List[str]] = None,
-) -> str:
+def _image_parts(prompt: str, image_gcs_uris: Optional[List[str]]) -> list:
     """
-    Llama a Gemini con un prompt de texto + hasta N imágenes (por ahora máx 3).
-    Cada imagen se pasa como Part con referencia a GCS:
-      - gs://bucket/path/to/image.jpg
-
-    Úsalo cuando quieras que el modelo tenga en cuenta las fotos del usuario
-    (identificación de planta, manchas en hojas, etc).
+    Construye la lista de parts: primero las imágenes (referencia a GCS,
+    gs://bucket/path/to/image.jpg), luego el texto. Máx 3 imágenes.
     """
+    from vertexai.generative_models import Part
+
     image_gcs_uris = image_gcs_uris or []
     # Por si acaso, limitamos a 3 aquí también
     image_gcs_uris = image_gcs_uris[:3]
 
-    # Construir la lista de parts: primero las imágenes, luego el texto
-    parts: List[Part] = []
-
+    parts = []
     for uri in image_gcs_uris:
         # Part.from_uri crea un part que referencia un archivo en GCS
         parts.append(
@@ -80,53 +158,189 @@ def generate_gemini_response_with_images(
 
     # Por último, el prompt de texto
     parts.append(Part.from_text(prompt))
+    return parts
 
-    response = model.generate_content(parts)
 
-    # Igual que en la función de texto
+async def _resolve_model_async(
+    model_name: str,
+    instructions: Optional[str],
+) -> Tuple["GenerativeModel", Optional[str]]:
+    """
+    Como _resolve_model, pero la inicialización (import + init) y la creación
+    o renovación de cachés van a un hilo; el caso habitual no sale del loop.
+    """
+    if _vertex_ready:
+        resolved, cached = (
+            context_caches.peek(model_name, instructions) if instructions else (True, None)
+        )
+        if resolved:
+            return _model_for(model_name, instructions, cached), cached
+    from starlette.concurrency import run_in_threadpool
+
+    return await run_in_threadpool(_resolve_model, model_name, instructions)
+
+
+def _cache_gone(exc: Exception) -> bool:
+    # La caché expiró o se borró antes de lo previsto (404 / 400 sobre cachedContent)
+    return "cachedcontent" in str(exc).lower().replace("_", "")
+
+
+# -------------------------------------------------
+# Uso por llamada (tokens, latencia, finish_reason)
+# -------------------------------------------------
+# track_usage() junta un registro por cada llamada a Gemini hecha dentro del
+# bloque (incluidas las que corren en la Task del single-flight, que hereda el contexto).
+_usage_records: ContextVar[Optional[list]] = ContextVar("vertex_usage_records", default=None)
+
+
+@contextmanager
+def track_usage():
+    records: list = []
+    token = _usage_records.set(records)
     try:
-        if getattr(response, "text", None):
-            return response.text
-    except Exception:
-        pass
+        yield records
+    finally:
+        _usage_records.reset(token)
+
+
+def _usage_record(call: str, model: str, seconds: float, response) -> dict:
+    usage = getattr(response, "usage_metadata", None)
+    candidates = getattr(response, "candidates", None) or []
+    finish_reason = getattr(candidates[0], "finish_reason", None) if candidates else None
+    cached_tokens = int(getattr(usage, "cached_content_token_count", 0) or 0)
+    return {
+        "call": call,
+        "model": model,
+        "prompt_tokens": int(getattr(usage, "prompt_token_count", 0) or 0),
+        "output_tokens": int(getattr(usage, "candidates_token_count", 0) or 0),
+        "cached_tokens": cached_tokens,
+        "latency_ms": round(seconds * 1000, 1),
+        "finish_reason": getattr(finish_reason, "name", None) or (
+            str(finish_reason) if finish_reason is not None else None
+        ),
+        "cache_hit": cached_tokens > 0,
+    }
 
-    if not response.candidates:
-        raise ValueError("La respuesta de Vertex AI no contiene candidatos.")
 
-    candidate = response.candidates[0]
-    cparts = getattr(candidate.content, "parts", []) or []
+def _observe(call: str, model: str, seconds: float, response, current_span) -> None:
+    metrics.observe_vertex(call, seconds, response, current_span, model=model)
+    records = _usage_records.get()
+    if records is not None:
+        records.append(_usage_record(call, model, seconds, response))
 
-    texts = []
-    for p in cparts:
-        text = getattr(p, "text", None)
-        if text:
-            texts.append(text)
 
-    if not texts:
-        raise ValueError("No se encontraron partes de texto en la respuesta de Vertex AI.")
+async def _generate_async(contents, call: str, instructions: Optional[str] = None):
+    """
+    generate_content_async con el modelo y la generation config de la etapa
+    `call`, métricas (latencia, tokens) y span por llamada.
+    """
+    stage = stage_config(call)
+    config = _generation_config(stage)
+    model, cached = await _resolve_model_async(stage.model, instructions)
+    attributes = {"vertex.call": call, "gen_ai.request.model": stage.model}
+    with metrics.span("vertex.generate_content", **attributes) as current:
+        start = time.perf_counter()
+        try:
+            try:
+                response = await model.generate_content_async(contents, generation_config=config)
+            except Exception as exc:
+                if not (cached and _cache_gone(exc)):
+                    raise
+                context_caches.invalidate(stage.model, instructions)
+                model = _model_for(stage.model, instructions, None)
+                response = await model.generate_content_async(contents, generation_config=config)
+        except Exception:
+            metrics.observe_vertex(call, time.perf_counter() - start, model=stage.model)
+            raise
+        _observe(call, stage.model, time.perf_counter() - start, response, current)
+    return response
 
-    return "".join(texts)
+
+# -------------------------------------------------
+# Llamadas idénticas en curso (reintentos del frontend, varias pestañas)
+# comparten una sola generación: clave = hash de etapa + instrucciones +
+# prompt + imágenes. El uso (track_usage) queda en el turno que ejecutó la
+# llamada; los que esperaron no consumieron tokens.
+# -------------------------------------------------
+_flights = SingleFlight("vertex")
+
+
+def _flight_key(call: str, instructions: Optional[str], prompt: str, image_gcs_uris=()) -> str:
+    digest = hashlib.sha256()
+    for part in (call, instructions or "", prompt, *image_gcs_uris):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
 
 
 # -------------------------------------------------
-# 3. Análisis de intención
+# 1. Texto plano
 # -------------------------------------------------
-def analyze_user_message(
-    history_text: str,
-    session_context: dict,
-    new_message: str,
-) -> dict:
+async def generate_gemini_response_async(
+    prompt: str,
+    call: str = "reply",
+    instructions: Optional[str] = None,
+) -> str:
     """
-    Usa Gemini para:
-    - determinar el 'mode': 'general', 'recommend', 'care_plan', 'identify'
-    - extraer campos: location, time, humidity, light, temperature, plant_name
-    - indicar si falta información y qué pregunta de aclaración hacer
-    Devuelve un dict con esa estructura.
+    Llama a Gemini para generar una respuesta en texto plano (solo prompt de texto),
+    sin ocupar un hilo del threadpool mientras responde.
+    `call` es la etapa (reply, analysis, care_plan, identify): elige modelo y
+    generation config (stage_config) y etiqueta la llamada en las métricas.
+    `instructions` es la parte fija del prompt (system_instruction / caché de contexto).
     """
+    async def run() -> str:
+        return _response_text(await _generate_async(prompt, call, instructions))
 
-    context_str = json.dumps(session_context, ensure_ascii=False)
+    return await _flights.do(_flight_key(call, instructions, prompt), run)
+
+
+# -------------------------------------------------
+# 2. NUEVO: Texto + imágenes (GCS URIs)
+# -------------------------------------------------
+async def generate_gemini_response_with_images_async(
+    prompt: str,
+    image_gcs_uris: Optional[List[str]] = None,
+    instructions: Optional[str] = None,
+) -> str:
+    """
+    Llama a Gemini con un prompt de texto + hasta N imágenes (por ahora máx 3).
+    Cada imagen se pasa como Part con referencia a GCS:
+      - gs://bucket/path/to/image.jpg
+
+    Úsalo cuando quieras que el modelo tenga en cuenta las fotos del usuario
+    (identificación de planta, manchas en hojas, etc).
+    """
+    image_gcs_uris = (image_gcs_uris or [])[:3]
+
+    async def run() -> str:
+        return _response_text(
+            await _generate_async(_image_parts(prompt, image_gcs_uris), "identify", instructions)
+        )
 
-    analysis_prompt = f"""
+    return await _flights.do(_flight_key("identify", instructions, prompt, image_gcs_uris), run)
+
+
+# -------------------------------------------------
+# 3. Análisis de intención
+# -------------------------------------------------
+def _analysis_defaults() -> dict:
+    return {
+        "mode": "general",
+        "location": None,
+        "time": None,
+        "humidity": None,
+        "light": None,
+        "temperature": None,
+        "plant_name": None,
+        "need_clarification": False,
+        "missing_fields": [],
+        "clarification_question": None,
+    }
+
+
+# Parte fija del análisis: va como instrucciones de sistema (o caché de
+# contexto), no en cada prompt.
+ANALYSIS_INSTRUCTIONS = """
 Eres un asistente que SOLO clasifica y extrae información estructurada de mensajes de usuario
 relacionados con plantas y jardinería. NO debes generar la respuesta final al usuario, solo análisis.
 
@@ -136,16 +350,8 @@ Tipos de petición posibles (mode):
 - "identify": el usuario quiere identificar qué planta tiene (por texto, o luego por imagen).
 - "general": cualquier otra pregunta o charla sobre plantas.
 
-Información importante:
-- Historial reciente de la conversación (puede estar vacío):
-{history_text}
-
-- Contexto ya conocido de la sesión (puede estar vacío):
-{context_str}
-
-- Mensaje actual del usuario:
-\"\"\"{new_message}\"\"\"
-
+En cada petición recibirás el historial reciente de la conversación, el contexto ya conocido
+de la sesión y el mensaje actual del usuario.
 
 TU TAREA:
 1. Decide el "mode" más adecuado entre: "recommend", "care_plan", "identify", "general".
@@ -177,7 +383,7 @@ SIN texto adicional, SIN comentarios, SIN markdown.
 
 Ejemplo de formato EXACTO:
 
-{{
+{
   "mode": "recommend",
   "location": "Bogotá, apartamento",
   "time": null,
@@ -188,46 +394,57 @@ Ejemplo de formato EXACTO:
   "need_clarification": false,
   "missing_fields": [],
   "clarification_question": null
-}}
+}
+""".strip()
+
+
+def _analysis_prompt(history_text: str, session_context: dict, new_message: str) -> str:
+    """Parte variable del análisis (la fija está en ANALYSIS_INSTRUCTIONS)."""
+    context_str = json.dumps(session_context, ensure_ascii=False)
+
+    return f"""
+- Historial reciente de la conversación (puede estar vacío):
+{history_text}
+
+- Contexto ya conocido de la sesión (puede estar vacío):
+{context_str}
+
+- Mensaje actual del usuario:
+\"\"\"{new_message}\"\"\"
 
 Ahora genera SOLO el JSON para este caso.
 """
 
-    # Aquí seguimos usando solo texto, no imágenes
-    raw = model.generate_content(analysis_prompt)
-    analysis_text = generate_gemini_response(analysis_prompt)
 
+def _parse_analysis(analysis_text: str) -> dict:
     try:
         data = json.loads(analysis_text)
     except json.JSONDecodeError:
         # fallback muy simple si algo falla: modo general sin aclaración
-        return {
-            "mode": "general",
-            "location": None,
-            "time": None,
-            "humidity": None,
-            "light": None,
-            "temperature": None,
-            "plant_name": None,
-            "need_clarification": False,
-            "missing_fields": [],
-            "clarification_question": None,
-        }
+        return _analysis_defaults()
 
     # Nos aseguramos de que todas las claves existan
-    defaults = {
-        "mode": "general",
-        "location": None,
-        "time": None,
-        "humidity": None,
-        "light": None,
-        "temperature": None,
-        "plant_name": None,
-        "need_clarification": False,
-        "missing_fields": [],
-        "clarification_question": None,
-    }
-    for k, v in defaults.items():
+    for k, v in _analysis_defaults().items():
         data.setdefault(k, v)
 
     return data
+
+
+async def analyze_user_message_async(
+    history_text: str,
+    session_context: dict,
+    new_message: str,
+) -> dict:
+    """
+    Usa Gemini para:
+    - determinar el 'mode': 'general', 'recommend', 'care_plan', 'identify'
+    - extraer campos: location, time, humidity, light, temperature, plant_name
+    - indicar si falta información y qué pregunta de aclaración hacer
+    Devuelve un dict con esa estructura.
+    """
+    analysis_prompt = _analysis_prompt(history_text, session_context, new_message)
+    return _parse_analysis(
+        await generate_gemini_response_async(
+            analysis_prompt, call="analysis", instructions=ANALYSIS_INSTRUCTIONS
+        )
+    )
@@ -1,7 +1,8 @@
 # app/db/models.py
 from datetime import datetime
 from sqlalchemy import (
-    Column, Integer, String, Text, DateTime, ForeignKey, Numeric, Boolean
+    Column, Integer, BigInteger, String, Text, Date, DateTime, ForeignKey, Numeric, Boolean,
+    Index, func,
 )
 
 from sqlalchemy.dialects.postgresql import JSONB
@@ -32,12 +33,18 @@ class ChatSession(Base):
     last_activity_at = Column(DateTime, default=datetime.utcnow)
     location = Column(Text, nullable=True)
     environment_json = Column(JSONB, nullable=True)
+    # Lease del turno en curso: solo un /chat/message a la vez por sesión
+    # (entre procesos), sin retener conexión mientras se llama a Gemini.
+    turn_lease_until = Column(DateTime, nullable=True)
 
     user = relationship("User", back_populates="chat_sessions")
+    # passive_deletes: el borrado de mensajes lo hace el ON DELETE CASCADE de
+    # la base, sin cargarlos ni emitir un DELETE por fila
     messages = relationship(
         "ChatMessage",
         back_populates="session",
         cascade="all, delete-orphan",
+        passive_deletes=True,
     )
 
 
@@ -45,7 +52,7 @@ class ChatMessage(Base):
     __tablename__ = "chat_messages"
 
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(Integer, ForeignKey("chat_sessions.id"), nullable=False)
+    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False)
     sender = Column(String, nullable=False)
     content = Column(Text, nullable=True)
     message_type = Column(String, default="text")
@@ -59,14 +66,43 @@ class ChatMessage(Base):
     "PlantPrediction",
     back_populates="message",
     cascade="all, delete-orphan",
+    passive_deletes=True,
 )
 
 
+class ChatIdempotencyKey(Base):
+    __tablename__ = "chat_idempotency_keys"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # "<user_id>:<Idempotency-Key>" (o "-:<clave>" si no hay usuario)
+    key = Column(String, unique=True, nullable=False)
+    request_hash = Column(String(64), nullable=False)
+    status = Column(String, nullable=False, default="pending")  # 'pending', 'done'
+    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=True)
+    reply_message_id = Column(Integer, ForeignKey("chat_messages.id", ondelete="CASCADE"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class LlmUsageDaily(Base):
+    """Consumo de Gemini por usuario y día (UTC), acumulado en cada turno de chat."""
+    __tablename__ = "llm_usage_daily"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    requests = Column(Integer, nullable=False, default=0)  # llamadas a Gemini
+    turns = Column(Integer, nullable=False, default=0)  # respuestas del asistente
+    prompt_tokens = Column(BigInteger, nullable=False, default=0)
+    output_tokens = Column(BigInteger, nullable=False, default=0)
+    cached_tokens = Column(BigInteger, nullable=False, default=0)
+    latency_ms = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
 class PlantPrediction(Base):
     __tablename__ = "plant_predictions"
 
     id = Column(Integer, primary_key=True, index=True)
-    chat_message_id = Column(Integer, ForeignKey("chat_messages.id"), nullable=False)
+    chat_message_id = Column(Integer, ForeignKey("chat_messages.id", ondelete="CASCADE"), nullable=False)
     label = Column(Text, nullable=False)
     confidence = Column(Numeric, nullable=True)
     raw_prediction_json = Column(JSONB, nullable=True)
@@ -78,7 +114,8 @@ class CarePlan(Base):
     __tablename__ = "care_plans"
 
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(Integer, ForeignKey("chat_sessions.id"), nullable=True)
+    # El plan sobrevive al borrar la conversación que lo originó
+    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="SET NULL"), nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     plant_id = Column(Integer, ForeignKey("plants.id"), nullable=True)
     plant_name = Column(Text, nullable=False)
@@ -89,6 +126,27 @@ class CarePlan(Base):
     #relación ORM hacia Plant
     plant = relationship("Plant", back_populates="care_plans")
 
+class CareTask(Base):
+    """
+    Tarea recurrente (riego, fertilización) derivada del CarePlan vigente.
+    next_due_at está indexado: las tareas pendientes salen de un rango por
+    fecha, sin recorrer todas las plantas (ver services.care_tasks).
+    """
+    __tablename__ = "care_tasks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    plant_id = Column(Integer, ForeignKey("plants.id"), nullable=False)
+    care_plan_id = Column(Integer, ForeignKey("care_plans.id"), nullable=True)
+    kind = Column(String, nullable=False)  # 'riego', 'fertilizacion'
+    frequency_text = Column(Text, nullable=False)  # texto original del plan
+    interval_hours = Column(Integer, nullable=False)
+    next_due_at = Column(DateTime, nullable=False)
+    last_done_at = Column(DateTime, nullable=True)
+    # Aviso enviado para el vencimiento actual; vuelve a NULL al completar
+    notified_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class Plant(Base):
     __tablename__ = "plants"
 
@@ -111,17 +169,35 @@ class Plant(Base):
     source = Column(String, default="manual")
     created_at = Column(DateTime, default=datetime.utcnow)
 
-    user = relationship("User", backref="plants", lazy="joined")
+    # Carga perezosa: ningún endpoint de plantas devuelve el usuario ni el
+    # historial de planes. Para el plan vigente usar services.plants.latest_care_plans.
+    user = relationship("User", backref="plants")
 
     # relación ORM hacia CarePlan
     care_plans = relationship(
         "CarePlan",
         back_populates="plant",
-        lazy="selectin",
         order_by="desc(CarePlan.created_at)",
     )
 
 
+class StoredObject(Base):
+    """
+    Imagen guardada por contenido (clave = carpeta/sha256) y cuántas filas la
+    referencian. Ver app/services/storage.py.
+    """
+    __tablename__ = "stored_objects"
+
+    key = Column(Text, primary_key=True)
+    content_type = Column(String, nullable=True)
+    size = Column(BigInteger, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+    # NULL hasta que los bytes están en el backend (store_image los sube mientras tanto)
+    uploaded_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
 class MarketplaceItem(Base):
     __tablename__ = "marketplace_items"
 
@@ -174,4 +250,78 @@ class ItemRequest(Base):
     status = Column(String, default="pending")  # 'pending', 'approved', 'rejected'
     created_at = Column(DateTime, default=datetime.utcnow)
 
-    user = relationship("User", backref="item_requests")
\ No newline at end of file
+    user = relationship("User", backref="item_requests")
+
+
+# --- Índices para las consultas calientes (ver migrations/versions/0002) ---
+Index("ix_chat_messages_session_created", ChatMessage.session_id, ChatMessage.created_at)
+Index(
+    "ix_chat_messages_session_user_created",
+    ChatMessage.session_id,
+    ChatMessage.created_at,
+    postgresql_where=ChatMessage.sender == "user",
+)
+Index("ix_chat_sessions_user_activity", ChatSession.user_id, ChatSession.last_activity_at.desc())
+Index(
+    "ix_chat_sessions_environment",
+    ChatSession.environment_json,
+    postgresql_using="gin",
+    postgresql_ops={"environment_json": "jsonb_path_ops"},
+)
+Index(
+    "ix_plants_user_active_created",
+    Plant.user_id,
+    Plant.created_at.desc(),
+    postgresql_where=Plant.status == "active",
+)
+Index(
+    "ix_plants_user_active_lower_name",
+    Plant.user_id,
+    func.lower(Plant.common_name),
+    postgresql_where=Plant.status == "active",
+)
+Index(
+    "ix_care_plans_user_plant_created",
+    CarePlan.user_id,
+    CarePlan.plant_id,
+    CarePlan.created_at.desc(),
+)
+Index("ix_care_plans_plant_created", CarePlan.plant_id, CarePlan.created_at.desc())
+Index("ix_care_tasks_plant_kind", CareTask.plant_id, CareTask.kind, unique=True)
+Index("ix_care_tasks_user_due", CareTask.user_id, CareTask.next_due_at)
+Index(
+    "ix_care_tasks_due_unnotified",
+    CareTask.next_due_at,
+    postgresql_where=CareTask.notified_at.is_(None),
+)
+Index(
+    "ix_stored_objects_unreferenced",
+    StoredObject.updated_at,
+    postgresql_where=StoredObject.refcount == 0,
+)
+Index("ix_orders_user_created", Order.user_id, Order.created_at.desc())
+Index("ix_users_lower_email", func.lower(User.email), unique=True)
+Index(
+    "ix_marketplace_items_active_category",
+    MarketplaceItem.category,
+    postgresql_where=MarketplaceItem.is_active,
+)
+Index("ix_order_items_order_id", OrderItem.order_id)
+Index("ix_plant_predictions_chat_message_id", PlantPrediction.chat_message_id)
+Index("ix_chat_idempotency_keys_created_at", ChatIdempotencyKey.created_at)
+# Lado referenciante de los ON DELETE: sin índice cada fila borrada recorre la tabla
+Index(
+    "ix_chat_idempotency_keys_session_id",
+    ChatIdempotencyKey.session_id,
+    postgresql_where=ChatIdempotencyKey.session_id.isnot(None),
+)
+Index(
+    "ix_chat_idempotency_keys_reply_message_id",
+    ChatIdempotencyKey.reply_message_id,
+    postgresql_where=ChatIdempotencyKey.reply_message_id.isnot(None),
+)
+Index(
+    "ix_care_plans_session_id",
+    CarePlan.session_id,
+    postgresql_where=CarePlan.session_id.isnot(None),
+)
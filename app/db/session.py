@@ -1,9 +1,23 @@
 # app/db/session.py
+import logging
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+from fastapi import Request
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool
 from dotenv import load_dotenv
 
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
 # Cargar variables de entorno desde el archivo .env (solo en local)
 load_dotenv()
 
@@ -14,43 +28,464 @@ DB_NAME = os.getenv("DB_NAME", "plant_app_db")
 DB_HOST = os.getenv("DB_HOST", "127.0.0.1")
 DB_PORT = os.getenv("DB_PORT", "5432")
 
+DB_DRIVER = os.getenv("DB_DRIVER", "psycopg2")
+
 # Conector de Cloud SQL (solo si estamos en Cloud Run)
 INSTANCE_CONNECTION_NAME = os.getenv("INSTANCE_CONNECTION_NAME")
 
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# === Pool de conexiones ===
+# Los valores por defecto equivalen a los de SQLAlchemy (5 + 10). Con varios
+# workers de uvicorn x instancias de Cloud Run conviene bajarlos: el total de
+# conexiones es workers * instancias * (DB_POOL_SIZE + DB_MAX_OVERFLOW).
+#
+# DB_PGBOUNCER=true: la app habla con PgBouncer (o el pooler de Cloud SQL) en
+# modo "transaction pooling". En ese modo una conexión física no pertenece a la
+# sesión entre transacciones, así que:
+#   - por defecto se usa NullPool (el pooling lo hace PgBouncer),
+#   - no se usan prepared statements del lado servidor. psycopg2 nunca los usa;
+#     con DB_DRIVER=psycopg (v3) se desactivan con prepare_threshold=None.
+DB_PGBOUNCER = _env_bool("DB_PGBOUNCER", False)
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "null" if DB_PGBOUNCER else "queue")  # queue | null
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # segundos esperando conexión libre
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # segundos; -1 desactiva
+# pre_ping cuesta un round-trip por checkout; con DB_POOL_RECYCLE por debajo del
+# timeout de inactividad del servidor se puede desactivar.
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", True)
+
 # === Construcción dinámica de la URL de conexión ===
+def _build_database_url(host: str, port: str = "5432") -> str:
+    """host puede ser un host TCP o un directorio de socket (/cloudsql/...)."""
+    if host.startswith("/"):
+        return (
+            f"postgresql+{DB_DRIVER}://{DB_USER}:{DB_PASSWORD}"
+            f"@/{DB_NAME}"
+            f"?host={host}"
+        )
+    return (
+        f"postgresql+{DB_DRIVER}://{DB_USER}:{DB_PASSWORD}"
+        f"@{host}:{port}/{DB_NAME}"
+    )
+
+
 if INSTANCE_CONNECTION_NAME:
     # Entorno: Cloud Run con Cloud SQL Connector
-    SQLALCHEMY_DATABASE_URL = (
-        f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}"
-        f"@/{DB_NAME}"
-        f"?host=/cloudsql/{INSTANCE_CONNECTION_NAME}"
-    )
+    SQLALCHEMY_DATABASE_URL = _build_database_url(f"/cloudsql/{INSTANCE_CONNECTION_NAME}")
 else:
     # Entorno: desarrollo local o servidor sin Cloud SQL
-    SQLALCHEMY_DATABASE_URL = (
-        f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}"
-        f"@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-    )
+    SQLALCHEMY_DATABASE_URL = _build_database_url(DB_HOST, DB_PORT)
+
+# === Réplicas de lectura ===
+# DB_REPLICA_HOSTS: lista separada por comas de "host:puerto" o de sockets de
+# Cloud SQL ("/cloudsql/proyecto:region:replica"). Mismo usuario/clave/base que
+# el primario. Para probar en local basta con otra instancia de Postgres:
+#   DB_REPLICA_HOSTS=127.0.0.1:5433
+DB_REPLICA_HOSTS = [h.strip() for h in os.getenv("DB_REPLICA_HOSTS", "").split(",") if h.strip()]
+# Si la réplica va más atrasada que esto, las lecturas vuelven al primario.
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "2"))
+# Cada cuánto se vuelve a medir el lag de cada réplica.
+DB_REPLICA_LAG_CHECK_SECONDS = float(os.getenv("DB_REPLICA_LAG_CHECK_SECONDS", "5"))
+# Tras una escritura, el mismo usuario lee del primario durante esta
+# ventana (read-your-writes). Debe cubrir el lag máximo tolerado.
+DB_READ_STICKY_SECONDS = float(os.getenv("DB_READ_STICKY_SECONDS", "10"))
+
+
+def _replica_url(entry: str) -> str:
+    if entry.startswith("/"):
+        return _build_database_url(entry)
+    host, _, port = entry.partition(":")
+    return _build_database_url(host, port or "5432")
+
+
+# === Métricas del pool ===
+# Contadores acumulados desde el arranque del proceso, para dimensionar el pool
+# (ver get_pool_stats y el endpoint /health/pool).
+_pool_stats_lock = threading.Lock()
+_pool_stats = {
+    "connects": 0,
+    "checkouts": 0,
+    "checkins": 0,
+    "timeouts": 0,
+    "wait_count": 0,
+    "wait_seconds_total": 0.0,
+    "wait_seconds_max": 0.0,
+}
+
+
+def _record_wait(seconds: float, timed_out: bool = False) -> None:
+    metrics.DB_POOL_WAIT_SECONDS.observe(seconds)
+    with _pool_stats_lock:
+        _pool_stats["wait_count"] += 1
+        _pool_stats["wait_seconds_total"] += seconds
+        if seconds > _pool_stats["wait_seconds_max"]:
+            _pool_stats["wait_seconds_max"] = seconds
+        if timed_out:
+            _pool_stats["timeouts"] += 1
+
+
+def _incr(key: str) -> None:
+    with _pool_stats_lock:
+        _pool_stats[key] += 1
+
+
+class _TimedQueuePool(QueuePool):
+    """QueuePool que mide cuánto espera cada checkout (incluye abrir conexión nueva)."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            _record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        _record_wait(time.perf_counter() - start)
+        return conn
+
+
+def _engine_kwargs() -> dict:
+    kwargs: dict = {
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if DB_POOL_MODE == "null":
+        kwargs["poolclass"] = NullPool
+    else:
+        kwargs.update(
+            poolclass=_TimedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    if DB_PGBOUNCER and DB_DRIVER == "psycopg":
+        kwargs["connect_args"] = {"prepare_threshold": None}
+    return kwargs
+
+
+def _install_pool_listeners(engine: Engine) -> None:
+    event.listen(engine, "connect", lambda *_: _incr("connects"))
+    event.listen(engine, "checkout", lambda *_: _incr("checkouts"))
+    event.listen(engine, "checkin", lambda *_: _incr("checkins"))
+
 
 # === Crear motor y sesión ===
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    pool_pre_ping=True,  # Verifica conexiones antes de usarlas
+# El motor se crea en la primera sesión que se pide, no al importar el módulo:
+# create_engine carga el dialecto y el driver, y no queremos pagarlo en el
+# arranque en frío de Cloud Run si la primera petición no toca la base.
+_engine: Optional[Engine] = None
+_engine_lock = threading.Lock()
+
+# expire_on_commit=False: tras un commit los objetos siguen siendo legibles sin
+# volver a hacer SELECT (los INSERT ya traen id/defaults vía RETURNING).
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False)
+
+
+def get_engine() -> Engine:
+    """Devuelve el motor global, creándolo la primera vez (thread-safe)."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = create_engine(SQLALCHEMY_DATABASE_URL, **_engine_kwargs())
+                _install_pool_listeners(engine)
+                metrics.instrument_engine(engine)
+                SessionLocal.configure(bind=engine)
+                _engine = engine
+                if not INSTANCE_CONNECTION_NAME:
+                    logger.info("Conectando localmente a %s:%s/%s", DB_HOST, DB_PORT, DB_NAME)
+                else:
+                    logger.info(
+                        "Conectando a Cloud SQL vía socket: /cloudsql/%s",
+                        INSTANCE_CONNECTION_NAME,
+                    )
+    return _engine
+
+
+def get_pool_stats() -> dict:
+    """
+    Estado del pool para capacity planning:
+    - checked_out / checked_in / overflow: ocupación actual
+    - wait_ms_*: tiempo esperando una conexión libre (solo QueuePool)
+    - timeouts: checkouts que agotaron DB_POOL_TIMEOUT
+    """
+    with _pool_stats_lock:
+        counters = dict(_pool_stats)
+
+    stats = {
+        "mode": DB_POOL_MODE,
+        "pgbouncer": DB_PGBOUNCER,
+        "pool_size": DB_POOL_SIZE if DB_POOL_MODE != "null" else 0,
+        "max_overflow": DB_MAX_OVERFLOW if DB_POOL_MODE != "null" else 0,
+        "checked_out": counters["checkouts"] - counters["checkins"],
+        "checked_in": 0,
+        "overflow": 0,
+        "connects": counters["connects"],
+        "checkouts": counters["checkouts"],
+        "timeouts": counters["timeouts"],
+        "wait_count": counters["wait_count"],
+        "wait_ms_total": round(counters["wait_seconds_total"] * 1000, 3),
+        "wait_ms_max": round(counters["wait_seconds_max"] * 1000, 3),
+        "wait_ms_avg": round(
+            counters["wait_seconds_total"] * 1000 / counters["wait_count"], 3
+        ) if counters["wait_count"] else 0.0,
+    }
+
+    pool = _engine.pool if _engine is not None else None
+    if isinstance(pool, QueuePool):
+        stats["checked_out"] = pool.checkedout()
+        stats["checked_in"] = pool.checkedin()
+        stats["overflow"] = max(pool.overflow(), 0)
+    return stats
+
+
+# === Routing de lecturas a réplicas ===
+# Lag = 0 si la réplica ya aplicó todo lo recibido; si no, antigüedad de la
+# última transacción aplicada. En una instancia que no es réplica ambas
+# funciones devuelven NULL y el lag es 0 (útil para probar con dos Postgres).
+_REPLICA_LAG_SQL = text(
+    """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+    """
 )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# === Dependencia para FastAPI ===
+class _Replica:
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = url
+        self.engine: Optional[Engine] = None
+        self.lag_seconds: Optional[float] = None
+        self.checked_at = 0.0
+        self.healthy = False
+        self._check_lock = threading.Lock()
+
+    def get_engine(self) -> Engine:
+        if self.engine is None:
+            with self._check_lock:
+                if self.engine is None:
+                    engine = create_engine(self.url, **_engine_kwargs())
+                    metrics.instrument_engine(engine, name=f"replica:{self.name}")
+                    self.engine = engine
+        return self.engine
+
+    def is_usable(self) -> bool:
+        """Mide el lag si el dato está caducado. Solo un hilo mide a la vez; el resto usa el último valor."""
+        now = time.monotonic()
+        if now - self.checked_at >= DB_REPLICA_LAG_CHECK_SECONDS and self._check_lock.acquire(blocking=False):
+            try:
+                with self.get_engine().connect() as conn:
+                    self.lag_seconds = float(conn.execute(_REPLICA_LAG_SQL).scalar() or 0)
+                self.healthy = self.lag_seconds <= DB_REPLICA_MAX_LAG_SECONDS
+            except Exception:
+                logger.warning("Réplica %s no disponible; lecturas al primario", self.name, exc_info=True)
+                self.lag_seconds = None
+                self.healthy = False
+            finally:
+                self.checked_at = time.monotonic()
+                self._check_lock.release()
+        return self.healthy
+
+
+_replicas: List[_Replica] = [_Replica(h, _replica_url(h)) for h in DB_REPLICA_HOSTS]
+_replica_rr = 0
+_replica_rr_lock = threading.Lock()
+
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False)
+
+# Claves ("user:<id>", "session:<id>", "plant:<id>") escritas hace poco -> instante de expiración.
+_sticky_until: dict = {}
+_sticky_lock = threading.Lock()
+
+
+def _mark_sticky(keys) -> None:
+    if not keys or not _replicas:
+        return
+    now = time.monotonic()
+    until = now + DB_READ_STICKY_SECONDS
+    with _sticky_lock:
+        for key in keys:
+            _sticky_until[key] = until
+        if len(_sticky_until) > 10_000:
+            for key in [k for k, t in _sticky_until.items() if t <= now]:
+                del _sticky_until[key]
+
+
+def _is_sticky(keys) -> bool:
+    now = time.monotonic()
+    with _sticky_lock:
+        return any(_sticky_until.get(key, 0) > now for key in keys)
+
+
+def _pick_replica() -> Optional[_Replica]:
+    global _replica_rr
+    with _replica_rr_lock:
+        start = _replica_rr
+        _replica_rr = (_replica_rr + 1) % len(_replicas)
+    for i in range(len(_replicas)):
+        replica = _replicas[(start + i) % len(_replicas)]
+        if replica.is_usable():
+            return replica
+    return None
+
+
+def _token_user_id(request: Request) -> Optional[str]:
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    from app.core.security import InvalidToken, decode_access_token
+
+    try:
+        return str(decode_access_token(token)["sub"])
+    except (InvalidToken, KeyError):
+        return None
+
+
+_STICKY_PARAMS = (("user", "user_id"), ("session", "session_id"), ("plant", "plant_id"))
+
+
+def _request_keys(request: Optional[Request]) -> List[str]:
+    """
+    Claves de la petición: el usuario del token y user_id / session_id /
+    plant_id de la ruta o la query. No se usa la IP: detrás del balanceador de
+    Cloud Run es la del proxy, compartida por clientes que no tienen nada que ver.
+    """
+    if request is None:
+        return []
+    keys = []
+    token_user = _token_user_id(request)
+    if token_user:
+        keys.append(f"user:{token_user}")
+    for kind, param in _STICKY_PARAMS:
+        value = request.path_params.get(param) or request.query_params.get(param)
+        if value and f"{kind}:{value}" not in keys:
+            keys.append(f"{kind}:{value}")
+    return keys
+
+
+def mark_written(
+    db: Session,
+    user_id: Optional[int] = None,
+    session_id: Optional[int] = None,
+    plant_id: Optional[int] = None,
+) -> None:
+    """
+    Apunta a quién afecta lo que escribe esta sesión (sin E/S). Tras el commit,
+    las lecturas de ese usuario / sesión de chat / planta van al primario
+    durante DB_READ_STICKY_SECONDS. Cada ruta de escritura lo llama con el
+    dueño explícito: ni ChatMessage ni los update()/delete() de Core permiten
+    deducirlo del flush.
+    """
+    keys = db.info.setdefault("written_keys", set())
+    for kind, value in (("user", user_id), ("session", session_id), ("plant", plant_id)):
+        if value is not None:
+            keys.add(f"{kind}:{value}")
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _stick_after_commit(session: Session) -> None:
+    _mark_sticky(session.info.pop("written_keys", None))
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _forget_rolled_back_writes(session: Session) -> None:
+    session.info.pop("written_keys", None)
+
+
+@event.listens_for(ReadSessionLocal, "before_flush")
+def _reject_replica_writes(session: Session, flush_context, instances) -> None:
+    if session.new or session.dirty or session.deleted:
+        raise RuntimeError("Intento de escritura en una sesión de solo lectura (réplica).")
+
+
+def get_replica_status() -> List[dict]:
+    return [
+        {
+            "name": r.name,
+            "healthy": r.healthy,
+            "lag_seconds": r.lag_seconds,
+            "checked_ago_s": round(time.monotonic() - r.checked_at, 1) if r.checked_at else None,
+        }
+        for r in _replicas
+    ]
+
+
+# === Dependencias para FastAPI ===
 def get_db():
-    """Devuelve una sesión de base de datos para usar en dependencias."""
+    """Devuelve una sesión de base de datos (primario) para usar en dependencias."""
+    get_engine()
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
-# Debug opcional: imprimir la URL de conexión (solo en desarrollo)
-if not INSTANCE_CONNECTION_NAME:
-    print(f"Conectando localmente a: {SQLALCHEMY_DATABASE_URL}")
-else:
-    print(f"Conectando a Cloud SQL vía socket: /cloudsql/{INSTANCE_CONNECTION_NAME}")
+
+@contextmanager
+def session_scope():
+    """
+    Sesión corta fuera de Depends: commit al salir, rollback si hay excepción.
+    La conexión vuelve al pool al cerrar el bloque, así que sirve para no
+    retenerla durante llamadas lentas (Gemini, GCS) entre lecturas y escrituras.
+    """
+    get_engine()
+    db = SessionLocal()
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def get_read_db(request: Request):
+    """
+    Sesión para endpoints de solo lectura. Va a una réplica sana salvo que:
+    - no haya réplicas configuradas,
+    - el usuario (token o user_id), la sesión de chat o la planta de la ruta
+      se hayan escrito (mark_written) hace menos de DB_READ_STICKY_SECONDS,
+    - todas las réplicas superen DB_REPLICA_MAX_LAG_SECONDS o no respondan.
+    En esos casos se usa el primario.
+    """
+    db = _open_read_session(request)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def _open_read_session(request: Optional[Request]) -> Session:
+    replica = None
+    if _replicas and not _is_sticky(_request_keys(request)):
+        replica = _pick_replica()
+
+    if replica is None:
+        get_engine()
+        return SessionLocal()
+    return ReadSessionLocal(bind=replica.get_engine())
+
+
+@contextmanager
+def read_session_scope(request: Optional[Request] = None):
+    """
+    Como get_read_db fuera de Depends, para lecturas que viven más que el
+    handler (p. ej. el generador de un StreamingResponse: las dependencias
+    con yield se cierran antes de enviar el cuerpo).
+    """
+    db = _open_read_session(request)
+    try:
+        yield db
+    finally:
+        db.close()
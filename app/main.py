@@ -1,17 +1,25 @@
 # app/main.py
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 
-from app.db.session import get_db
-from app.db import models
+from app.core import metrics
+from app.core.config import settings
+from app.core.rate_limit import RateLimited
+from app.api import health
 from app.api import chat
 from app.api import auth
 from app.api import plants
 from app.api import marketplace
+from app.api import images
 
 
-app = FastAPI(title="Plant Care Backend")
+app = FastAPI(title="Plant Care Backend", default_response_class=ORJSONResponse)
+
+# Trazas OTLP (si hay OTEL_EXPORTER_OTLP_ENDPOINT) y latencia por ruta
+metrics.setup_tracing()
+app.middleware("http")(metrics.http_metrics_middleware)
 
 origins = [
     "http://localhost:4200",
@@ -28,12 +36,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.get("/health")
-def health(db: Session = Depends(get_db)):
-    users_count = db.query(models.User).count()
-    return {"status": "ok", "users": users_count}
+# Compresión: Brotli si está instalado brotli-asgi (con gzip para clientes que
+# no lo aceptan); si no, solo gzip.
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=settings.response_compression_min_bytes)
+else:
+    app.add_middleware(
+        BrotliMiddleware,
+        quality=4,
+        minimum_size=settings.response_compression_min_bytes,
+        gzip_fallback=True,
+    )
+
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    return ORJSONResponse(
+        status_code=429,
+        content={"detail": "Demasiadas peticiones, intenta más tarde.", "limit": exc.scope},
+        headers={"Retry-After": exc.retry_after_header},
+    )
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return metrics.metrics_response()
 
 
+# Probes (/livez, /readyz) y estado (/health, /health/pool)
+app.include_router(health.router, tags=["health"])
 # Router del chatbot
 app.include_router(chat.router, prefix="/chat", tags=["chat"])
 # Router de autenticación
@@ -42,3 +75,5 @@ app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(plants.router, prefix="/plants", tags=["plants"])
 # Router de marketplace
 app.include_router(marketplace.router, prefix="/marketplace", tags=["marketplace"])
+# Imágenes (redirección a URL firmada o archivo local)
+app.include_router(images.router, prefix="/images", tags=["images"])
@@ -3,13 +3,15 @@ from __future__ import annotations
 
 import json
 import re
-from typing import Optional
+from typing import Optional, Union
 
 from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 
 from app.db import models
-from app.core.vertex_client import generate_gemini_response
+from app.core.single_flight import SingleFlight
+from app.core.vertex_client import generate_gemini_response_async
 
 
 # --------- Esquema del plan (valida estructura, sin inventar) ---------
@@ -41,85 +43,152 @@ def _clean_json_text(text: str) -> str:
     return cleaned
 
 
-def _build_prompt(plant_common_name: str, context_block: str) -> str:
-    return f"""
+# Parte fija del prompt: va como instrucciones de sistema (o caché de contexto)
+CARE_PLAN_INSTRUCTIONS = """
 Eres un experto en jardinería. Devuelve **SOLO** un JSON válido (sin explicaciones, sin markdown).
-Planta: {plant_common_name}
-{context_block}
+En cada petición recibirás la planta y, si se conocen, su ubicación, luz, humedad y temperatura.
 
 Formato EXACTO que debes devolver (rellena todos los campos; usa "" si no aplica, pero NO agregues texto fuera del JSON):
-{{
-  "riego": {{"frecuencia":"", "detalle":""}},
-  "luz": {{"tipo":"", "detalle":""}},
+{
+  "riego": {"frecuencia":"", "detalle":""},
+  "luz": {"tipo":"", "detalle":""},
   "temperatura": "",
   "humedad": "",
-  "fertilizacion": {{"frecuencia":"", "detalle":""}},
+  "fertilizacion": {"frecuencia":"", "detalle":""},
   "poda": "",
   "plagas": "",
   "alertas": []
-}}
+}
 """.strip()
 
 
-# --------- Servicio principal (estricto, sin fallback inventado) ---------
-def ensure_care_plan_for_plant(
-    db: Session,
-    user_id: int,
-    plant: models.Plant,
-    session_id: Optional[int] = None,
-) -> Optional[models.CarePlan]:
-    """
-    Crea (si no existe) un CarePlan para la planta dada del usuario.
-    - Idempotente por (user_id, plant_id).
-    - SOLO guarda si el modelo devuelve JSON válido según CarePlanSchema.
-    - Si el JSON es inválido o no parsea, retorna None (no inventa contenido).
-    """
-    if not user_id or not plant or not plant.id:
-        raise ValueError("user_id y plant.id son obligatorios para generar el CarePlan.")
+def _build_prompt(plant_common_name: str, context_block: str) -> str:
+    return f"""
+Planta: {plant_common_name}
+{context_block}
+""".strip()
 
-    existing = (
+
+def _parse_plan(raw_text: str) -> Optional[CarePlanSchema]:
+    # Intento 1: limpiar fences y parsear
+    try:
+        cleaned = _clean_json_text(raw_text)
+        parsed = json.loads(cleaned)
+        return CarePlanSchema(**parsed)
+    except (json.JSONDecodeError, ValidationError):
+        # Intento 2 (último): probar el raw por si el recorte eliminó algo útil
+        try:
+            parsed2 = json.loads(raw_text)
+            return CarePlanSchema(**parsed2)
+        except Exception:
+            # No guardamos nada si no hay JSON válido
+            return None
+
+
+def find_care_plan(db: Session, user_id: int, plant_id: int) -> Optional[models.CarePlan]:
+    """Plan más reciente de (user_id, plant_id), si existe."""
+    return (
         db.query(models.CarePlan)
         .filter(
             models.CarePlan.user_id == user_id,
-            models.CarePlan.plant_id == plant.id,
+            models.CarePlan.plant_id == plant_id,
         )
         .order_by(models.CarePlan.created_at.desc())
         .first()
     )
-    if existing:
-        return existing
 
+
+def find_care_plan_locked(db: Session, user_id: int, plant_id: int) -> Optional[models.CarePlan]:
+    """
+    Como find_care_plan, pero antes toma pg_advisory_xact_lock(user_id, plant_id):
+    dos procesos que van a guardar un plan para la misma planta se serializan
+    y el segundo ve el del primero. El lock dura hasta el commit/rollback, así
+    que solo se usa en la transacción corta que inserta (nunca durante Gemini).
+    """
+    db.execute(
+        text("SELECT pg_advisory_xact_lock(:user_id, :plant_id)"),
+        {"user_id": user_id, "plant_id": plant_id},
+    )
+    return find_care_plan(db, user_id, plant_id)
+
+
+# Generaciones de plan en curso por (user_id, planta): reintentos y pestañas
+# que piden el mismo plan esperan a la primera en vez de volver a llamar a Gemini.
+_plan_flights = SingleFlight("care_plan")
+
+
+def _plan_flight_key(user_id: int, plant: Union[int, str]) -> tuple:
+    # Planta por id o, si aún no existe, por nombre (como find_active_plant)
+    return (user_id, plant.lower().strip() if isinstance(plant, str) else plant)
+
+
+def _care_plan_prompt(
+    common_name: str,
+    location: Optional[str],
+    light: Optional[str],
+    humidity: Optional[str],
+    temperature: Optional[str],
+) -> str:
     # Construir contexto para el prompt (sin asumir nada extra)
     ctx_lines = []
-    if plant.location:    ctx_lines.append(f"Ubicación: {plant.location}")
-    if plant.light:       ctx_lines.append(f"Luz: {plant.light}")
-    if plant.humidity:    ctx_lines.append(f"Humedad: {plant.humidity}")
-    if plant.temperature: ctx_lines.append(f"Temperatura: {plant.temperature}")
+    if location:    ctx_lines.append(f"Ubicación: {location}")
+    if light:       ctx_lines.append(f"Luz: {light}")
+    if humidity:    ctx_lines.append(f"Humedad: {humidity}")
+    if temperature: ctx_lines.append(f"Temperatura: {temperature}")
     context_block = "\n".join(ctx_lines)
 
-    prompt = _build_prompt(plant.common_name.strip(), context_block)
+    return _build_prompt(common_name.strip(), context_block)
 
-    # Llamada al modelo
-    raw_text = generate_gemini_response(prompt)
 
-    # Intento 1: limpiar fences y parsear
-    try:
-        cleaned = _clean_json_text(raw_text)
-        parsed = json.loads(cleaned)
-        plan_model = CarePlanSchema(**parsed)
-    except (json.JSONDecodeError, ValidationError):
-        # Intento 2 (último): probar el raw por si el recorte eliminó algo útil
-        try:
-            parsed2 = json.loads(raw_text)
-            plan_model = CarePlanSchema(**parsed2)
-        except Exception:
-            # No guardamos nada si no hay JSON válido
-            return None
+async def generate_care_plan_json_async(
+    common_name: str,
+    location: Optional[str] = None,
+    light: Optional[str] = None,
+    humidity: Optional[str] = None,
+    temperature: Optional[str] = None,
+) -> Optional[dict]:
+    """
+    Llama a Gemini y devuelve el plan validado con CarePlanSchema, o None si el
+    JSON es inválido. No toca la base: se puede llamar sin tener una
+    transacción (ni una conexión) abierta.
+    """
+    prompt = _care_plan_prompt(common_name, location, light, humidity, temperature)
+    plan_model = _parse_plan(await generate_gemini_response_async(
+        prompt, call="care_plan", instructions=CARE_PLAN_INSTRUCTIONS
+    ))
+    if plan_model is None:
+        return None
+    return plan_model.model_dump()
 
-    cp = models.CarePlan(
+
+async def shared_care_plan_json_async(
+    user_id: int,
+    plant: Union[int, str],
+    common_name: str,
+    **fields: Optional[str],
+) -> Optional[dict]:
+    """
+    generate_care_plan_json_async coalescido por (user_id, plant): las
+    peticiones concurrentes para la misma planta comparten una generación.
+    `plant` es el id o, si la planta aún no existe, su nombre.
+    """
+    return await _plan_flights.do(
+        _plan_flight_key(user_id, plant),
+        lambda: generate_care_plan_json_async(common_name, **fields),
+    )
+
+
+def new_care_plan(
+    user_id: int,
+    plant: models.Plant,
+    plan_json: dict,
+    session_id: Optional[int] = None,
+) -> models.CarePlan:
+    """CarePlan sin guardar; el llamador decide cuándo hacer commit."""
+    return models.CarePlan(
         session_id=session_id,
         user_id=user_id,
-        plant_id=plant.id,               
+        plant_id=plant.id,
         plant_name=plant.common_name,
         environment_json={
             "location": plant.location,
@@ -127,9 +196,6 @@ def ensure_care_plan_for_plant(
             "humidity": plant.humidity,
             "temperature": plant.temperature,
         },
-        plan_json=plan_model.model_dump(),  
+        plan_json=plan_json,
     )
-    db.add(cp)
-    db.commit()
-    db.refresh(cp)
-    return cp
+
@@ -0,0 +1,302 @@
+# app/services/care_tasks.py
+"""
+Recordatorios de cuidado a partir del CarePlan.
+
+plan_json trae riego.frecuencia y fertilizacion.frecuencia como texto libre
+("cada 7-10 días", "2 veces por semana", "mensual en primavera"...).
+parse_frequency() lo convierte en un intervalo en horas y
+schedule_care_tasks() guarda una CareTask por (planta, tipo) con su
+próximo vencimiento (next_due_at).
+
+Las consultas van por índice sobre next_due_at, así que el coste es
+proporcional a las tareas vencidas y no al número de plantas:
+- due_tasks(): pendientes de un usuario (GET /plants/due-tasks),
+  ix_care_tasks_user_due.
+- claim_due_reminders(): lote de vencidas sin avisar, con FOR UPDATE SKIP
+  LOCKED para que varios workers no avisen dos veces, ix_care_tasks_due_unnotified.
+
+Worker de avisos (Cloud Scheduler / cron):
+    python -m app.services.care_tasks            # una pasada
+    python -m app.services.care_tasks --backfill # tareas de los planes ya existentes
+"""
+import argparse
+import logging
+import re
+import unicodedata
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.db import models
+from app.db.session import session_scope
+from app.services.plants import latest_care_plans
+
+logger = logging.getLogger(__name__)
+
+# Clave en plan_json -> CareTask.kind
+TASK_KINDS = ("riego", "fertilizacion")
+
+_UNIT_HOURS = {"hora": 1, "dia": 24, "semana": 24 * 7, "mes": 24 * 30, "ano": 24 * 365}
+_WORDS = {
+    "un": 1, "una": 1, "uno": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5,
+    "seis": 6, "siete": 7, "ocho": 8, "nueve": 9, "diez": 10, "doce": 12,
+    "quince": 15, "veinte": 20, "treinta": 30,
+}
+_KEYWORDS = (
+    ("diari", 24),
+    ("todos los dias", 24),
+    ("cada dia", 24),
+    ("quincenal", 24 * 14),
+    ("semanal", 24 * 7),
+    ("bimestral", 24 * 60),
+    ("bimensual", 24 * 60),
+    ("trimestral", 24 * 90),
+    ("mensual", 24 * 30),
+    ("anual", 24 * 365),
+)
+_UNIT = r"(hora|dia|semana|mes|ano)"
+# "cada 7-10 días", "cada 2 a 3 semanas": se toma el extremo menor (mejor revisar antes)
+_RANGE_RE = re.compile(r"(\d+)\s*(?:-|a|o|y)\s*\d+\s*" + _UNIT)
+# "2 veces por semana", "1 vez al mes"
+_TIMES_RE = re.compile(r"(\d+)\s*ve(?:z|ces)\s*(?:por|al|a la|cada)\s*" + _UNIT)
+# "cada 10 días", "cada semana"
+_EVERY_RE = re.compile(r"cada\s*(\d+)?\s*" + _UNIT)
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(
+        r"\b(" + "|".join(_WORDS) + r")\b", lambda m: str(_WORDS[m.group(1)]), text
+    )
+
+
+def parse_frequency(text: Optional[str]) -> Optional[int]:
+    """Intervalo en horas para una frecuencia en texto libre, o None si no se entiende."""
+    if not text:
+        return None
+    norm = _normalize(text)
+
+    m = _RANGE_RE.search(norm)
+    if m:
+        hours = int(m.group(1)) * _UNIT_HOURS[m.group(2)]
+    elif (m := _TIMES_RE.search(norm)):
+        hours = _UNIT_HOURS[m.group(2)] // max(int(m.group(1)), 1)
+    elif (m := _EVERY_RE.search(norm)):
+        hours = int(m.group(1) or 1) * _UNIT_HOURS[m.group(2)]
+    else:
+        hours = next((h for word, h in _KEYWORDS if word in norm), 0)
+    return hours or None
+
+
+def plan_intervals(plan_json: Optional[dict]) -> dict:
+    """{kind: (texto, horas)} de las frecuencias que se pudieron interpretar."""
+    intervals = {}
+    for kind in TASK_KINDS:
+        section = (plan_json or {}).get(kind)
+        text = (section or {}).get("frecuencia") if isinstance(section, dict) else None
+        hours = parse_frequency(text)
+        if hours:
+            intervals[kind] = (text.strip(), hours)
+    return intervals
+
+
+def schedule_care_tasks(db: Session, plan: models.CarePlan, now: Optional[datetime] = None) -> int:
+    """
+    Crea o actualiza las CareTask del plan (sin commit) en un único
+    INSERT ... ON CONFLICT (plant_id, kind). Si la tarea ya existía se
+    conserva su vencimiento salvo que el nuevo intervalo lo adelante.
+    """
+    intervals = plan_intervals(plan.plan_json)
+    if not intervals or plan.plant_id is None or plan.user_id is None:
+        return 0
+    if plan.id is None:
+        db.flush()
+    now = now or datetime.utcnow()
+
+    stmt = insert(models.CareTask).values([
+        {
+            "user_id": plan.user_id,
+            "plant_id": plan.plant_id,
+            "care_plan_id": plan.id,
+            "kind": kind,
+            "frequency_text": text,
+            "interval_hours": hours,
+            "next_due_at": now + timedelta(hours=hours),
+            "created_at": now,
+        }
+        for kind, (text, hours) in intervals.items()
+    ])
+    table = models.CareTask.__table__
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["plant_id", "kind"],
+        set_={
+            "care_plan_id": stmt.excluded.care_plan_id,
+            "frequency_text": stmt.excluded.frequency_text,
+            "interval_hours": stmt.excluded.interval_hours,
+            "next_due_at": func.least(
+                table.c.next_due_at,
+                func.coalesce(table.c.last_done_at, stmt.excluded.created_at)
+                + func.make_interval(0, 0, 0, 0, stmt.excluded.interval_hours),
+            ),
+        },
+    )
+    db.execute(stmt)
+    return len(intervals)
+
+
+def drop_care_tasks(db: Session, plant_id: int) -> None:
+    """Quita las tareas de una planta que deja de estar activa (sin commit)."""
+    db.query(models.CareTask).filter(models.CareTask.plant_id == plant_id).delete(
+        synchronize_session=False
+    )
+
+
+# Columnas que devuelve CareTaskOut
+CARE_TASK_COLUMNS = (
+    models.CareTask.id,
+    models.CareTask.plant_id,
+    models.Plant.common_name.label("plant_name"),
+    models.Plant.nickname.label("plant_nickname"),
+    models.CareTask.kind,
+    models.CareTask.frequency_text,
+    models.CareTask.interval_hours,
+    models.CareTask.next_due_at,
+    models.CareTask.last_done_at,
+)
+
+
+def due_tasks(db: Session, user_id: int, until: datetime, limit: int = 100):
+    """Tareas del usuario con next_due_at <= until, las más atrasadas primero."""
+    return (
+        db.query(*CARE_TASK_COLUMNS)
+        .join(models.Plant, models.Plant.id == models.CareTask.plant_id)
+        .filter(
+            models.CareTask.user_id == user_id,
+            models.CareTask.next_due_at <= until,
+            models.Plant.status == "active",
+        )
+        .order_by(models.CareTask.next_due_at)
+        .limit(limit)
+        .all()
+    )
+
+
+def complete_task(db: Session, user_id: int, task_id: int, done_at: Optional[datetime] = None):
+    """
+    Marca la tarea como hecha y la reprograma (done_at + intervalo). None si
+    no existe o no es del usuario. Sin commit.
+
+    RETURNING solo trae el id: un UPDATE del ORM no devuelve las columnas de
+    plants (nombre / apodo), que salen del mismo SELECT con join que due_tasks.
+    """
+    done_at = done_at or datetime.utcnow()
+    task = models.CareTask
+    updated_id = db.execute(
+        update(task)
+        .where(task.id == task_id, task.user_id == user_id)
+        .values(
+            last_done_at=done_at,
+            next_due_at=done_at + func.make_interval(0, 0, 0, 0, task.interval_hours),
+            notified_at=None,
+        )
+        .returning(task.id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if updated_id is None:
+        return None
+    return (
+        db.query(*CARE_TASK_COLUMNS)
+        .join(models.Plant, models.Plant.id == task.plant_id)
+        .filter(task.id == updated_id)
+        .first()
+    )
+
+
+def claim_due_reminders(db: Session, now: Optional[datetime] = None, limit: int = 100) -> list:
+    """
+    Toma hasta `limit` tareas vencidas sin aviso y las marca como avisadas
+    (sin commit). SKIP LOCKED: workers concurrentes se reparten el lote.
+    """
+    now = now or datetime.utcnow()
+    task = models.CareTask
+    due_ids = (
+        select(task.id)
+        .where(task.notified_at.is_(None), task.next_due_at <= now)
+        .order_by(task.next_due_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    stmt = (
+        update(task)
+        .where(task.id.in_(due_ids))
+        .values(notified_at=now)
+        .returning(task.id, task.user_id, task.plant_id, task.kind, task.next_due_at)
+        .execution_options(synchronize_session=False)
+    )
+    return db.execute(stmt).all()
+
+
+def send_due_reminders(notify: Callable[[List], None], batch: int = 100) -> int:
+    """
+    Avisa de todas las tareas vencidas, un lote por transacción. Si notify
+    falla el lote se revierte y esas tareas se reintentan en la próxima pasada.
+    """
+    sent = 0
+    while True:
+        with session_scope() as db:
+            rows = claim_due_reminders(db, limit=batch)
+            if rows:
+                notify(rows)
+        sent += len(rows)
+        if len(rows) < batch:
+            return sent
+
+
+def backfill_care_tasks(batch: int = 500) -> int:
+    """Programa tareas para las plantas activas a partir de su último CarePlan."""
+    scheduled = 0
+    last_id = 0
+    while True:
+        with session_scope() as db:
+            plant_ids = [
+                pid for (pid,) in db.query(models.Plant.id)
+                .filter(models.Plant.id > last_id, models.Plant.status == "active")
+                .order_by(models.Plant.id)
+                .limit(batch)
+            ]
+            for plan in latest_care_plans(db, plant_ids).values():
+                scheduled += schedule_care_tasks(db, plan)
+        if len(plant_ids) < batch:
+            return scheduled
+        last_id = plant_ids[-1]
+
+
+def _log_reminders(rows: Iterable) -> None:
+    # Sin canal de notificaciones todavía (push / email): solo registro
+    for row in rows:
+        logger.info(
+            "Recordatorio: %s de la planta %s (usuario %s), vencía %s",
+            row.kind, row.plant_id, row.user_id, row.next_due_at,
+        )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Recordatorios de riego y fertilización")
+    parser.add_argument("--backfill", action="store_true", help="crear tareas de los planes existentes")
+    parser.add_argument("--batch", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.backfill:
+        print(f"tareas programadas: {backfill_care_tasks(args.batch)}")
+    else:
+        print(f"recordatorios enviados: {send_due_reminders(_log_reminders, args.batch)}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,74 @@
+# app/services/chat_cleanup.py
+"""
+Borrado de sesiones de chat.
+
+delete_sessions() es un único DELETE ... RETURNING sobre chat_sessions: los
+mensajes, predicciones y claves de idempotencia caen por ON DELETE CASCADE en
+la base (y care_plans.session_id queda en NULL), sin cargar nada en memoria.
+
+Antes del DELETE se libera la referencia que cada mensaje tiene sobre sus
+imágenes (stored_objects; ver la regla en app/services/storage.py); el barrido de app.services.storage borra las que quedan sin
+uso. Las imágenes con el esquema anterior (fotos_chat/user-N/session-M/) se
+borran después, fuera de la petición (BackgroundTasks), con
+delete_session_images().
+"""
+import logging
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from app.db import models
+from app.db.session import mark_written
+from app.services.storage import chat_session_prefix, delete_prefixes, release_uris
+
+logger = logging.getLogger(__name__)
+
+
+def delete_sessions(
+    db: Session,
+    user_id: Optional[int] = None,
+    session_ids: Optional[Iterable[int]] = None,
+) -> List[Tuple[int, Optional[int]]]:
+    """
+    Borra las sesiones del usuario y/o con esos ids (sin commit).
+    Devuelve (session_id, user_id) de las borradas.
+    """
+    conditions = []
+    if user_id is not None:
+        conditions.append(models.ChatSession.user_id == user_id)
+    if session_ids is not None:
+        conditions.append(models.ChatSession.id.in_(list(session_ids)))
+    elif user_id is None:
+        raise ValueError("delete_sessions necesita user_id o session_ids.")
+
+    image_lists = db.execute(
+        select(models.ChatMessage.image_gcs_uris)
+        .join(models.ChatSession, models.ChatSession.id == models.ChatMessage.session_id)
+        .where(*conditions, models.ChatMessage.image_gcs_uris.isnot(None))
+    ).scalars()
+    release_uris(db, [uri for uris in image_lists for uri in uris or ()])
+
+    stmt = (
+        delete(models.ChatSession)
+        .where(*conditions)
+        .returning(models.ChatSession.id, models.ChatSession.user_id)
+    )
+    deleted = [tuple(row) for row in db.execute(stmt.execution_options(synchronize_session=False))]
+    for sid, uid in deleted:
+        mark_written(db, user_id=uid, session_id=sid)
+    return deleted
+
+
+def delete_session_images(sessions: List[Tuple[int, Optional[int]]]) -> None:
+    """Borra de GCS las imágenes de las sesiones ya eliminadas. Para BackgroundTasks."""
+    prefixes = [chat_session_prefix(uid, sid) for sid, uid in sessions if uid is not None]
+    if not prefixes:
+        return
+    try:
+        deleted = delete_prefixes(prefixes)
+    except Exception:
+        # Quedan huérfanas en el bucket; no afecta a la base
+        logger.exception("No se pudieron borrar las imágenes de %d sesiones", len(prefixes))
+        return
+    logger.info("Borradas %d imágenes de %d sesiones", deleted, len(prefixes))
@@ -0,0 +1,78 @@
+# app/services/chat_context.py
+"""
+Contexto ambiental de las sesiones de chat (ChatSession.environment_json).
+
+Las actualizaciones son un único UPDATE con merge en el servidor
+(`environment_json = coalesce(environment_json, '{}') || :patch`), así que
+dos turnos concurrentes que aportan campos distintos no se pisan y no hay
+que reescribir el JSON entero desde Python.
+"""
+from typing import Optional
+
+from sqlalchemy import cast, func, literal, update
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Query, Session
+
+from app.db import models
+
+# Campos del análisis que se guardan en environment_json
+ENV_FIELDS = ("humidity", "light", "temperature", "time")
+
+
+def environment_patch(analysis: dict, known: Optional[dict] = None) -> dict:
+    """Campos nuevos o cambiados respecto a lo que ya sabíamos de la sesión."""
+    known = known or {}
+    return {
+        key: analysis[key]
+        for key in ENV_FIELDS
+        if analysis.get(key) and known.get(key) != analysis[key]
+    }
+
+
+def update_session_context(
+    db: Session,
+    session_id: int,
+    location: Optional[str] = None,
+    env_patch: Optional[dict] = None,
+    release_turn: bool = False,
+) -> None:
+    """
+    Aplica ubicación y entorno en un solo UPDATE (sin leer la fila antes).
+    release_turn=True libera además el lease del turno (ver chat_turns).
+    """
+    values = {}
+    if location:
+        values[models.ChatSession.location] = location
+    if env_patch:
+        values[models.ChatSession.environment_json] = func.coalesce(
+            models.ChatSession.environment_json, literal({}, JSONB)
+        ).op("||")(cast(literal(env_patch, JSONB), JSONB))
+    if release_turn:
+        values[models.ChatSession.turn_lease_until] = None
+    if not values:
+        return
+
+    db.execute(
+        update(models.ChatSession)
+        .where(models.ChatSession.id == session_id)
+        .values(values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def sessions_with_context(
+    db: Session,
+    location_contains: Optional[str] = None,
+    **environment,
+) -> Query:
+    """
+    Sesiones cuyo entorno contiene los pares dados, p. ej.
+    sessions_with_context(db, "Bogotá", light="baja").
+    El filtro de entorno usa `@>` (índice GIN ix_chat_sessions_environment).
+    """
+    q = db.query(models.ChatSession)
+    if environment:
+        q = q.filter(models.ChatSession.environment_json.contains(environment))
+    if location_contains:
+        q = q.filter(models.ChatSession.location.ilike(f"%{location_contains}%"))
+    return q
@@ -0,0 +1,224 @@
+# app/services/chat_turns.py
+"""
+Orden e idempotencia de los turnos de /chat/message.
+
+- Orden por sesión: dentro del proceso un asyncio.Lock por sesión; entre
+  procesos/instancias un lease en chat_sessions.turn_lease_until que se toma
+  con un UPDATE condicional. No se usa pg_advisory_lock porque obligaría a
+  retener la conexión durante las llamadas a Gemini.
+- Idempotency-Key: la primera petición reserva la clave (INSERT ... ON
+  CONFLICT DO NOTHING); los reintentos reciben la respuesta guardada sin volver
+  a llamar a Gemini. Las claves viejas (chat_idempotency_ttl_hours) se borran
+  con un job periódico:
+    python -m app.services.chat_turns --purge-idempotency
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import weakref
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.db import models
+from app.db.session import session_scope
+
+
+# --------- Orden por sesión ---------
+_session_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def session_lock(session_id: int) -> asyncio.Lock:
+    """Lock en memoria por sesión; desaparece solo cuando nadie lo usa."""
+    lock = _session_locks.get(session_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _session_locks[session_id] = lock
+    return lock
+
+
+class SessionBusy(Exception):
+    """Otro proceso tiene el turno de la sesión."""
+
+
+def acquire_turn_lease(db: Session, session_id: int) -> Optional[models.ChatSession]:
+    """
+    Toma el turno de la sesión y actualiza last_activity_at en el mismo UPDATE.
+    Devuelve la sesión, None si no existe, o lanza SessionBusy si otro turno la tiene.
+    """
+    now = datetime.utcnow()
+    stmt = (
+        update(models.ChatSession)
+        .where(
+            models.ChatSession.id == session_id,
+            or_(
+                models.ChatSession.turn_lease_until.is_(None),
+                models.ChatSession.turn_lease_until < now,
+            ),
+        )
+        .values(
+            turn_lease_until=now + timedelta(seconds=settings.chat_turn_lease_seconds),
+            last_activity_at=now,
+        )
+        .returning(models.ChatSession)
+        .execution_options(synchronize_session=False)
+    )
+    session = db.execute(stmt).scalars().first()
+    if session is not None:
+        return session
+
+    exists = db.query(models.ChatSession.id).filter(models.ChatSession.id == session_id).first()
+    if exists is None:
+        return None
+    raise SessionBusy(session_id)
+
+
+def release_turn_lease(session_id: int) -> None:
+    """Libera el turno si el pipeline falla antes de la transacción de salida."""
+    with session_scope() as db:
+        db.query(models.ChatSession).filter(models.ChatSession.id == session_id).update(
+            {models.ChatSession.turn_lease_until: None}, synchronize_session=False
+        )
+
+
+# --------- Idempotency-Key ---------
+def scoped_key(user_id: int, key: str) -> str:
+    """Clave por usuario verificado (token o dueño de la sesión): nunca compartida entre anónimos."""
+    return f"{user_id}:{key.strip()}"
+
+
+def request_fingerprint(body: dict) -> str:
+    """Hash estable del cuerpo: la misma clave con otro cuerpo es un error del cliente."""
+    raw = json.dumps(body, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def claim_idempotency_key(
+    db: Session, key: str, request_hash: str
+) -> Optional[models.ChatIdempotencyKey]:
+    """
+    Reserva la clave. Devuelve None si esta petición es la primera (o si la
+    reserva anterior quedó abandonada); si no, el registro existente.
+    """
+    inserted = db.execute(
+        insert(models.ChatIdempotencyKey)
+        .values(key=key, request_hash=request_hash, status="pending", created_at=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=["key"])
+        .returning(models.ChatIdempotencyKey.id)
+    ).first()
+    if inserted is not None:
+        return None
+
+    existing = (
+        db.query(models.ChatIdempotencyKey)
+        .filter(models.ChatIdempotencyKey.key == key)
+        .with_for_update()
+        .one()
+    )
+    stale_before = datetime.utcnow() - timedelta(seconds=settings.chat_turn_lease_seconds)
+    if (
+        existing.status == "pending"
+        and existing.request_hash == request_hash
+        and existing.created_at < stale_before
+    ):
+        # El proceso que la reservó murió a mitad de turno: la retomamos
+        existing.created_at = datetime.utcnow()
+        return None
+    return existing
+
+
+def stored_reply(db: Session, record: models.ChatIdempotencyKey) -> Optional[str]:
+    if record.reply_message_id is None:
+        return None
+    msg = db.get(models.ChatMessage, record.reply_message_id)
+    return msg.content if msg else None
+
+
+def complete_idempotency_key(
+    db: Session, key: str, session_id: int, reply_message_id: int
+) -> None:
+    db.query(models.ChatIdempotencyKey).filter(models.ChatIdempotencyKey.key == key).update(
+        {
+            models.ChatIdempotencyKey.status: "done",
+            models.ChatIdempotencyKey.session_id: session_id,
+            models.ChatIdempotencyKey.reply_message_id: reply_message_id,
+        },
+        synchronize_session=False,
+    )
+
+
+def release_idempotency_key(key: str) -> None:
+    """Borra una reserva pendiente para que el cliente pueda reintentar tras un error."""
+    with session_scope() as db:
+        db.query(models.ChatIdempotencyKey).filter(
+            models.ChatIdempotencyKey.key == key,
+            models.ChatIdempotencyKey.status == "pending",
+        ).delete(synchronize_session=False)
+
+
+def purge_idempotency_keys(db: Session, limit: int = 1000) -> int:
+    """Borra hasta `limit` claves más viejas que chat_idempotency_ttl_hours (sin commit)."""
+    key = models.ChatIdempotencyKey
+    cutoff = datetime.utcnow() - timedelta(hours=settings.chat_idempotency_ttl_hours)
+    expired = select(key.id).where(key.created_at < cutoff).limit(limit)
+    return db.execute(
+        delete(key).where(key.id.in_(expired)).execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def purge_all_idempotency_keys(batch: int = 1000) -> int:
+    """Purga por lotes, una transacción corta por lote. Devuelve cuántas borró."""
+    purged = 0
+    while True:
+        with session_scope() as db:
+            deleted = purge_idempotency_keys(db, batch)
+        purged += deleted
+        if deleted < batch:
+            return purged
+
+
+async def wait_for_turn(acquire):
+    """
+    Reintenta `acquire` (una función síncrona que usa acquire_turn_lease) hasta
+    que la sesión quede libre o pase chat_turn_wait_seconds. Lanza SessionBusy
+    si no lo consigue.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.chat_turn_wait_seconds
+    delay = 0.1
+    while True:
+        try:
+            return await run_in_threadpool(acquire)
+        except SessionBusy:
+            if loop.time() + delay > deadline:
+                raise
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Mantenimiento de los turnos de chat")
+    parser.add_argument(
+        "--purge-idempotency", action="store_true",
+        help="borrar Idempotency-Key más viejas que chat_idempotency_ttl_hours",
+    )
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.purge_idempotency:
+        print(f"claves borradas: {purge_all_idempotency_keys(args.batch)}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,72 @@
+# app/services/image_urls.py
+"""
+URLs de lectura de imágenes para las respuestas (plantas, mensajes de chat,
+marketplace).
+
+En la base quedan URIs del backend (gs://bucket/clave), que un navegador no
+puede cargar. read_urls() las cambia por URLs firmadas V4 de corta duración
+(settings.image_url_ttl_seconds):
+- cada URL se guarda en memoria hasta REFRESH_MARGIN_SECONDS antes de que
+  caduque; con claves por contenido, la misma imagen comparte URL entre
+  usuarios y peticiones,
+- las que faltan se firman en un solo lote por respuesta (un refresco de
+  credenciales, firmas en paralelo), no una por fila.
+URIs que no son del backend (URLs externas, públicas antiguas) se devuelven
+tal cual.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.storage_backends import get_backend
+
+REFRESH_MARGIN_SECONDS = 300
+
+# clave -> (url, expira en time.time()); orden de uso para descartar las viejas
+_cache: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def read_urls(uris: Iterable[Optional[str]]) -> Dict[str, str]:
+    """URI guardada -> URL para el navegador, firmando de una vez las que falten."""
+    backend = get_backend()
+    now = time.time()
+    urls: Dict[str, str] = {}
+    missing: Dict[str, List[str]] = {}
+    with _lock:
+        for uri in uris:
+            if not uri or uri in urls:
+                continue
+            key = backend.key_from_uri(uri)
+            if key is None:
+                urls[uri] = uri
+                continue
+            cached = _cache.get(key)
+            if cached is not None and cached[1] - now > REFRESH_MARGIN_SECONDS:
+                _cache.move_to_end(key)
+                urls[uri] = cached[0]
+            else:
+                missing.setdefault(key, []).append(uri)
+    if not missing:
+        return urls
+
+    ttl = settings.image_url_ttl_seconds
+    signed = backend.read_urls(list(missing), ttl)
+    expires_at = now + ttl
+    with _lock:
+        for key, url in signed.items():
+            _cache[key] = (url, expires_at)
+            _cache.move_to_end(key)
+            for uri in missing[key]:
+                urls[uri] = url
+        while len(_cache) > settings.image_url_cache_size:
+            _cache.popitem(last=False)
+    return urls
+
+
+def read_url(uri: Optional[str]) -> Optional[str]:
+    if not uri:
+        return None
+    return read_urls([uri])[uri]
@@ -0,0 +1,144 @@
+# app/services/llm_usage.py
+"""
+Contabilidad de uso de Gemini.
+
+- summarize_usage(): resumen de las llamadas de un turno (vertex_client.track_usage)
+  que se guarda en ChatMessage.vertex_response_json.
+- add_daily_usage(): suma el turno a llm_usage_daily con un único
+  INSERT ... ON CONFLICT DO UPDATE (sin leer la fila antes).
+- check_daily_budget() / note_daily_usage(): presupuesto diario de tokens por
+  usuario (settings.llm_daily_token_budget). El gasto se cachea en memoria y se
+  relee de llm_usage_daily cada BUDGET_REFRESH_SECONDS, así que el camino
+  caliente no toca la base y varias instancias convergen en poco tiempo.
+"""
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.rate_limit import RateLimited
+from app.db import models
+from app.db.session import session_scope
+
+_TOTALS = ("prompt_tokens", "output_tokens", "cached_tokens", "latency_ms")
+
+
+def summarize_usage(records: List[dict]) -> Optional[dict]:
+    """
+    Totales del turno + detalle por llamada. finish_reason y model son los de
+    la última llamada (la que produjo el texto que ve el usuario).
+    """
+    if not records:
+        return None
+    last = records[-1]
+    summary = {
+        "model": last["model"],
+        "finish_reason": last["finish_reason"],
+        "cache_hit": any(r["cache_hit"] for r in records),
+        "calls": records,
+    }
+    for field in _TOTALS:
+        summary[field] = sum(r[field] for r in records)
+    summary["latency_ms"] = round(summary["latency_ms"], 1)
+    return summary
+
+
+def add_daily_usage(db: Session, user_id: Optional[int], summary: Optional[dict]) -> None:
+    """Acumula el turno en llm_usage_daily (sin commit). Sesiones anónimas no cuentan."""
+    if user_id is None or summary is None:
+        return
+    row = {
+        "user_id": user_id,
+        "day": datetime.utcnow().date(),
+        "requests": len(summary["calls"]),
+        "turns": 1,
+        "prompt_tokens": summary["prompt_tokens"],
+        "output_tokens": summary["output_tokens"],
+        "cached_tokens": summary["cached_tokens"],
+        "latency_ms": int(summary["latency_ms"]),
+        "updated_at": datetime.utcnow(),
+    }
+    stmt = insert(models.LlmUsageDaily).values(**row)
+    table = models.LlmUsageDaily.__table__
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "day"],
+        set_={
+            **{
+                key: table.c[key] + stmt.excluded[key]
+                for key in ("requests", "turns", *_TOTALS)
+            },
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    db.execute(stmt)
+
+
+def usage_for_day(db: Session, user_id: int, day: Optional[date] = None) -> Optional[models.LlmUsageDaily]:
+    return db.get(models.LlmUsageDaily, (user_id, day or datetime.utcnow().date()))
+
+
+def usage_tokens(records: List[dict]) -> int:
+    return sum(r["prompt_tokens"] + r["output_tokens"] for r in records)
+
+
+# --------- Presupuesto diario ---------
+BUDGET_REFRESH_SECONDS = 60
+
+# user_id -> (día UTC, tokens gastados, instante de la última lectura de la base)
+_spent: Dict[int, Tuple[date, int, float]] = {}
+_spent_lock = threading.Lock()
+
+
+def _refresh_spent(user_id: int) -> int:
+    today = datetime.utcnow().date()
+    with session_scope() as db:
+        row = usage_for_day(db, user_id, today)
+        spent = (row.prompt_tokens + row.output_tokens) if row else 0
+    with _spent_lock:
+        _spent[user_id] = (today, spent, time.monotonic())
+    return spent
+
+
+def _cached_spent(user_id: int) -> Optional[int]:
+    with _spent_lock:
+        entry = _spent.get(user_id)
+    if entry is None:
+        return None
+    day, spent, loaded_at = entry
+    if day != datetime.utcnow().date() or time.monotonic() - loaded_at > BUDGET_REFRESH_SECONDS:
+        return None
+    return spent
+
+
+def _seconds_until_utc_midnight() -> float:
+    now = datetime.utcnow()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return (midnight - now).total_seconds()
+
+
+async def check_daily_budget(user_id: Optional[int]) -> None:
+    """Lanza RateLimited si el usuario ya gastó su presupuesto de tokens de hoy."""
+    budget = settings.llm_daily_token_budget
+    if not budget or user_id is None or not settings.rate_limit_enabled:
+        return
+    spent = _cached_spent(user_id)
+    if spent is None:
+        spent = await run_in_threadpool(_refresh_spent, user_id)
+    if spent >= budget:
+        raise RateLimited("llm_budget", _seconds_until_utc_midnight())
+
+
+def note_daily_usage(user_id: Optional[int], tokens: int) -> None:
+    """Suma al gasto cacheado los tokens de un turno ya guardado."""
+    if user_id is None or not tokens:
+        return
+    today = datetime.utcnow().date()
+    with _spent_lock:
+        entry = _spent.get(user_id)
+        if entry is not None and entry[0] == today:
+            _spent[user_id] = (today, entry[1] + tokens, entry[2])
@@ -2,6 +2,7 @@ from sqlalchemy.orm import Session
 from app.db.models import MarketplaceItem, Order, OrderItem, ItemRequest
 from app.schemas.marketplace import MarketplaceItemCreate, OrderCreate, ItemRequestCreate
 from fastapi import HTTPException
+from app.services.storage import retain_uris
 
 class MarketplaceService:
     
@@ -15,6 +16,7 @@ class MarketplaceService:
     @staticmethod
     def create_item(db: Session, item: MarketplaceItemCreate):
         db_item = MarketplaceItem(**item.model_dump())
+        retain_uris(db, [db_item.image_url])
         db.add(db_item)
         db.commit()
         db.refresh(db_item)
@@ -1,6 +1,68 @@
+from typing import Iterable
+
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from app.db import models
 
+# Columnas que devuelve PlantOut. Los listados proyectan solo esto (filas
+# planas, sin identity map ni relaciones) en vez de cargar entidades Plant.
+PLANT_LIST_COLUMNS = (
+    models.Plant.id,
+    models.Plant.user_id,
+    models.Plant.common_name,
+    models.Plant.scientific_name,
+    models.Plant.nickname,
+    models.Plant.location,
+    models.Plant.light,
+    models.Plant.humidity,
+    models.Plant.temperature,
+    models.Plant.notes,
+    models.Plant.image_gcs_uri,
+    models.Plant.status,
+    models.Plant.source,
+    models.Plant.created_at,
+)
+
+
+def list_active_plants(db: Session, user_id: int):
+    """Plantas activas del usuario como filas (Row) con las columnas de PlantOut."""
+    return (
+        db.query(*PLANT_LIST_COLUMNS)
+        .filter(models.Plant.user_id == user_id, models.Plant.status == "active")
+        .order_by(models.Plant.created_at.desc())
+        .all()
+    )
+
+
+def latest_care_plans(db: Session, plant_ids: Iterable[int]) -> dict[int, models.CarePlan]:
+    """
+    Solo el plan más reciente de cada planta (DISTINCT ON), en una consulta.
+    Evita cargar todo el historial de CarePlan con sus plan_json.
+    """
+    plant_ids = list(plant_ids)
+    if not plant_ids:
+        return {}
+    plans = (
+        db.query(models.CarePlan)
+        .filter(models.CarePlan.plant_id.in_(plant_ids))
+        .distinct(models.CarePlan.plant_id)
+        .order_by(models.CarePlan.plant_id, models.CarePlan.created_at.desc())
+        .all()
+    )
+    return {cp.plant_id: cp for cp in plans}
+
+def find_active_plant(db: Session, user_id: int, common_name: str) -> models.Plant | None:
+    return (
+        db.query(models.Plant)
+        # lower() = lower() en vez de ilike: mismo resultado sin comodines y
+        # usa el índice ix_plants_user_active_lower_name
+        .filter(models.Plant.user_id == user_id,
+                func.lower(models.Plant.common_name) == common_name.lower(),
+                models.Plant.status == "active")
+        .first()
+    )
+
+
 def ensure_plant_for_user(
     db: Session,
     user_id: int,
@@ -10,21 +72,23 @@ def ensure_plant_for_user(
     humidity: str | None = None,
     temperature: str | None = None,
     location: str | None = None,
+    commit: bool = True,
 ) -> models.Plant:
-    existing = (
-        db.query(models.Plant)
-        .filter(models.Plant.user_id == user_id,
-                models.Plant.common_name.ilike(common_name),
-                models.Plant.status == "active")
-        .first()
-    )
+    """
+    Devuelve la planta activa del usuario con ese nombre, creándola si no existe
+    y completando los campos vacíos. Con commit=False solo hace flush (el id
+    queda asignado vía RETURNING) y el llamador cierra la transacción.
+    """
+    existing = find_active_plant(db, user_id, common_name)
     if existing:
         changed = False
         for k, v in dict(light=light, humidity=humidity, temperature=temperature, location=location).items():
             if v and not getattr(existing, k):
                 setattr(existing, k, v); changed = True
         if changed:
-            db.add(existing); db.commit(); db.refresh(existing)
+            db.add(existing)
+            if commit:
+                db.commit(); db.refresh(existing)
         return existing
 
     plant = models.Plant(
@@ -36,5 +100,9 @@ def ensure_plant_for_user(
         temperature=temperature,
         location=location,
     )
-    db.add(plant); db.commit(); db.refresh(plant)
+    db.add(plant)
+    if commit:
+        db.commit(); db.refresh(plant)
+    else:
+        db.flush()
     return plant
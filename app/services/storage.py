@@ -1,20 +1,178 @@
 # app/services/storage.py
-import time
-import uuid
-from typing import Optional
-
-from google.cloud import storage
+"""
+Imágenes direccionadas por contenido.
+
+La clave de cada objeto es "<carpeta>/<sha256[:2]>/<sha256>" de sus bytes:
+la misma foto subida dos veces (reintentos, la misma imagen en dos sesiones)
+se guarda una sola vez. stored_objects lleva la cuenta de referencias:
+
+- store_image(): suma una referencia (INSERT ... ON CONFLICT) y sube los
+  bytes mientras la fila no esté marcada uploaded_at. put() no sobrescribe
+  (412 / link()), así que subidas concurrentes no se pisan, cada llamada
+  vuelve solo cuando el objeto existe, y si un proceso muere antes de subir
+  la siguiente llamada lo sube.
+- retain_uris(): suma una referencia por cada fila más que guarda la URI
+  (p. ej. el mensaje de /chat/message que reenvía las de /chat/upload-images).
+- release_uris(): resta referencias cuando se borra / reemplaza lo que apuntaba
+  a la imagen. Con refcount 0 el objeto no se borra enseguida.
+Regla: cada fila que guarda una URI tiene su referencia, y la suelta al
+borrarse o cambiar de imagen.
+- sweep_unreferenced(): borra los objetos con refcount 0 desde hace más de
+  storage_sweep_grace_seconds. Toma la fila con FOR UPDATE y borra el objeto
+  antes de la fila, así que una subida concurrente de la misma imagen espera
+  y vuelve a subirla.
+    python -m app.services.storage --sweep
+
+El backend (GCS o disco local) sale de settings.storage_backend; ver
+app/services/storage_backends.py.
+"""
+import argparse
+import hashlib
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.core import metrics
 from app.core.config import settings
+from app.db import models
+from app.db.session import session_scope
+from app.services.storage_backends import get_backend, get_storage_client
+
+logger = logging.getLogger(__name__)
+
+CHAT_IMAGES = "fotos_chat"
+PLANT_IMAGES = "foto_planta"
+MARKETPLACE_IMAGES = "marketplace_items"
+
+
+def content_key(folder: str, data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    return f"{folder}/{digest[:2]}/{digest}"
+
+
+def _acquire(db: Session, key: str, size: int, content_type: str) -> bool:
+    """Suma una referencia a `key`; True si el objeto ya consta como subido."""
+    table = models.StoredObject.__table__
+    now = datetime.utcnow()
+    stmt = insert(table).values(
+        key=key, content_type=content_type, size=size, refcount=1, created_at=now, updated_at=now,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["key"],
+        set_={"refcount": table.c.refcount + 1, "updated_at": now},
+    ).returning(table.c.uploaded_at)
+    return db.execute(stmt).scalar_one() is not None
+
+
+def _mark_uploaded(db: Session, key: str) -> None:
+    db.query(models.StoredObject).filter(
+        models.StoredObject.key == key, models.StoredObject.uploaded_at.is_(None)
+    ).update({models.StoredObject.uploaded_at: datetime.utcnow()}, synchronize_session=False)
+
+
+def _adjust_keys(db: Session, keys: Iterable[str], sign: int) -> None:
+    """Suma (sign=1) o resta (sign=-1) una referencia por aparición de cada clave."""
+    counts = Counter(keys)
+    if not counts:
+        return
+    table = models.StoredObject.__table__
+    stmt = (
+        table.update()
+        .where(table.c.key == bindparam("b_key"))
+        .values(
+            refcount=func.greatest(table.c.refcount + sign * bindparam("b_count"), 0),
+            updated_at=datetime.utcnow(),
+        )
+    )
+    db.execute(stmt, [{"b_key": key, "b_count": n} for key, n in counts.items()])
 
-_storage_client: Optional[storage.Client] = None
 
-def get_storage_client() -> storage.Client:
-    global _storage_client
-    if _storage_client is None:
-        _storage_client = storage.Client(
-            project=settings.project_id  
-        )
-    return _storage_client
+def _release_keys(db: Session, keys: Iterable[str]) -> None:
+    _adjust_keys(db, keys, -1)
+
+
+def _backend_keys(uris: Iterable[Optional[str]]) -> List[str]:
+    backend = get_backend()
+    return [key for key in (backend.key_from_uri(u) for u in uris if u) if key]
+
+
+def store_image(folder: str, data: bytes, content_type: str) -> str:
+    """
+    Guarda la imagen (deduplicada por contenido) y devuelve su URI. Cada
+    llamada es una referencia: quien deje de usar la URI debe liberarla.
+    """
+    key = content_key(folder, data)
+    # La referencia va antes que los bytes: el barrido no borra un objeto referenciado
+    with session_scope() as db:
+        uploaded = _acquire(db, key, len(data), content_type)
+
+    backend = get_backend()
+    if uploaded:
+        metrics.STORAGE_DEDUP.labels(folder).inc()
+        return backend.uri(key)
+
+    try:
+        with metrics.gcs_upload(folder, len(data)):
+            written = backend.put(key, data, content_type)
+    except Exception:
+        # Solo se suelta la referencia propia; otra llamada puede seguir subiéndolo
+        with session_scope() as db:
+            _release_keys(db, [key])
+        raise
+    if not written:
+        metrics.STORAGE_DEDUP.labels(folder).inc()
+    with session_scope() as db:
+        _mark_uploaded(db, key)
+    return backend.uri(key)
+
+
+def retain_uris(db: Session, uris: Iterable[Optional[str]]) -> None:
+    """
+    Suma una referencia por cada URI que una fila nueva pasa a guardar (sin
+    commit). Las que no están en stored_objects (externas, anteriores) se ignoran.
+    """
+    _adjust_keys(db, _backend_keys(uris), 1)
+
+
+def release_uris(db: Session, uris: Iterable[Optional[str]]) -> None:
+    """
+    Resta una referencia por cada URI (sin commit). URIs de otro backend o
+    anteriores a las claves por contenido (no están en stored_objects) se ignoran.
+    """
+    _release_keys(db, _backend_keys(uris))
+
+
+def sweep_unreferenced(batch: int = 100, grace_seconds: Optional[float] = None) -> int:
+    """Borra objetos sin referencias desde hace más de grace_seconds. Devuelve cuántos."""
+    grace = settings.storage_sweep_grace_seconds if grace_seconds is None else grace_seconds
+    backend = get_backend()
+    deleted = 0
+    while True:
+        with session_scope() as db:
+            keys: List[str] = list(db.execute(
+                select(models.StoredObject.key)
+                .where(
+                    models.StoredObject.refcount == 0,
+                    models.StoredObject.updated_at < datetime.utcnow() - timedelta(seconds=grace),
+                )
+                .limit(batch)
+                .with_for_update(skip_locked=True)
+            ).scalars())
+            if keys:
+                # Primero el objeto, luego la fila (que sigue bloqueada hasta el commit)
+                backend.delete_many(keys)
+                db.query(models.StoredObject).filter(models.StoredObject.key.in_(keys)).delete(
+                    synchronize_session=False
+                )
+        deleted += len(keys)
+        if len(keys) < batch:
+            return deleted
+
 
 def upload_chat_image(
     data: bytes,
@@ -24,22 +182,11 @@ def upload_chat_image(
     idx: int,
 ) -> str:
     """
-    Sube una imagen al bucket configurado y devuelve la URL pública.
+    Sube una imagen del chat y devuelve su URI (gs://... con el backend GCS).
+    user_id / session_id / idx ya no forman parte de la clave (es el sha256).
     """
-    client = get_storage_client()
-    bucket = client.bucket(settings.gcs_bucket)
-
-    ts = int(time.time())
-    file_id = uuid.uuid4().hex[:8]
-
-    # Ruta organizada por usuario/sesión
-    blob_name = f"fotos_chat/user-{user_id}/session-{session_id}/{ts}_{idx}_{file_id}"
-
-    blob = bucket.blob(blob_name)
-    blob.upload_from_string(data, content_type=content_type)
+    return store_image(CHAT_IMAGES, data, content_type)
 
-    gcs_uri = f"gs://{settings.gcs_bucket}/{blob_name}"
-    return gcs_uri
 
 def upload_plant_image(
     data: bytes,
@@ -48,23 +195,11 @@ def upload_plant_image(
     plant_id: int,
 ) -> str:
     """
-    Sube la imagen principal de una planta al mismo bucket,
-    pero en la carpeta foto_planta/, y devuelve la URI gs://.
+    Sube la imagen principal de una planta (carpeta foto_planta/) y devuelve
+    la URI gs://.
     """
-    client = get_storage_client()
-    bucket = client.bucket(settings.gcs_bucket)
-
-    ts = int(time.time())
-    file_id = uuid.uuid4().hex[:8]
-
-    # Ruta organizada por usuario/planta
-    blob_name = f"foto_planta/user-{user_id}/plant-{plant_id}/{ts}_{file_id}"
-
-    blob = bucket.blob(blob_name)
-    blob.upload_from_string(data, content_type=content_type)
+    return store_image(PLANT_IMAGES, data, content_type)
 
-    gcs_uri = f"gs://{settings.gcs_bucket}/{blob_name}"
-    return gcs_uri
 
 def upload_marketplace_item_image(
     data: bytes,
@@ -72,20 +207,48 @@ def upload_marketplace_item_image(
     item_id: int,
 ) -> str:
     """
-    Sube una imagen de artículo del marketplace al bucket configurado
-    y devuelve la URI gs://.
+    Sube una imagen de artículo del marketplace y devuelve su URI (gs://...).
+    El objeto no se hace público: las respuestas llevan una URL firmada
+    (app/services/image_urls.py).
     """
+    return store_image(MARKETPLACE_IMAGES, data, content_type)
+
+
+# --------- Imágenes de chat anteriores a las claves por contenido ---------
+def chat_session_prefix(user_id: int, session_id: int) -> str:
+    """Carpeta por sesión del esquema de nombres anterior (timestamp + uuid)."""
+    return f"fotos_chat/user-{user_id}/session-{session_id}/"
+
+
+def delete_prefixes(prefixes: Iterable[str]) -> int:
+    """
+    Borra todos los objetos bajo los prefijos dados (solo GCS), en lotes.
+    Devuelve cuántos objetos se mandaron a borrar.
+    """
+    backend = get_backend()
+    if backend.name != "gcs":
+        return 0
     client = get_storage_client()
-    bucket = client.bucket(settings.gcs_bucket)
+    keys = [
+        blob.name
+        for prefix in prefixes
+        for blob in client.list_blobs(backend.bucket, prefix=prefix)
+    ]
+    backend.delete_many(keys)
+    return len(keys)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Mantenimiento del almacenamiento de imágenes")
+    parser.add_argument("--sweep", action="store_true", help="borrar objetos sin referencias")
+    parser.add_argument("--batch", type=int, default=100)
+    args = parser.parse_args(argv)
 
-    ts = int(time.time())
-    file_id = uuid.uuid4().hex[:8]
+    logging.basicConfig(level=logging.INFO)
+    if args.sweep:
+        print(f"objetos borrados: {sweep_unreferenced(args.batch)}")
+    return 0
 
-    # Ruta organizada por artículo
-    blob_name = f"marketplace_items/item-{item_id}/{ts}_{file_id}"
 
-    blob = bucket.blob(blob_name)
-    blob.upload_from_string(data, content_type=content_type)
-    blob.make_public()
-    public_url = f"https://storage.googleapis.com/{settings.gcs_bucket}/{blob_name}"
-    return public_url
\ No newline at end of file
+if __name__ == "__main__":
+    raise SystemExit(main())
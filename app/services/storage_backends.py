@@ -0,0 +1,241 @@
+# app/services/storage_backends.py
+"""
+Backends de almacenamiento de objetos (imágenes) intercambiables.
+
+- GCSBackend: bucket settings.gcs_bucket (o STORAGE_EMULATOR_HOST).
+- LocalBackend: directorio settings.storage_local_root, para correr y medir
+  las subidas sin red (benchmarks/load.py --gcs local).
+
+Las claves son rutas relativas ("fotos_chat/ab/abcd...") y el backend decide
+la URI que se guarda en la base (gs://bucket/clave o file:///ruta/clave).
+put() no sobrescribe: si la clave ya existe no hace nada, que con claves por
+contenido (sha256) significa que los bytes son los mismos.
+
+read_urls() da URLs que un navegador puede cargar: firmadas V4 en GCS, la
+ruta /images/<clave> de la app con el backend local.
+"""
+import mmap
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    from google.cloud import storage
+
+# Máximo de operaciones por petición batch de la API JSON de GCS
+DELETE_BATCH_SIZE = 100
+# Firmas en paralelo cuando cada una es una llamada a IAM signBlob
+SIGN_WORKERS = 8
+
+# google.cloud.storage se importa en la primera subida, no al arrancar.
+_storage_client: Optional["storage.Client"] = None
+_storage_client_lock = threading.Lock()
+
+
+def get_storage_client() -> "storage.Client":
+    global _storage_client
+    if _storage_client is None:
+        with _storage_client_lock:
+            if _storage_client is None:
+                from google.cloud import storage
+
+                _storage_client = storage.Client(
+                    project=settings.project_id
+                )
+    return _storage_client
+
+
+class StorageBackend:
+    name = ""
+
+    def put(self, key: str, data: bytes, content_type: str) -> bool:
+        """Guarda el objeto si no existe. True si se escribió, False si ya estaba."""
+        raise NotImplementedError
+
+    def read(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        """Borra las claves; las que ya no existen se ignoran."""
+        raise NotImplementedError
+
+    def uri(self, key: str) -> str:
+        raise NotImplementedError
+
+    def read_urls(self, keys: List[str], expires_seconds: int) -> Dict[str, str]:
+        """URL de lectura para cada clave, válida al menos expires_seconds."""
+        raise NotImplementedError
+
+    def key_from_uri(self, uri: str) -> Optional[str]:
+        """Clave de una URI de este backend, o None si la URI no es suya."""
+        raise NotImplementedError
+
+
+class GCSBackend(StorageBackend):
+    name = "gcs"
+
+    def __init__(self, bucket_name: str):
+        self.bucket_name = bucket_name
+        self._prefixes = (
+            f"gs://{bucket_name}/",
+            f"https://storage.googleapis.com/{bucket_name}/",
+        )
+
+    @property
+    def bucket(self):
+        return get_storage_client().bucket(self.bucket_name)
+
+    def put(self, key: str, data: bytes, content_type: str) -> bool:
+        try:
+            # if_generation_match=0: solo crea; si ya existe GCS responde 412
+            self.bucket.blob(key).upload_from_string(
+                data, content_type=content_type, if_generation_match=0
+            )
+        except Exception as exc:
+            if getattr(exc, "code", None) == 412:  # google.api_core PreconditionFailed
+                return False
+            raise
+        return True
+
+    def read(self, key: str) -> bytes:
+        return self.bucket.blob(key).download_as_bytes()
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        client = get_storage_client()
+        bucket = self.bucket
+        keys = list(keys)
+        for start in range(0, len(keys), DELETE_BATCH_SIZE):
+            # Un round-trip por lote; un 404 (ya borrado) no aborta el resto
+            with client.batch(raise_exception=False):
+                for key in keys[start:start + DELETE_BATCH_SIZE]:
+                    bucket.blob(key).delete()
+
+    def uri(self, key: str) -> str:
+        return f"gs://{self.bucket_name}/{key}"
+
+    def _signing_kwargs(self) -> dict:
+        """
+        Argumentos de firma comunes al lote. Con una clave de cuenta de servicio
+        se firma en local; con las credenciales de Cloud Run (sin clave privada)
+        cada firma es una llamada a IAM signBlob con el token de acceso, que se
+        refresca una sola vez por lote.
+        """
+        credentials = getattr(get_storage_client(), "_credentials", None)
+        if credentials is None or hasattr(credentials, "sign_bytes"):
+            return {}
+        if not getattr(credentials, "service_account_email", None):
+            # Credenciales de usuario: generate_signed_url explica el error
+            return {}
+        if not credentials.valid:
+            from google.auth.transport.requests import Request
+
+            credentials.refresh(Request())
+        return {
+            "service_account_email": credentials.service_account_email,
+            "access_token": credentials.token,
+        }
+
+    def read_urls(self, keys: List[str], expires_seconds: int) -> Dict[str, str]:
+        emulator = os.getenv("STORAGE_EMULATOR_HOST")
+        if emulator:
+            # fake-gcs-server sirve los objetos en /<bucket>/<clave> sin firma
+            return {key: f"{emulator.rstrip('/')}/{self.bucket_name}/{key}" for key in keys}
+        bucket = self.bucket
+        kwargs = self._signing_kwargs()
+        expiration = timedelta(seconds=expires_seconds)
+
+        def sign(key: str) -> str:
+            return bucket.blob(key).generate_signed_url(
+                version="v4", method="GET", expiration=expiration, **kwargs
+            )
+
+        if not kwargs or len(keys) == 1:
+            return {key: sign(key) for key in keys}
+        with ThreadPoolExecutor(max_workers=min(SIGN_WORKERS, len(keys))) as pool:
+            return dict(zip(keys, pool.map(sign, keys)))
+
+    def key_from_uri(self, uri: str) -> Optional[str]:
+        for prefix in self._prefixes:
+            if uri.startswith(prefix):
+                return uri[len(prefix):]
+        return None
+
+
+class LocalBackend(StorageBackend):
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = Path(root).resolve()
+        self._prefix = f"file://{self.root}/"
+
+    def path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root not in path.parents:
+            raise ValueError(f"Clave fuera del directorio de almacenamiento: {key}")
+        return path
+
+    def put(self, key: str, data: bytes, content_type: str) -> bool:
+        path = self.path(key)
+        if path.exists():
+            return False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            # link() falla si otro proceso ya la creó: escritura atómica y sin pisar
+            os.link(tmp, path)
+        except FileExistsError:
+            return False
+        finally:
+            os.unlink(tmp)
+        return True
+
+    def read(self, key: str) -> bytes:
+        with open(self.path(key), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:]
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            try:
+                self.path(key).unlink()
+            except FileNotFoundError:
+                pass
+
+    def uri(self, key: str) -> str:
+        return f"{self._prefix}{key}"
+
+    def read_urls(self, keys: List[str], expires_seconds: int) -> Dict[str, str]:
+        # Sin firma: los sirve GET /images/<clave> (app/api/images.py)
+        return {key: f"/images/{key}" for key in keys}
+
+    def key_from_uri(self, uri: str) -> Optional[str]:
+        return uri[len(self._prefix):] if uri.startswith(self._prefix) else None
+
+
+_backend: Optional[StorageBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> StorageBackend:
+    """Backend según settings.storage_backend ("gcs" | "local")."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if settings.storage_backend == "local":
+                    _backend = LocalBackend(settings.storage_local_root)
+                elif settings.storage_backend == "gcs":
+                    _backend = GCSBackend(settings.gcs_bucket)
+                else:
+                    raise ValueError(f"STORAGE_BACKEND desconocido: {settings.storage_backend}")
+    return _backend
@@ -0,0 +1,11 @@
+# benchmarks/__init__.py
+import os
+
+# Valores mínimos para que Settings() cargue sin .env (los benchmarks no llaman a GCP).
+BENCH_ENV = {
+    "PROJECT_ID": "bench-project",
+    "VERTEX_LOCATION": "us-central1",
+    "VERTEX_MODEL_NAME": "gemini-bench",
+}
+for _key, _value in BENCH_ENV.items():
+    os.environ.setdefault(_key, _value)
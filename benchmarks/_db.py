@@ -0,0 +1,137 @@
+# benchmarks/_db.py
+"""
+Utilidades de base de datos para los benchmarks.
+
+throwaway_database() crea una base temporal en el mismo servidor que usa la
+app (variables DB_*), le crea el esquema con Base.metadata y la borra al
+salir. Nada de lo que hace un benchmark toca la base real.
+"""
+import contextlib
+import contextvars
+import re
+import threading
+import uuid
+from collections import defaultdict
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine, make_url
+
+from app.db import models  # noqa: F401  (registra las tablas)
+from app.db.base import Base
+from app.db import session as db_session
+
+_ID_RE = re.compile(r"/\d+")
+
+
+def endpoint_label(method: str, path: str) -> str:
+    """Etiqueta por endpoint: GET /plants/123/care-plan -> GET /plants/{id}/care-plan."""
+    return f"{method} {_ID_RE.sub('/{id}', path)}"
+
+
+@contextlib.contextmanager
+def throwaway_database(bind_app: bool = True):
+    """
+    Crea bench_<uuid>, aplica el esquema y (si bind_app) hace que SessionLocal
+    de la app apunte a ella. Al salir cierra conexiones y la borra.
+    """
+    base_url = make_url(db_session.SQLALCHEMY_DATABASE_URL)
+    name = f"bench_{uuid.uuid4().hex[:10]}"
+    admin = create_engine(base_url.set(database="postgres"), isolation_level="AUTOCOMMIT")
+    with admin.connect() as conn:
+        conn.execute(text(f'CREATE DATABASE "{name}"'))
+
+    engine = create_engine(base_url.set(database=name), **db_session._engine_kwargs())
+    previous = db_session._engine
+    try:
+        Base.metadata.create_all(engine)
+        if bind_app:
+            db_session._install_pool_listeners(engine)
+            db_session._engine = engine
+            db_session.SessionLocal.configure(bind=engine)
+        yield engine
+    finally:
+        if bind_app:
+            db_session._engine = previous
+            db_session.SessionLocal.configure(bind=previous)
+        engine.dispose()
+        with admin.connect() as conn:
+            conn.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+        admin.dispose()
+
+
+class QueryCounter:
+    """
+    Cuenta sentencias SQL, COMMIT/ROLLBACK (round-trips) y filas devueltas por
+    etiqueta. La etiqueta es un ContextVar: se fija con `counter.label(...)` o,
+    para peticiones HTTP, envolviendo la app con `counter.asgi(app)`.
+    """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.statements = defaultdict(int)
+        self.transactions = defaultdict(int)
+        self.rows = defaultdict(int)
+        self.captured = defaultdict(list)
+        self.capture = False
+        self._label: contextvars.ContextVar = contextvars.ContextVar("bench_label", default=None)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def label(self, name: str):
+        token = self._label.set(name)
+        try:
+            yield
+        finally:
+            self._label.reset(token)
+
+    def asgi(self, app):
+        """Envuelve una app ASGI para etiquetar cada petición como "MÉTODO /ruta/{id}"."""
+        async def wrapped(scope, receive, send):
+            if scope["type"] != "http":
+                return await app(scope, receive, send)
+            name = endpoint_label(scope["method"], scope["path"])
+            token = self._label.set(name)
+            try:
+                return await app(scope, receive, send)
+            finally:
+                self._label.reset(token)
+        return wrapped
+
+    def round_trips(self, name: str) -> int:
+        return self.statements[name] + self.transactions[name]
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        name = self._label.get()
+        if name is None:
+            return
+        with self._lock:
+            self.statements[name] += 1
+            if cursor.description is not None and cursor.rowcount and cursor.rowcount > 0:
+                self.rows[name] += cursor.rowcount
+            if self.capture and statement.lstrip().upper().startswith("SELECT"):
+                self.captured[name].append((statement, parameters))
+
+    def _end_tx(self, conn):
+        name = self._label.get()
+        if name is None:
+            return
+        with self._lock:
+            self.transactions[name] += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "after_cursor_execute", self._after)
+        event.listen(self.engine, "commit", self._end_tx)
+        event.listen(self.engine, "rollback", self._end_tx)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "after_cursor_execute", self._after)
+        event.remove(self.engine, "commit", self._end_tx)
+        event.remove(self.engine, "rollback", self._end_tx)
+
+
+def result_bytes(engine: Engine, statement: str, parameters) -> int:
+    """Tamaño aproximado (pg_column_size) de lo que devuelve una SELECT ya ejecutada."""
+    wrapped = f"SELECT coalesce(sum(pg_column_size(t.*)), 0) FROM ({statement}) AS t"
+    with engine.connect() as conn:
+        return int(conn.exec_driver_sql(wrapped, parameters).scalar() or 0)
@@ -0,0 +1,148 @@
+# benchmarks/auth_throughput.py
+"""
+Logins por segundo de POST /auth/login con contraseñas scrypt y SHA-256 antiguas.
+
+Uso:
+    python -m benchmarks.auth_throughput --concurrency 64 --duration 10
+    python -m benchmarks.auth_throughput --kdf-workers 2 --json auth.json
+
+Base temporal con --users usuarios por formato de hash. Para cada escenario
+lanza --concurrency clientes haciendo login durante --duration segundos y, en
+paralelo, sondea GET /health/pool para ver si el event loop sigue
+respondiendo mientras scrypt corre en el pool de procesos.
+
+Escenarios:
+  - scrypt: hashes actuales
+  - legacy: hashes SHA-256; el primer login de cada usuario lo re-hashea a
+    scrypt en segundo plano, así que la cifra mezcla ambos costes
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+from sqlalchemy.orm import Session
+
+from app.core import security
+from app.core.config import settings
+from app.db import models
+from app.main import app
+from benchmarks._db import throwaway_database
+
+PASSWORD = "bench-pass"
+
+
+def _percentiles(samples: list) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 2)
+
+    return {"n": len(ordered), "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99),
+            "mean_ms": round(statistics.fmean(ordered) * 1000, 2)}
+
+
+def seed(engine, n_users: int) -> dict:
+    scrypt_hash = security.hash_password(PASSWORD)
+    legacy_hash = security._legacy_hash(PASSWORD)
+    with Session(engine) as db:
+        for prefix, password_hash in (("scrypt", scrypt_hash), ("legacy", legacy_hash)):
+            db.add_all(
+                models.User(name=f"{prefix} {i}", email=f"{prefix}{i}@example.com",
+                            username=f"{prefix}{i}", password_hash=password_hash)
+                for i in range(n_users)
+            )
+        db.commit()
+    return {"scrypt": [f"scrypt{i}" for i in range(n_users)],
+            "legacy": [f"legacy{i}" for i in range(n_users)]}
+
+
+async def _scenario(client, usernames, concurrency: int, duration: float) -> dict:
+    latencies, failures = [], 0
+    probe = []
+    deadline = time.perf_counter() + duration
+
+    async def worker(i: int):
+        nonlocal failures
+        j = i
+        while time.perf_counter() < deadline:
+            username = usernames[j % len(usernames)]
+            j += concurrency
+            start = time.perf_counter()
+            resp = await client.post("/auth/login", json={"identifier": username, "password": PASSWORD})
+            latencies.append(time.perf_counter() - start)
+            failures += resp.status_code != 200 or not resp.json()["ok"]
+
+    async def prober():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await client.get("/health/pool")
+            probe.append(time.perf_counter() - start)
+            await asyncio.sleep(0.05)
+
+    started = time.perf_counter()
+    await asyncio.gather(prober(), *(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "logins": len(latencies),
+        "failures": failures,
+        "logins_per_s": round(len(latencies) / elapsed, 1),
+        "latency": _percentiles(latencies),
+        "health_probe_during_load": _percentiles(probe),
+    }
+
+
+def run(n_users: int, concurrency: int, duration: float) -> dict:
+    settings.rate_limit_enabled = False
+    with throwaway_database() as engine:
+        users = seed(engine, n_users)
+
+        async def main_async():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench",
+                                         timeout=None) as client:
+                # Arranca el pool de procesos antes de medir
+                await security.hash_password_async("warmup")
+                results = {}
+                for name in ("scrypt", "legacy"):
+                    results[name] = await _scenario(client, users[name], concurrency, duration)
+                return results
+
+        results = asyncio.run(main_async())
+    return {
+        "users_per_format": n_users,
+        "concurrency": concurrency,
+        "duration_s": duration,
+        "kdf_workers": settings.auth_kdf_workers or "cpu_count",
+        "results": results,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--kdf-workers", type=int, help="sobrescribe AUTH_KDF_WORKERS")
+    parser.add_argument("--json", dest="json_path")
+    args = parser.parse_args(argv)
+
+    if args.kdf_workers is not None:
+        settings.auth_kdf_workers = args.kdf_workers
+    result = run(args.users, args.concurrency, args.duration)
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(result, indent=2))
+    for name, r in result["results"].items():
+        print(f"{name:<7} {r['logins_per_s']:>8} logins/s  p95 {r['latency'].get('p95_ms')} ms  "
+              f"health p95 {r['health_probe_during_load'].get('p95_ms')} ms  fallos {r['failures']}")
+    return 0 if all(r["failures"] == 0 for r in result["results"].values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
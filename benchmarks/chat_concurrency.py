@@ -0,0 +1,141 @@
+# benchmarks/chat_concurrency.py
+"""
+Aislamiento del pool: latencia de endpoints que no son chat mientras hay
+muchos turnos de /chat/message esperando a Gemini.
+
+Uso:
+    python -m benchmarks.chat_concurrency --chats 200 --gemini-ms 5000
+    python -m benchmarks.chat_concurrency --json chat_concurrency.json
+
+Con Vertex falso (latencia lognormal de mediana --gemini-ms) y una base
+temporal, mide GET /marketplace/items y POST /auth/login primero en reposo y
+luego con --chats turnos en vuelo. Si el chat retuviera conexiones o hilos
+durante la llamada al modelo, la latencia "under_load" se dispararía (o
+aparecerían timeouts del pool).
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+from sqlalchemy.orm import Session
+
+from app.core.security import hash_password
+from app.db import models
+from app.db.session import get_pool_stats
+from app.main import app
+from benchmarks._db import throwaway_database
+from benchmarks.fakes import FakeModel, Latency, install_fake_vertex
+
+PROBES = [
+    ("GET", "/marketplace/items", None),
+    ("POST", "/auth/login", {"identifier": "bench", "password": "bench-pass"}),
+]
+
+
+def _percentiles(samples: list) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 2)
+
+    return {"n": len(ordered), "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99),
+            "mean_ms": round(statistics.fmean(ordered) * 1000, 2)}
+
+
+async def _probe(client: httpx.AsyncClient, duration: float) -> dict:
+    timings = {f"{m} {p}": [] for m, p, _ in PROBES}
+    errors = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        for method, path, body in PROBES:
+            start = time.perf_counter()
+            resp = await client.request(method, path, json=body)
+            timings[f"{method} {path}"].append(time.perf_counter() - start)
+            errors += resp.status_code >= 500
+        await asyncio.sleep(0.01)
+    return {"errors": errors, **{k: _percentiles(v) for k, v in timings.items()}}
+
+
+async def _run(n_chats: int, gemini_ms: float, probe_seconds: float, user_id: int) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench",
+                                 timeout=None) as client:
+        idle = await _probe(client, probe_seconds)
+
+        max_checked_out = 0
+
+        async def chat(i: int):
+            resp = await client.post("/chat/message", json={
+                "message": f"¿Cómo cuido mi monstera? ({i})", "user_id": user_id,
+            })
+            return resp.status_code
+
+        async def watch_pool():
+            nonlocal max_checked_out
+            while True:
+                max_checked_out = max(max_checked_out, get_pool_stats()["checked_out"])
+                await asyncio.sleep(0.005)
+
+        watcher = asyncio.create_task(watch_pool())
+        start = time.perf_counter()
+        chats = asyncio.gather(*(chat(i) for i in range(n_chats)))
+        # Dejar que los chats lleguen a la llamada al modelo antes de medir
+        await asyncio.sleep(min(0.5, gemini_ms / 4000))
+        under_load = await _probe(client, probe_seconds)
+        statuses = await chats
+        chat_seconds = time.perf_counter() - start
+        watcher.cancel()
+
+    return {
+        "chats": n_chats,
+        "gemini_median_ms": gemini_ms,
+        "idle": idle,
+        "under_load": under_load,
+        "chat_ok": sum(1 for s in statuses if s == 200),
+        "chat_failed": sum(1 for s in statuses if s != 200),
+        "chat_wall_s": round(chat_seconds, 2),
+        "pool_max_checked_out": max_checked_out,
+        "pool": get_pool_stats(),
+    }
+
+
+def run(n_chats: int, gemini_ms: float, probe_seconds: float) -> dict:
+    install_fake_vertex(FakeModel(latency=Latency(median_ms=gemini_ms, sigma=0.3, seed=1)))
+    with throwaway_database() as engine:
+        with Session(engine) as db:
+            user = models.User(name="Bench", email="bench@example.com", username="bench",
+                               password_hash=hash_password("bench-pass"))
+            db.add(user)
+            db.add_all(
+                models.MarketplaceItem(name=f"Item {i}", price=10, category="plant", stock=10)
+                for i in range(50)
+            )
+            db.commit()
+            user_id = user.id
+        return asyncio.run(_run(n_chats, gemini_ms, probe_seconds, user_id))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--gemini-ms", type=float, default=5000)
+    parser.add_argument("--probe-seconds", type=float, default=3)
+    parser.add_argument("--json", dest="json_path")
+    args = parser.parse_args(argv)
+
+    result = run(args.chats, args.gemini_ms, args.probe_seconds)
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(result, indent=2))
+    print(json.dumps(result, indent=2))
+    return 0 if result["chat_failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# benchmarks/chat_roundtrips.py
+"""
+Round-trips a la base por turno de POST /chat/message.
+
+Uso:
+    python -m benchmarks.chat_roundtrips
+    python -m benchmarks.chat_roundtrips --json chat_roundtrips.json
+
+Corre la app real contra una base temporal con Vertex falso
+(benchmarks/fakes.py) y cuenta, por escenario, sentencias SQL y
+COMMIT/ROLLBACK. Para comparar con otra versión, ejecutarlo en cada commit
+y comparar los JSON.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from app.db import models
+from app.main import app
+from benchmarks._db import QueryCounter, throwaway_database
+from benchmarks.fakes import analysis_for, install_fake_vertex
+
+SCENARIOS = [
+    # (nombre, análisis que devuelve el modelo, ¿sesión nueva?)
+    ("new session, care_plan (creates plant + plan)", analysis_for("care_plan"), True),
+    ("existing session, care_plan (plan already saved)", analysis_for("care_plan"), False),
+    ("existing session, general question", analysis_for("general"), False),
+    ("existing session, clarification", {
+        **analysis_for("recommend"),
+        "need_clarification": True,
+        "missing_fields": ["location"],
+        "clarification_question": "¿En qué ciudad estás?",
+    }, False),
+]
+
+
+def run() -> dict:
+    fake = install_fake_vertex()
+    with throwaway_database() as engine:
+        with Session(engine) as db:
+            user = models.User(name="Bench", email="bench@example.com", username="bench")
+            db.add(user)
+            db.commit()
+            user_id = user.id
+
+        results = []
+        session_id = None
+        with QueryCounter(engine) as counter:
+            client = TestClient(counter.asgi(app))
+            for name, analysis, new_session in SCENARIOS:
+                fake.analysis = analysis
+                label = "POST /chat/message"
+                before_s = counter.statements[label]
+                before_t = counter.transactions[label]
+                body = {"message": "¿Cómo cuido mi monstera?", "user_id": user_id}
+                if not new_session:
+                    body["session_id"] = session_id
+                resp = client.post("/chat/message", json=body)
+                resp.raise_for_status()
+                session_id = resp.json()["session_id"]
+                statements = counter.statements[label] - before_s
+                transactions = counter.transactions[label] - before_t
+                results.append({
+                    "scenario": name,
+                    "statements": statements,
+                    "transactions": transactions,
+                    "round_trips": statements + transactions,
+                })
+    return {"endpoint": "POST /chat/message", "results": results}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--json", dest="json_path")
+    args = parser.parse_args(argv)
+
+    result = run()
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(result, indent=2, ensure_ascii=False))
+    for r in result["results"]:
+        print(f"{r['round_trips']:>3} round-trips ({r['statements']} SQL, "
+              f"{r['transactions']} COMMIT/ROLLBACK)  {r['scenario']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# benchmarks/compare.py
+"""
+Compara dos reportes de benchmarks/load.py (base vs. nuevo).
+
+Uso:
+    python -m benchmarks.compare base.json nuevo.json
+    python -m benchmarks.compare base.json nuevo.json --threshold 15 --json diff.json
+
+Por endpoint muestra el cambio relativo de rps, p50/p95/p99 y round-trips a
+la base. Sale con código 1 si algún p95 empeora más de --threshold % o si
+sube el número de round-trips por petición (ruido de latencia aparte, esos
+son deterministas).
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+METRICS = ("rps", "p50_ms", "p95_ms", "p99_ms", "db_round_trips_per_request")
+
+
+def _change(old, new):
+    if not old:
+        return None
+    return round((new - old) / old * 100, 1)
+
+
+def compare(base: dict, new: dict, threshold: float) -> dict:
+    rows = []
+    regressions = []
+    for label in sorted(set(base["endpoints"]) | set(new["endpoints"])):
+        old_e = base["endpoints"].get(label)
+        new_e = new["endpoints"].get(label)
+        if old_e is None or new_e is None:
+            rows.append({"endpoint": label, "only_in": "new" if old_e is None else "base"})
+            continue
+        row = {"endpoint": label}
+        for metric in METRICS:
+            row[metric] = {"base": old_e[metric], "new": new_e[metric],
+                           "change_pct": _change(old_e[metric], new_e[metric])}
+        p95 = row["p95_ms"]["change_pct"]
+        if p95 is not None and p95 > threshold:
+            regressions.append(f"{label}: p95 {p95:+.1f}%")
+        if new_e["db_round_trips_per_request"] > old_e["db_round_trips_per_request"] + 0.05:
+            regressions.append(
+                f"{label}: round-trips {old_e['db_round_trips_per_request']} -> "
+                f"{new_e['db_round_trips_per_request']}"
+            )
+        rows.append(row)
+    return {
+        "base": base["meta"].get("commit"),
+        "new": new["meta"].get("commit"),
+        "threshold_pct": threshold,
+        "endpoints": rows,
+        "regressions": regressions,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10, help="%% de empeoramiento de p95 tolerado")
+    parser.add_argument("--json", dest="json_path")
+    args = parser.parse_args(argv)
+
+    result = compare(
+        json.loads(Path(args.base).read_text()),
+        json.loads(Path(args.new).read_text()),
+        args.threshold,
+    )
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(result, indent=2, ensure_ascii=False))
+
+    print(f"{result['base']} -> {result['new']}")
+    for row in result["endpoints"]:
+        if "only_in" in row:
+            print(f"{row['endpoint']:<40} solo en {row['only_in']}")
+            continue
+        cells = []
+        for metric in METRICS:
+            change = row[metric]["change_pct"]
+            cells.append(f"{metric.replace('_per_request', '')} {'n/a' if change is None else f'{change:+.1f}%'}")
+        print(f"{row['endpoint']:<40} " + "  ".join(cells))
+    for line in result["regressions"]:
+        print(f"REGRESIÓN {line}")
+    return 1 if result["regressions"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
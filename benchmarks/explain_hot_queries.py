@@ -0,0 +1,158 @@
+# benchmarks/explain_hot_queries.py
+"""
+Regresión de planes: comprueba con EXPLAIN que las consultas calientes de la
+API usan los índices de migrations/versions/0002 (y siguientes).
+
+Uso (contra una base migrada con `alembic upgrade head`):
+    python -m benchmarks.explain_hot_queries
+    python -m benchmarks.explain_hot_queries --json planes.json
+
+Con tablas pequeñas el planner prefiere un seq scan aunque exista el índice,
+así que se desactiva enable_seqscan dentro de la transacción: si la consulta
+*puede* usar el índice esperado, lo usará. Sale con código 1 si alguna no lo hace.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from sqlalchemy import func, select, text
+
+from app.db import models
+from app.db.session import get_engine
+
+INDEX_NODES = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+
+
+def hot_queries():
+    """(nombre, sentencia, índice esperado). Copian los filtros/orden de app/api y app/services."""
+    M = models
+    return [
+        (
+            "chat history / get_session_messages",
+            select(M.ChatMessage)
+            .where(M.ChatMessage.session_id == 1)
+            .order_by(M.ChatMessage.created_at.asc()),
+            "ix_chat_messages_session_created",
+        ),
+        (
+            "list_user_sessions: first user message",
+            select(M.ChatMessage)
+            .where(M.ChatMessage.session_id == 1, M.ChatMessage.sender == "user")
+            .order_by(M.ChatMessage.created_at.asc())
+            .limit(1),
+            "ix_chat_messages_session_user_created",
+        ),
+        (
+            "list_user_sessions",
+            select(M.ChatSession)
+            .where(M.ChatSession.user_id == 1)
+            .order_by(M.ChatSession.last_activity_at.desc()),
+            "ix_chat_sessions_user_activity",
+        ),
+        (
+            "list_plants",
+            select(M.Plant)
+            .where(M.Plant.user_id == 1, M.Plant.status == "active")
+            .order_by(M.Plant.created_at.desc()),
+            "ix_plants_user_active_created",
+        ),
+        (
+            "ensure_plant_for_user",
+            select(M.Plant)
+            .where(
+                M.Plant.user_id == 1,
+                func.lower(M.Plant.common_name) == "monstera",
+                M.Plant.status == "active",
+            )
+            .limit(1),
+            "ix_plants_user_active_lower_name",
+        ),
+        (
+            "find_care_plan",
+            select(M.CarePlan)
+            .where(M.CarePlan.user_id == 1, M.CarePlan.plant_id == 1)
+            .order_by(M.CarePlan.created_at.desc())
+            .limit(1),
+            "ix_care_plans_user_plant_created",
+        ),
+        (
+            "get_latest_care_plan",
+            select(M.CarePlan)
+            .where(M.CarePlan.plant_id == 1)
+            .order_by(M.CarePlan.created_at.desc())
+            .limit(1),
+            "ix_care_plans_plant_created",
+        ),
+        (
+            "orders by user",
+            select(M.Order)
+            .where(M.Order.user_id == 1)
+            .order_by(M.Order.created_at.desc()),
+            "ix_orders_user_created",
+        ),
+        (
+            "login by email",
+            select(M.User).where(func.lower(M.User.email) == "a@b.co").limit(1),
+            "ix_users_lower_email",
+        ),
+        (
+            "marketplace get_items by category",
+            select(M.MarketplaceItem)
+            .where(M.MarketplaceItem.is_active == True, M.MarketplaceItem.category == "plant")  # noqa: E712
+            .limit(100),
+            "ix_marketplace_items_active_category",
+        ),
+    ]
+
+
+def _index_nodes(plan: dict):
+    if plan.get("Node Type") in INDEX_NODES:
+        yield plan.get("Index Name")
+    for child in plan.get("Plans", []) or []:
+        yield from _index_nodes(child)
+
+
+def explain_all() -> list:
+    engine = get_engine()
+    results = []
+    with engine.connect() as conn:
+        for name, stmt, expected in hot_queries():
+            compiled = stmt.compile(engine, compile_kwargs={"literal_binds": True})
+            with conn.begin() as tx:
+                conn.execute(text("SET LOCAL enable_seqscan = off"))
+                plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}")).scalar()
+                tx.rollback()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            used = [i for i in _index_nodes(plan[0]["Plan"]) if i]
+            results.append({
+                "query": name,
+                "expected_index": expected,
+                "indexes_used": used,
+                "ok": expected in used,
+                "plan": plan[0]["Plan"],
+            })
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--json", dest="json_path", help="escribe los planes en este fichero")
+    args = parser.parse_args(argv)
+
+    results = explain_all()
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(results, indent=2, default=str))
+
+    failed = 0
+    for r in results:
+        mark = "ok  " if r["ok"] else "FAIL"
+        used = ", ".join(r["indexes_used"]) or "seq scan"
+        print(f"[{mark}] {r['query']}: esperado {r['expected_index']}, usa {used}")
+        failed += not r["ok"]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
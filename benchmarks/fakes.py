@@ -0,0 +1,207 @@
+# benchmarks/fakes.py
+"""
+Dobles de Vertex AI y Cloud Storage para correr la app sin red ni credenciales.
+
+install_fake_vertex() sustituye los modelos de app.core.vertex_client por
+FakeModel, que responde según el tipo de prompt (instrucciones de sistema +
+prompt):
+  - análisis de intención -> JSON de análisis (modo configurable)
+  - plan de cuidado       -> JSON de CarePlanSchema
+  - cualquier otro        -> texto de respuesta
+
+install_fake_storage() sustituye el cliente de app.services.storage_backends
+por uno en memoria (para un emulador real o disco local, ver benchmarks/load.py
+--gcs emulator | local).
+"""
+import asyncio
+import contextlib
+import json
+import random
+import time
+from types import SimpleNamespace
+
+from app.core import vertex_client
+from app.services import storage_backends
+
+ANALYSIS_MARKER = "SOLO clasifica"
+CARE_PLAN_MARKER = '"riego"'
+
+FAKE_PLAN = {
+    "riego": {"frecuencia": "cada 7 días", "detalle": "Regar cuando el sustrato esté seco."},
+    "luz": {"frecuencia": "", "detalle": "Luz indirecta brillante."},
+    "temperatura": "18-27 °C",
+    "humedad": "media",
+    "fertilizacion": {"frecuencia": "cada 30 días", "detalle": "Fertilizante balanceado."},
+    "poda": "Retirar hojas secas.",
+    "plagas": "Revisar cochinilla.",
+    "alertas": [],
+}
+
+
+def analysis_for(mode: str = "care_plan", plant_name: str | None = "Monstera") -> dict:
+    return {
+        "mode": mode,
+        "location": "Bogotá, apartamento",
+        "time": None,
+        "humidity": "media",
+        "light": "luz indirecta",
+        "temperature": None,
+        "plant_name": plant_name if mode in ("care_plan", "identify") else None,
+        "need_clarification": False,
+        "missing_fields": [],
+        "clarification_question": None,
+    }
+
+
+class Latency:
+    """Latencia simulada: lognormal alrededor de `median_ms` (cola larga, como un LLM real)."""
+
+    def __init__(self, median_ms: float = 0.0, sigma: float = 0.5, seed: int | None = None):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self._rng = random.Random(seed)
+
+    def sample(self) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        return self.median_ms * self._rng.lognormvariate(0, self.sigma) / 1000
+
+
+class FakeModel:
+    def __init__(self, analysis: dict | None = None, latency: Latency | None = None,
+                 reply_chars: int = 600):
+        self.analysis = analysis or analysis_for()
+        self.latency = latency or Latency()
+        self.reply_chars = reply_chars
+        self.calls = 0
+
+    def _prompt_text(self, contents) -> str:
+        if isinstance(contents, str):
+            return contents
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        return "\n".join(str(getattr(p, "text", p)) for p in parts)
+
+    def _answer(self, prompt: str) -> str:
+        if ANALYSIS_MARKER in prompt:
+            return json.dumps(self.analysis, ensure_ascii=False)
+        if CARE_PLAN_MARKER in prompt:
+            return json.dumps(FAKE_PLAN, ensure_ascii=False)
+        return ("Claro, te cuento cómo cuidar tu planta. " * 20)[: self.reply_chars]
+
+    def _response(self, prompt: str):
+        text = self._answer(prompt)
+        return SimpleNamespace(
+            text=text,
+            candidates=[SimpleNamespace(
+                content=SimpleNamespace(parts=[SimpleNamespace(text=text)]),
+                finish_reason="STOP",
+            )],
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=len(prompt) // 4,
+                candidates_token_count=len(text) // 4,
+                total_token_count=(len(prompt) + len(text)) // 4,
+                cached_content_token_count=0,
+            ),
+        )
+
+    def generate_content(self, contents, instructions: str | None = None, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency.sample())
+        return self._response(f"{instructions or ''}\n{self._prompt_text(contents)}")
+
+    async def generate_content_async(self, contents, instructions: str | None = None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency.sample())
+        return self._response(f"{instructions or ''}\n{self._prompt_text(contents)}")
+
+
+class _InstructedModel:
+    """FakeModel con unas instrucciones de sistema fijas (como GenerativeModel(system_instruction=...))."""
+
+    def __init__(self, model: FakeModel, instructions: str | None):
+        self.model = model
+        self.instructions = instructions
+
+    def generate_content(self, contents, **kwargs):
+        return self.model.generate_content(contents, instructions=self.instructions, **kwargs)
+
+    async def generate_content_async(self, contents, **kwargs):
+        return await self.model.generate_content_async(contents, instructions=self.instructions, **kwargs)
+
+
+def install_fake_vertex(model: FakeModel | None = None) -> FakeModel:
+    """Instala el doble en lugar de los modelos de Vertex (no se importa el SDK ni se crean cachés)."""
+    model = model or FakeModel()
+    vertex_client._vertex_ready = True
+    vertex_client._models.clear()
+    vertex_client._new_model = (
+        lambda model_name, instructions=None, cached_content=None: _InstructedModel(model, instructions)
+    )
+    vertex_client.settings.vertex_context_cache_enabled = False
+    return model
+
+
+class FakePreconditionFailed(Exception):
+    """Como google.api_core.exceptions.PreconditionFailed (GCSBackend mira .code)."""
+    code = 412
+
+
+class FakeBlob:
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+
+    def upload_from_string(
+        self, data: bytes, content_type: str | None = None, if_generation_match: int | None = None
+    ):
+        time.sleep(self.bucket.client.latency.sample())
+        if if_generation_match == 0 and self.name in self.bucket.objects:
+            raise FakePreconditionFailed(self.name)
+        self.bucket.objects[self.name] = (bytes(data), content_type)
+
+    def download_as_bytes(self) -> bytes:
+        time.sleep(self.bucket.client.latency.sample())
+        return self.bucket.objects[self.name][0]
+
+    def generate_signed_url(self, version: str = "v4", method: str = "GET", expiration=None, **kwargs) -> str:
+        # Firma local (como con clave de cuenta de servicio): sin latencia de red
+        expires = int(expiration.total_seconds()) if expiration is not None else 3600
+        return f"https://fake-gcs/{self.bucket.name}/{self.name}?X-Goog-Expires={expires}"
+
+    def delete(self):
+        self.bucket.objects.pop(self.name, None)
+
+
+class FakeBucket:
+    def __init__(self, client: "FakeStorageClient", name: str):
+        self.client = client
+        self.name = name
+        self.objects: dict = {}
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+
+class FakeStorageClient:
+    def __init__(self, latency: Latency | None = None):
+        self.latency = latency or Latency()
+        self.buckets: dict = {}
+
+    def bucket(self, name: str) -> FakeBucket:
+        if name not in self.buckets:
+            self.buckets[name] = FakeBucket(self, name)
+        return self.buckets[name]
+
+    def list_blobs(self, bucket: FakeBucket, prefix: str = ""):
+        return [FakeBlob(bucket, name) for name in list(bucket.objects) if name.startswith(prefix)]
+
+    def batch(self, raise_exception: bool = True):
+        return contextlib.nullcontext()
+
+
+def install_fake_storage(client: FakeStorageClient | None = None) -> FakeStorageClient:
+    """Instala el doble como cliente global de GCS (no se importa google.cloud.storage)."""
+    client = client or FakeStorageClient()
+    storage_backends._storage_client = client
+    storage_backends._backend = None
+    return client
@@ -0,0 +1,127 @@
+# benchmarks/importtime.py
+"""
+Mide el coste de importación en frío de la app con `python -X importtime`.
+
+Uso:
+    python -m benchmarks.importtime                      # resumen legible
+    python -m benchmarks.importtime --json out.json      # resultado para comparar entre commits
+    python -m benchmarks.importtime --max-ms 800         # falla (exit 1) si se supera el umbral
+
+Cada ejecución lanza un intérprete nuevo (sin caché de módulos en memoria),
+repite la medición `--runs` veces y se queda con la mediana. Los módulos más
+caros se reportan por tiempo acumulado (incluye sus dependencias).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+from benchmarks import BENCH_ENV
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Módulos que NO deberían cargarse al importar la app (se difieren a la primera llamada).
+DEFERRED_MODULES = ("vertexai", "google.cloud.aiplatform", "google.cloud.storage")
+
+
+def _run_once(target: str) -> dict:
+    env = {**BENCH_ENV, **os.environ}
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        # importtime escribe en stderr; si el import falla el traceback también va ahí
+        tail = "\n".join(proc.stderr.splitlines()[-15:])
+        raise RuntimeError(f"No se pudo importar {target}:\n{tail}")
+
+    modules = {}
+    for line in proc.stderr.splitlines():
+        # Formato: "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, rest = line.split(":", 1)
+        self_us, cumulative_us, name = (p.strip() for p in rest.split("|", 2))
+        modules[name.strip()] = {
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+        }
+
+    total_us = modules.get(target, {}).get("cumulative_us")
+    if total_us is None:
+        total_us = sum(m["self_us"] for m in modules.values())
+    return {"total_us": total_us, "modules": modules}
+
+
+def measure(target: str, runs: int, top: int) -> dict:
+    samples = [_run_once(target) for _ in range(runs)]
+    totals = [s["total_us"] for s in samples]
+    median_sample = sorted(samples, key=lambda s: s["total_us"])[len(samples) // 2]
+
+    heaviest = sorted(
+        median_sample["modules"].items(),
+        key=lambda kv: kv[1]["cumulative_us"],
+        reverse=True,
+    )
+    loaded_deferred = sorted(
+        name
+        for name in median_sample["modules"]
+        if any(name == d or name.startswith(d + ".") for d in DEFERRED_MODULES)
+    )
+
+    return {
+        "target": target,
+        "python": sys.version.split()[0],
+        "runs": runs,
+        "total_ms_median": round(statistics.median(totals) / 1000, 2),
+        "total_ms_min": round(min(totals) / 1000, 2),
+        "total_ms_max": round(max(totals) / 1000, 2),
+        "module_count": len(median_sample["modules"]),
+        "top_modules": [
+            {"module": name, "cumulative_ms": round(m["cumulative_us"] / 1000, 2)}
+            for name, m in heaviest[:top]
+        ],
+        "deferred_modules_loaded": loaded_deferred,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--target", default="app.main", help="módulo a importar")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", dest="json_path", help="escribe el resultado en este fichero")
+    parser.add_argument("--max-ms", type=float, help="umbral de regresión (mediana)")
+    args = parser.parse_args(argv)
+
+    result = measure(args.target, args.runs, args.top)
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(result, indent=2))
+
+    print(f"import {result['target']}: {result['total_ms_median']} ms "
+          f"(min {result['total_ms_min']}, max {result['total_ms_max']}, "
+          f"{result['module_count']} módulos, {result['runs']} runs)")
+    for m in result["top_modules"]:
+        print(f"  {m['cumulative_ms']:>9.2f} ms  {m['module']}")
+
+    failed = False
+    if result["deferred_modules_loaded"]:
+        print("ERROR: módulos que deberían diferirse se cargaron en el import:")
+        for name in result["deferred_modules_loaded"][:10]:
+            print(f"  - {name}")
+        failed = True
+    if args.max_ms is not None and result["total_ms_median"] > args.max_ms:
+        print(f"ERROR: {result['total_ms_median']} ms supera el umbral de {args.max_ms} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,401 @@
+# benchmarks/load.py
+"""
+Prueba de carga offline con una mezcla realista de peticiones a todos los routers.
+
+Uso:
+    python -m benchmarks.load --duration 60 --concurrency 50 --json load.json
+    python -m benchmarks.load --mix chat=40,auth_login=10 --gemini-ms 2500
+    STORAGE_EMULATOR_HOST=http://localhost:4443 python -m benchmarks.load --gcs emulator
+    python -m benchmarks.load --gcs local
+
+Todo corre en el proceso (httpx.ASGITransport) contra una base temporal
+(benchmarks/_db.py), con Vertex falso de latencia lognormal (--gemini-ms,
+--gemini-sigma) y GCS en memoria, un emulador (fake-gcs-server:
+`docker run -p 4443:4443 fsouza/fake-gcs-server -scheme http`) o el backend
+de disco local (STORAGE_BACKEND=local, en un directorio temporal).
+
+Por endpoint reporta peticiones, errores, throughput, p50/p95/p99 y
+round-trips a la base por petición (sentencias + COMMIT/ROLLBACK). Para
+comparar dos commits: benchmarks/compare.py base.json nuevo.json.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.security import hash_password
+from app.db import models
+from app.db.session import get_pool_stats
+from app.main import app
+from app.services import storage_backends
+from app.services.storage import get_storage_client
+from benchmarks._db import QueryCounter, endpoint_label, throwaway_database
+from benchmarks.fakes import (
+    ANALYSIS_MARKER,
+    FAKE_PLAN,
+    FakeModel,
+    FakeStorageClient,
+    Latency,
+    analysis_for,
+    install_fake_storage,
+    install_fake_vertex,
+)
+
+PASSWORD = "bench-pass"
+PLANT_NAMES = ["Monstera", "Pothos", "Sansevieria", "Ficus lyrata", "Calathea", "Aloe vera"]
+CHAT_MODES = ["care_plan", "care_plan", "general", "recommend", "identify"]
+FAKE_IMAGE = os.urandom(180_000)
+
+# Pesos por operación (relativos)
+DEFAULT_MIX = {
+    "chat": 15,
+    "upload_images": 3,
+    "plants_list": 20,
+    "plant_get": 10,
+    "plant_care_plan": 8,
+    "plant_create": 3,
+    "plant_patch": 3,
+    "plant_image": 2,
+    "marketplace_items": 15,
+    "marketplace_order": 4,
+    "auth_login": 17,
+}
+
+
+class MixedModel(FakeModel):
+    """FakeModel que varía el modo y la planta en cada análisis."""
+
+    def __init__(self, rng: random.Random, **kwargs):
+        super().__init__(**kwargs)
+        self.rng = rng
+
+    def _answer(self, prompt: str) -> str:
+        if ANALYSIS_MARKER in prompt:
+            self.analysis = analysis_for(self.rng.choice(CHAT_MODES), self.rng.choice(PLANT_NAMES))
+        return super()._answer(prompt)
+
+
+# --------- Operaciones ---------
+async def op_chat(client, rng, user):
+    body = {"message": f"¿Cómo cuido mi {rng.choice(PLANT_NAMES)}?", "user_id": user["id"]}
+    if user["session_id"] is not None and rng.random() < 0.8:
+        body["session_id"] = user["session_id"]
+    resp = await client.post("/chat/message", json=body)
+    if resp.status_code == 200:
+        user["session_id"] = resp.json()["session_id"]
+    return resp
+
+
+async def op_upload_images(client, rng, user):
+    data = {"user_id": str(user["id"])}
+    if user["session_id"] is not None:
+        data["session_id"] = str(user["session_id"])
+    files = [("files", (f"foto{i}.jpg", FAKE_IMAGE, "image/jpeg")) for i in range(rng.randint(1, 3))]
+    return await client.post("/chat/upload-images", data=data, files=files)
+
+
+async def op_plants_list(client, rng, user):
+    return await client.get("/plants/", params={"user_id": user["id"]})
+
+
+async def op_plant_get(client, rng, user):
+    return await client.get(f"/plants/{rng.choice(user['plant_ids'])}")
+
+
+async def op_plant_care_plan(client, rng, user):
+    return await client.get(f"/plants/{rng.choice(user['plant_ids'])}/care-plan")
+
+
+async def op_plant_create(client, rng, user):
+    resp = await client.post("/plants/", json={
+        "user_id": user["id"],
+        "common_name": rng.choice(PLANT_NAMES),
+        "location": "Bogotá, apartamento",
+        "light": "luz indirecta",
+    })
+    if resp.status_code == 200:
+        user["plant_ids"].append(resp.json()["id"])
+    return resp
+
+
+async def op_plant_patch(client, rng, user):
+    return await client.patch(
+        f"/plants/{rng.choice(user['plant_ids'])}",
+        json={"notes": f"Regada el {datetime.utcnow():%Y-%m-%d}"},
+    )
+
+
+async def op_plant_image(client, rng, user):
+    return await client.post(
+        f"/plants/{rng.choice(user['plant_ids'])}/image",
+        files={"file": ("planta.jpg", FAKE_IMAGE, "image/jpeg")},
+    )
+
+
+async def op_marketplace_items(client, rng, user):
+    return await client.get("/marketplace/items")
+
+
+async def op_marketplace_order(client, rng, user, item_ids=()):
+    items = rng.sample(item_ids, k=min(len(item_ids), rng.randint(1, 3)))
+    return await client.post("/marketplace/orders", json={
+        "user_id": user["id"],
+        "items": [{"item_id": i, "quantity": 1} for i in items],
+        "shipping_address": "Calle 1 # 2-3",
+        "payment_method": "card",
+    })
+
+
+async def op_auth_login(client, rng, user):
+    return await client.post(
+        "/auth/login", json={"identifier": user["username"], "password": PASSWORD}
+    )
+
+
+OPERATIONS = {
+    "chat": op_chat,
+    "upload_images": op_upload_images,
+    "plants_list": op_plants_list,
+    "plant_get": op_plant_get,
+    "plant_care_plan": op_plant_care_plan,
+    "plant_create": op_plant_create,
+    "plant_patch": op_plant_patch,
+    "plant_image": op_plant_image,
+    "marketplace_items": op_marketplace_items,
+    "marketplace_order": op_marketplace_order,
+    "auth_login": op_auth_login,
+}
+
+
+# --------- Siembra ---------
+def seed(engine, n_users: int, plants_per_user: int, n_items: int):
+    password_hash = hash_password(PASSWORD)
+    with Session(engine) as db:
+        users = [
+            models.User(name=f"Bench {i}", email=f"bench{i}@example.com",
+                        username=f"bench{i}", password_hash=password_hash)
+            for i in range(n_users)
+        ]
+        db.add_all(users)
+        items = [
+            models.MarketplaceItem(name=f"Item {i}", price=10 + i % 40,
+                                   category=("plant", "pot", "soil")[i % 3], stock=1_000_000)
+            for i in range(n_items)
+        ]
+        db.add_all(items)
+        db.flush()
+
+        pool = []
+        for user in users:
+            plants = [
+                models.Plant(user_id=user.id, common_name=PLANT_NAMES[j % len(PLANT_NAMES)],
+                             location="Bogotá, apartamento", light="luz indirecta")
+                for j in range(plants_per_user)
+            ]
+            db.add_all(plants)
+            db.flush()
+            db.add_all(
+                models.CarePlan(user_id=user.id, plant_id=p.id, plant_name=p.common_name,
+                                plan_json=FAKE_PLAN)
+                for p in plants
+            )
+            pool.append({"id": user.id, "username": user.username,
+                         "plant_ids": [p.id for p in plants], "session_id": None})
+        db.commit()
+        return pool, [i.id for i in items]
+
+
+def _setup_gcs(mode: str, gcs_ms: float, seed_value: int) -> str:
+    if mode == "emulator":
+        if not os.getenv("STORAGE_EMULATOR_HOST"):
+            raise SystemExit("--gcs emulator requiere STORAGE_EMULATOR_HOST (p. ej. http://localhost:4443)")
+        settings.gcs_bucket = settings.gcs_bucket or "bench-bucket"
+        client = get_storage_client()
+        if client.lookup_bucket(settings.gcs_bucket) is None:
+            client.create_bucket(settings.gcs_bucket)
+        return f"emulator:{os.environ['STORAGE_EMULATOR_HOST']}"
+    if mode == "local":
+        settings.storage_backend = "local"
+        settings.storage_local_root = tempfile.mkdtemp(prefix="bench-storage-")
+        storage_backends._backend = None
+        return f"local:{settings.storage_local_root}"
+    settings.gcs_bucket = settings.gcs_bucket or "bench-bucket"
+    install_fake_storage(FakeStorageClient(Latency(median_ms=gcs_ms, sigma=0.4, seed=seed_value + 1)))
+    return "memory"
+
+
+# --------- Ejecución ---------
+def _percentiles(samples: list) -> dict:
+    ordered = sorted(samples)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 2)
+
+    return {"p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99),
+            "mean_ms": round(statistics.fmean(ordered) * 1000, 2),
+            "max_ms": round(ordered[-1] * 1000, 2)}
+
+
+async def _drive(client, users, item_ids, mix, duration, concurrency, rng_seed, record):
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    deadline = time.perf_counter() + duration
+
+    async def worker(i: int):
+        rng = random.Random(rng_seed * 1000 + i)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            user = rng.choice(users)
+            op = OPERATIONS[name]
+            start = time.perf_counter()
+            try:
+                if name == "marketplace_order":
+                    resp = await op(client, rng, user, item_ids)
+                else:
+                    resp = await op(client, rng, user)
+                status = resp.status_code
+                label = endpoint_label(resp.request.method, resp.request.url.path)
+            except Exception as exc:  # error de transporte o de la app sin capturar
+                status = type(exc).__name__
+                label = name
+            if record is not None:
+                record(label, time.perf_counter() - start, status)
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+
+
+def run(args) -> dict:
+    rng = random.Random(args.seed)
+    install_fake_vertex(MixedModel(
+        rng, latency=Latency(median_ms=args.gemini_ms, sigma=args.gemini_sigma, seed=args.seed),
+    ))
+    gcs = _setup_gcs(args.gcs, args.gcs_ms, args.seed)
+    # La carga es deliberadamente más alta que los límites por usuario
+    settings.rate_limit_enabled = False
+
+    mix = dict(DEFAULT_MIX)
+    if args.mix:
+        mix = {}
+        for part in args.mix.split(","):
+            name, _, weight = part.partition("=")
+            if name.strip() not in OPERATIONS:
+                raise SystemExit(f"Operación desconocida: {name} (opciones: {', '.join(OPERATIONS)})")
+            mix[name.strip()] = float(weight or 1)
+
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(label, seconds, status):
+        latencies[label].append(seconds)
+        statuses[label][str(status)] += 1
+
+    with throwaway_database() as engine:
+        users, item_ids = seed(engine, args.users, args.plants_per_user, args.items)
+
+        async def main_async():
+            with QueryCounter(engine) as counter:
+                transport = httpx.ASGITransport(app=counter.asgi(app))
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench",
+                                             timeout=None) as client:
+                    if args.warmup:
+                        await _drive(client, users, item_ids, mix, args.warmup,
+                                     args.concurrency, args.seed + 7, None)
+                    counter.statements.clear()
+                    counter.transactions.clear()
+                    started = time.perf_counter()
+                    await _drive(client, users, item_ids, mix, args.duration,
+                                 args.concurrency, args.seed, record)
+                    elapsed = time.perf_counter() - started
+            return counter, elapsed
+
+        counter, elapsed = asyncio.run(main_async())
+        pool = get_pool_stats()
+
+    endpoints = {}
+    for label in sorted(latencies):
+        samples = latencies[label]
+        ok = sum(n for s, n in statuses[label].items() if s.isdigit() and int(s) < 400)
+        endpoints[label] = {
+            "requests": len(samples),
+            "errors": len(samples) - ok,
+            "status": dict(statuses[label]),
+            "rps": round(len(samples) / elapsed, 2),
+            **_percentiles(samples),
+            "db_round_trips_per_request": round(counter.round_trips(label) / len(samples), 2),
+        }
+    total = sum(e["requests"] for e in endpoints.values())
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "python": platform.python_version(),
+            "gcs": gcs,
+            "args": vars(args),
+            "mix": mix,
+        },
+        "totals": {
+            "requests": total,
+            "errors": sum(e["errors"] for e in endpoints.values()),
+            "rps": round(total / elapsed, 2),
+            "duration_s": round(elapsed, 2),
+        },
+        "endpoints": endpoints,
+        "pool": pool,
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--duration", type=float, default=30, help="segundos medidos")
+    parser.add_argument("--warmup", type=float, default=5, help="segundos sin medir antes de empezar")
+    parser.add_argument("--concurrency", type=int, default=32, help="clientes simultáneos")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--plants-per-user", type=int, default=8)
+    parser.add_argument("--items", type=int, default=100)
+    parser.add_argument("--mix", help="pesos, p. ej. chat=20,plants_list=30 (por defecto DEFAULT_MIX)")
+    parser.add_argument("--gemini-ms", type=float, default=1500, help="mediana de latencia de Gemini")
+    parser.add_argument("--gemini-sigma", type=float, default=0.5, help="sigma de la lognormal")
+    parser.add_argument("--gcs", choices=("memory", "emulator", "local"), default="memory")
+    parser.add_argument("--gcs-ms", type=float, default=80, help="latencia de GCS en modo memory")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path")
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(result, indent=2, ensure_ascii=False))
+
+    print(f"{'endpoint':<40} {'req':>6} {'err':>5} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'db rt':>6}")
+    for label, e in result["endpoints"].items():
+        print(f"{label:<40} {e['requests']:>6} {e['errors']:>5} {e['rps']:>7} "
+              f"{e['p50_ms']:>8} {e['p95_ms']:>8} {e['p99_ms']:>8} {e['db_round_trips_per_request']:>6}")
+    t = result["totals"]
+    print(f"total: {t['requests']} peticiones, {t['errors']} errores, {t['rps']} rps")
+    return 0 if t["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
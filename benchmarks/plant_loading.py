@@ -0,0 +1,160 @@
+# benchmarks/plant_loading.py
+"""
+Compara lo que cargan de la base los endpoints de plantas con la estrategia
+anterior (Plant.user lazy="joined" + Plant.care_plans lazy="selectin") y con
+la actual (proyección de columnas / solo el último plan).
+
+Uso:
+    python -m benchmarks.plant_loading --plants 300 --plans 20
+    python -m benchmarks.plant_loading --json plant_loading.json
+
+Crea una base temporal (ver benchmarks/_db.py), siembra un usuario con N
+plantas y M revisiones de plan por planta, y reporta por petición: sentencias
+SQL, filas devueltas y bytes (pg_column_size) de los resultados.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy.orm import Session, joinedload, selectinload
+
+from app.db import models
+from app.services.plants import latest_care_plans, list_active_plants
+from benchmarks._db import QueryCounter, result_bytes, throwaway_database
+
+PLAN_JSON = {
+    "riego": {"frecuencia": "cada 7 días", "detalle": "Regar hasta que drene, dejar secar el sustrato." * 3},
+    "luz": {"frecuencia": "", "detalle": "Luz indirecta brillante, evitar sol directo de mediodía." * 2},
+    "temperatura": "18-27 °C",
+    "humedad": "media-alta",
+    "fertilizacion": {"frecuencia": "cada 30 días", "detalle": "Fertilizante balanceado diluido a la mitad."},
+    "poda": "Retirar hojas amarillas y tallos secos.",
+    "plagas": "Cochinilla, araña roja: revisar el envés de las hojas.",
+    "alertas": ["Hojas amarillas = exceso de riego", "Puntas secas = humedad baja"],
+}
+
+
+def seed(engine, n_plants: int, n_plans: int) -> int:
+    with Session(engine) as db:
+        user = models.User(name="Bench", email="bench@example.com", username="bench")
+        db.add(user)
+        db.flush()
+        now = datetime.utcnow()
+        plants = [
+            models.Plant(user_id=user.id, common_name=f"Planta {i}", status="active",
+                         source="manual", created_at=now - timedelta(minutes=i))
+            for i in range(n_plants)
+        ]
+        db.add_all(plants)
+        db.flush()
+        db.add_all(
+            models.CarePlan(user_id=user.id, plant_id=p.id, plant_name=p.common_name,
+                            plan_json=PLAN_JSON, created_at=now - timedelta(days=j))
+            for p in plants
+            for j in range(n_plans)
+        )
+        db.commit()
+        return user.id
+
+
+# --- Estrategias ---
+
+def legacy_list(db: Session, user_id: int):
+    # Equivalente a lo que hacían lazy="joined"/"selectin" en cada consulta de Plant
+    return (
+        db.query(models.Plant)
+        .options(joinedload(models.Plant.user), selectinload(models.Plant.care_plans))
+        .filter(models.Plant.user_id == user_id, models.Plant.status == "active")
+        .order_by(models.Plant.created_at.desc())
+        .all()
+    )
+
+
+def legacy_latest_plan(db: Session, plant_id: int):
+    plant = (
+        db.query(models.Plant)
+        .options(joinedload(models.Plant.user), selectinload(models.Plant.care_plans))
+        .get(plant_id)
+    )
+    return (
+        db.query(models.CarePlan)
+        .filter(models.CarePlan.plant_id == plant.id)
+        .order_by(models.CarePlan.created_at.desc())
+        .first()
+    )
+
+
+def current_list(db: Session, user_id: int):
+    return list_active_plants(db, user_id)
+
+
+def current_latest_plan(db: Session, plant_id: int):
+    db.query(models.Plant.id).filter(models.Plant.id == plant_id).first()
+    return latest_care_plans(db, [plant_id]).get(plant_id)
+
+
+def run(n_plants: int, n_plans: int, repeat: int) -> dict:
+    with throwaway_database(bind_app=False) as engine:
+        user_id = seed(engine, n_plants, n_plans)
+        with Session(engine) as db:
+            plant_id = db.query(models.Plant.id).filter(models.Plant.user_id == user_id).first()[0]
+
+        cases = {
+            "list_plants/legacy": lambda db: legacy_list(db, user_id),
+            "list_plants/current": lambda db: current_list(db, user_id),
+            "get_latest_care_plan/legacy": lambda db: legacy_latest_plan(db, plant_id),
+            "get_latest_care_plan/current": lambda db: current_latest_plan(db, plant_id),
+        }
+
+        report = {}
+        with QueryCounter(engine) as counter:
+            counter.capture = True
+            for name, fn in cases.items():
+                timings = []
+                for i in range(repeat):
+                    with Session(engine) as db:
+                        start = time.perf_counter()
+                        if i == 0:
+                            with counter.label(name):
+                                fn(db)
+                        else:
+                            fn(db)
+                        timings.append(time.perf_counter() - start)
+                timings.sort()
+                report[name] = {
+                    "statements": counter.statements[name],
+                    "rows": counter.rows[name],
+                    "bytes": sum(result_bytes(engine, s, p) for s, p in counter.captured[name]),
+                    "ms_median": round(timings[len(timings) // 2] * 1000, 3),
+                }
+
+    for endpoint in ("list_plants", "get_latest_care_plan"):
+        legacy, current = report[f"{endpoint}/legacy"], report[f"{endpoint}/current"]
+        report[f"{endpoint}/reduction"] = {
+            "rows_x": round(legacy["rows"] / max(current["rows"], 1), 1),
+            "bytes_x": round(legacy["bytes"] / max(current["bytes"], 1), 1),
+        }
+    return {"plants": n_plants, "plans_per_plant": n_plans, "repeat": repeat, "results": report}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--plants", type=int, default=300)
+    parser.add_argument("--plans", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", dest="json_path")
+    args = parser.parse_args(argv)
+
+    result = run(args.plants, args.plans, args.repeat)
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(result, indent=2))
+    for name, r in result["results"].items():
+        print(f"{name:36s} {r}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
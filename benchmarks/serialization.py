@@ -0,0 +1,116 @@
+# benchmarks/serialization.py
+"""
+CPU y bytes en la red para GET /chat/sessions/{id}/messages con una sesión grande.
+
+Uso:
+    python -m benchmarks.serialization --messages 5000
+    python -m benchmarks.serialization --json serialization.json
+
+Sin base de datos: construye N filas con las columnas de MessageOut y mide,
+con time.process_time, las dos rutas de serialización:
+  - fastapi_default: como FastAPI con response_model (validar, model_dump en
+    modo json, jsonable_encoder, json.dumps de JSONResponse)
+  - list_response: TypeAdapter.validate_python + dump_json (app/core/responses.py)
+Después reporta el tamaño del cuerpo sin comprimir, con gzip (nivel 9 de
+GZipMiddleware) y con brotli (calidad 4, si está instalado).
+"""
+import argparse
+import gzip
+import json
+import statistics
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from app.api.chat import MESSAGE_COLUMNS, MessageOut
+from app.core.responses import list_response
+
+Row = namedtuple("Row", [c.key for c in MESSAGE_COLUMNS])
+
+
+def build_rows(n: int) -> list:
+    start = datetime(2025, 1, 1, 8, 0)
+    rows = []
+    for i in range(n):
+        user = i % 2 == 0
+        rows.append(Row(
+            id=i + 1,
+            session_id=1,
+            sender="user" if user else "assistant",
+            content=("¿Cada cuánto riego mi monstera? " if user
+                     else "Riega cuando los primeros 3 cm del sustrato estén secos. " * 8),
+            message_type="mixed" if i % 50 == 0 else "text",
+            image_gcs_uris=[f"gs://bench/fotos_chat/user-1/session-1/{i}_0.jpg"] if i % 50 == 0 else None,
+            created_at=start + timedelta(seconds=30 * i),
+        ))
+    return rows
+
+
+def fastapi_default(rows) -> bytes:
+    adapter = TypeAdapter(list[MessageOut])
+    value = adapter.validate_python(rows, from_attributes=True)
+    content = jsonable_encoder(adapter.dump_python(value, mode="json"))
+    return JSONResponse(content).body
+
+
+def fast_path(rows) -> bytes:
+    return list_response(MessageOut, rows).body
+
+
+def _cpu_ms(fn, rows, repeat: int) -> dict:
+    fn(rows)  # calentar (TypeAdapter, imports)
+    samples = []
+    for _ in range(repeat):
+        start = time.process_time()
+        fn(rows)
+        samples.append((time.process_time() - start) * 1000)
+    return {"cpu_ms_median": round(statistics.median(samples), 2),
+            "cpu_ms_min": round(min(samples), 2)}
+
+
+def _wire(body: bytes) -> dict:
+    sizes = {"identity_bytes": len(body), "gzip_bytes": len(gzip.compress(body, compresslevel=9))}
+    try:
+        import brotli
+    except ImportError:
+        sizes["br_bytes"] = None
+    else:
+        sizes["br_bytes"] = len(brotli.compress(body, quality=4))
+    return sizes
+
+
+def run(n_messages: int, repeat: int) -> dict:
+    rows = build_rows(n_messages)
+    results = {}
+    for name, fn in (("fastapi_default", fastapi_default), ("list_response", fast_path)):
+        body = fn(rows)
+        results[name] = {**_cpu_ms(fn, rows, repeat), **_wire(body)}
+    # Mismo contenido por las dos rutas (el orden de claves es el del modelo)
+    assert json.loads(fastapi_default(rows)) == json.loads(fast_path(rows))
+    return {"messages": n_messages, "repeat": repeat, "results": results}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", dest="json_path")
+    args = parser.parse_args(argv)
+
+    result = run(args.messages, args.repeat)
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(result, indent=2))
+    for name, r in result["results"].items():
+        print(f"{name:<16} cpu {r['cpu_ms_median']:>8} ms  "
+              f"{r['identity_bytes']:>9} B  gzip {r['gzip_bytes']:>8} B  br {r['br_bytes']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
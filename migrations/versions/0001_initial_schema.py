@@ -0,0 +1,167 @@
+"""initial schema
+
+Esquema tal como existía antes de tener migraciones (las tablas se crearon a
+mano / con Base.metadata.create_all). En una base ya existente no hay que
+ejecutarla: basta con `alembic stamp 0001` y luego `alembic upgrade head`.
+
+Revision ID: 0001
+Revises:
+Create Date: 2025-11-26 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("external_id", sa.String(), nullable=True),
+        sa.Column("name", sa.String(), nullable=True),
+        sa.Column("email", sa.String(), nullable=True),
+        sa.Column("username", sa.String(), nullable=True),
+        sa.Column("password_hash", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_external_id", "users", ["external_id"])
+    op.create_index("ix_users_username", "users", ["username"], unique=True)
+
+    op.create_table(
+        "chat_sessions",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+        sa.Column("started_at", sa.DateTime(), nullable=True),
+        sa.Column("last_activity_at", sa.DateTime(), nullable=True),
+        sa.Column("location", sa.Text(), nullable=True),
+        sa.Column("environment_json", postgresql.JSONB(), nullable=True),
+    )
+    op.create_index("ix_chat_sessions_id", "chat_sessions", ["id"])
+
+    op.create_table(
+        "chat_messages",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("session_id", sa.Integer(), sa.ForeignKey("chat_sessions.id"), nullable=False),
+        sa.Column("sender", sa.String(), nullable=False),
+        sa.Column("content", sa.Text(), nullable=True),
+        sa.Column("message_type", sa.String(), nullable=True),
+        sa.Column("image_gcs_uris", postgresql.JSONB(), nullable=True),
+        sa.Column("vertex_model_name", sa.Text(), nullable=True),
+        sa.Column("vertex_response_json", postgresql.JSONB(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_chat_messages_id", "chat_messages", ["id"])
+
+    op.create_table(
+        "plant_predictions",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("chat_message_id", sa.Integer(), sa.ForeignKey("chat_messages.id"), nullable=False),
+        sa.Column("label", sa.Text(), nullable=False),
+        sa.Column("confidence", sa.Numeric(), nullable=True),
+        sa.Column("raw_prediction_json", postgresql.JSONB(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_plant_predictions_id", "plant_predictions", ["id"])
+
+    op.create_table(
+        "plants",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("common_name", sa.Text(), nullable=False),
+        sa.Column("scientific_name", sa.Text(), nullable=True),
+        sa.Column("nickname", sa.Text(), nullable=True),
+        sa.Column("location", sa.Text(), nullable=True),
+        sa.Column("light", sa.String(), nullable=True),
+        sa.Column("humidity", sa.String(), nullable=True),
+        sa.Column("temperature", sa.String(), nullable=True),
+        sa.Column("notes", sa.Text(), nullable=True),
+        sa.Column("image_gcs_uri", sa.Text(), nullable=True),
+        sa.Column("status", sa.String(), nullable=True),
+        sa.Column("source", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_plants_id", "plants", ["id"])
+
+    op.create_table(
+        "care_plans",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("session_id", sa.Integer(), sa.ForeignKey("chat_sessions.id"), nullable=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+        sa.Column("plant_id", sa.Integer(), sa.ForeignKey("plants.id"), nullable=True),
+        sa.Column("plant_name", sa.Text(), nullable=False),
+        sa.Column("environment_json", postgresql.JSONB(), nullable=True),
+        sa.Column("plan_json", postgresql.JSONB(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_care_plans_id", "care_plans", ["id"])
+
+    op.create_table(
+        "marketplace_items",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("description", sa.Text(), nullable=True),
+        sa.Column("price", sa.Numeric(10, 2), nullable=False),
+        sa.Column("image_url", sa.String(), nullable=True),
+        sa.Column("category", sa.String(), nullable=True),
+        sa.Column("stock", sa.Integer(), nullable=True),
+        sa.Column("is_active", sa.Boolean(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_marketplace_items_id", "marketplace_items", ["id"])
+    op.create_index("ix_marketplace_items_category", "marketplace_items", ["category"])
+
+    op.create_table(
+        "orders",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("shipping_address", sa.Text(), nullable=False),
+        sa.Column("payment_method", sa.String(), nullable=False),
+        sa.Column("total_amount", sa.Numeric(10, 2), nullable=False),
+        sa.Column("status", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_orders_id", "orders", ["id"])
+
+    op.create_table(
+        "order_items",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("order_id", sa.Integer(), sa.ForeignKey("orders.id"), nullable=False),
+        sa.Column("item_id", sa.Integer(), sa.ForeignKey("marketplace_items.id"), nullable=False),
+        sa.Column("quantity", sa.Integer(), nullable=False),
+        sa.Column("unit_price", sa.Numeric(10, 2), nullable=False),
+    )
+    op.create_index("ix_order_items_id", "order_items", ["id"])
+
+    op.create_table(
+        "item_requests",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("item_name", sa.String(), nullable=False),
+        sa.Column("description", sa.Text(), nullable=True),
+        sa.Column("status", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_item_requests_id", "item_requests", ["id"])
+
+
+def downgrade() -> None:
+    op.drop_table("item_requests")
+    op.drop_table("order_items")
+    op.drop_table("orders")
+    op.drop_table("marketplace_items")
+    op.drop_table("care_plans")
+    op.drop_table("plants")
+    op.drop_table("plant_predictions")
+    op.drop_table("chat_messages")
+    op.drop_table("chat_sessions")
+    op.drop_table("users")
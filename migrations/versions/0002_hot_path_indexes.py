@@ -0,0 +1,87 @@
+"""hot path indexes
+
+Índices para las consultas que hacen los endpoints de app/api/* y los
+servicios de app/services/*. Se crean con CREATE INDEX CONCURRENTLY para no
+bloquear escrituras en producción, por eso van fuera de la transacción de la
+migración (autocommit_block).
+
+Si un CONCURRENTLY falla a medias deja un índice INVALID; hay que borrarlo
+(DROP INDEX CONCURRENTLY ...) antes de reintentar.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-12-01 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (nombre, tabla, columnas/expresiones, WHERE parcial)
+INDEXES = [
+    # Historial del chat y GET /chat/sessions/{id}/messages:
+    #   WHERE session_id = ? ORDER BY created_at
+    ("ix_chat_messages_session_created", "chat_messages",
+     ["session_id", "created_at"], None),
+    # Título de cada conversación en GET /chat/sessions (primer mensaje del usuario)
+    ("ix_chat_messages_session_user_created", "chat_messages",
+     ["session_id", "created_at"], "sender = 'user'"),
+    # GET /chat/sessions: WHERE user_id = ? ORDER BY last_activity_at DESC
+    ("ix_chat_sessions_user_activity", "chat_sessions",
+     ["user_id", sa.text("last_activity_at DESC")], None),
+    # GET /plants: WHERE user_id = ? AND status = 'active' ORDER BY created_at DESC
+    ("ix_plants_user_active_created", "plants",
+     ["user_id", sa.text("created_at DESC")], "status = 'active'"),
+    # ensure_plant_for_user: WHERE user_id = ? AND lower(common_name) = ? AND status = 'active'
+    ("ix_plants_user_active_lower_name", "plants",
+     ["user_id", sa.text("lower(common_name)")], "status = 'active'"),
+    # find_care_plan: WHERE user_id = ? AND plant_id = ? ORDER BY created_at DESC
+    ("ix_care_plans_user_plant_created", "care_plans",
+     ["user_id", "plant_id", sa.text("created_at DESC")], None),
+    # GET /plants/{id}/care-plan: WHERE plant_id = ? ORDER BY created_at DESC
+    ("ix_care_plans_plant_created", "care_plans",
+     ["plant_id", sa.text("created_at DESC")], None),
+    # Pedidos de un usuario
+    ("ix_orders_user_created", "orders",
+     ["user_id", sa.text("created_at DESC")], None),
+    # Login / registro por email
+    ("ix_users_email", "users", ["email"], None),
+    # GET /marketplace/items: WHERE is_active AND category = ?
+    ("ix_marketplace_items_active_category", "marketplace_items",
+     ["category"], "is_active"),
+    # Claves foráneas sin índice (joins y borrados en cascada)
+    ("ix_order_items_order_id", "order_items", ["order_id"], None),
+    ("ix_plant_predictions_chat_message_id", "plant_predictions", ["chat_message_id"], None),
+]
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                postgresql_concurrently=True,
+                postgresql_where=sa.text(where) if where else None,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(
+                name,
+                table_name=table,
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
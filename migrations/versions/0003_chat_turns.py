@@ -0,0 +1,44 @@
+"""chat turn lease and idempotency keys
+
+- chat_sessions.turn_lease_until: un turno de /chat/message a la vez por sesión.
+- chat_idempotency_keys: respuestas guardadas por Idempotency-Key.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-12-03 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Columna nullable sin default: en Postgres es solo un cambio de catálogo
+    op.add_column("chat_sessions", sa.Column("turn_lease_until", sa.DateTime(), nullable=True))
+
+    op.create_table(
+        "chat_idempotency_keys",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("request_hash", sa.String(64), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("session_id", sa.Integer(), sa.ForeignKey("chat_sessions.id"), nullable=True),
+        sa.Column("reply_message_id", sa.Integer(), sa.ForeignKey("chat_messages.id"), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.UniqueConstraint("key", name="chat_idempotency_keys_key_key"),
+    )
+    op.create_index("ix_chat_idempotency_keys_id", "chat_idempotency_keys", ["id"])
+    op.create_index("ix_chat_idempotency_keys_created_at", "chat_idempotency_keys", ["created_at"])
+
+
+def downgrade() -> None:
+    op.drop_table("chat_idempotency_keys")
+    op.drop_column("chat_sessions", "turn_lease_until")
@@ -0,0 +1,43 @@
+"""chat session environment GIN index
+
+Índice GIN (jsonb_path_ops) sobre chat_sessions.environment_json para filtros
+de contención `@>`, p. ej. sesiones con {"light": "baja"}. Se crea
+CONCURRENTLY, igual que en 0002.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-12-05 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_chat_sessions_environment",
+            "chat_sessions",
+            ["environment_json"],
+            postgresql_using="gin",
+            postgresql_ops={"environment_json": "jsonb_path_ops"},
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_chat_sessions_environment",
+            table_name="chat_sessions",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
@@ -0,0 +1,61 @@
+"""users unique lower(email)
+
+Registro por INSERT ... ON CONFLICT DO NOTHING y login por lower(email):
+índice único sobre lower(email), que reemplaza a ix_users_email (0002).
+username ya tiene índice único (ix_users_username).
+
+Si hay emails repetidos (sin distinguir mayúsculas) el CREATE UNIQUE INDEX
+falla y deja un índice INVALID: hay que resolver los duplicados, borrar el
+índice y reintentar. Para encontrarlos:
+    SELECT lower(email), count(*) FROM users GROUP BY 1 HAVING count(*) > 1;
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2025-12-10 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_users_lower_email",
+            "users",
+            [sa.text("lower(email)")],
+            unique=True,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.drop_index(
+            "ix_users_email",
+            table_name="users",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_users_email",
+            "users",
+            ["email"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.drop_index(
+            "ix_users_lower_email",
+            table_name="users",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
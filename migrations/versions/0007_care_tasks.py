@@ -0,0 +1,60 @@
+"""care tasks
+
+care_tasks: riego / fertilización recurrentes derivados del CarePlan
+(app/services/care_tasks.py), con índices sobre next_due_at para que las
+tareas vencidas salgan por rango:
+- ix_care_tasks_user_due (user_id, next_due_at): GET /plants/due-tasks
+- ix_care_tasks_due_unnotified (next_due_at) WHERE notified_at IS NULL:
+  worker de recordatorios
+- ix_care_tasks_plant_kind (plant_id, kind) único: upsert al guardar un plan
+
+Tabla nueva, así que los índices se crean en la misma transacción. Para las
+plantas que ya tienen plan:
+    python -m app.services.care_tasks --backfill
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2025-12-12 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "care_tasks",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("plant_id", sa.Integer(), sa.ForeignKey("plants.id"), nullable=False),
+        sa.Column("care_plan_id", sa.Integer(), sa.ForeignKey("care_plans.id"), nullable=True),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column("frequency_text", sa.Text(), nullable=False),
+        sa.Column("interval_hours", sa.Integer(), nullable=False),
+        sa.Column("next_due_at", sa.DateTime(), nullable=False),
+        sa.Column("last_done_at", sa.DateTime(), nullable=True),
+        sa.Column("notified_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id", name="care_tasks_pkey"),
+    )
+    op.create_index("ix_care_tasks_id", "care_tasks", ["id"])
+    op.create_index("ix_care_tasks_plant_kind", "care_tasks", ["plant_id", "kind"], unique=True)
+    op.create_index("ix_care_tasks_user_due", "care_tasks", ["user_id", "next_due_at"])
+    op.create_index(
+        "ix_care_tasks_due_unnotified",
+        "care_tasks",
+        ["next_due_at"],
+        postgresql_where=sa.text("notified_at IS NULL"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("care_tasks")
@@ -0,0 +1,81 @@
+"""chat cascade deletes
+
+Borrado de sesiones de chat sin cargar mensajes (app/services/chat_cleanup.py):
+ON DELETE CASCADE en las FKs que cuelgan de chat_sessions / chat_messages, y
+SET NULL en care_plans.session_id (el plan se conserva).
+
+Las FKs se recrean NOT VALID (bloqueo breve) y se validan después fuera de la
+transacción, sin bloquear escrituras. Los índices del lado referenciante que
+faltaban se crean CONCURRENTLY antes: sin ellos cada fila borrada recorre
+chat_idempotency_keys / care_plans.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2025-12-15 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0008"
+down_revision: Union[str, None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (constraint, tabla, columna, tabla referenciada, ON DELETE)
+FOREIGN_KEYS = [
+    ("chat_messages_session_id_fkey", "chat_messages", "session_id", "chat_sessions", "CASCADE"),
+    ("plant_predictions_chat_message_id_fkey", "plant_predictions", "chat_message_id", "chat_messages", "CASCADE"),
+    ("chat_idempotency_keys_session_id_fkey", "chat_idempotency_keys", "session_id", "chat_sessions", "CASCADE"),
+    ("chat_idempotency_keys_reply_message_id_fkey", "chat_idempotency_keys", "reply_message_id", "chat_messages", "CASCADE"),
+    ("care_plans_session_id_fkey", "care_plans", "session_id", "chat_sessions", "SET NULL"),
+]
+
+# (nombre, tabla, columna); parciales WHERE columna IS NOT NULL
+INDEXES = [
+    ("ix_chat_idempotency_keys_session_id", "chat_idempotency_keys", "session_id"),
+    ("ix_chat_idempotency_keys_reply_message_id", "chat_idempotency_keys", "reply_message_id"),
+    ("ix_care_plans_session_id", "care_plans", "session_id"),
+]
+
+
+def _swap_foreign_keys(with_ondelete: bool) -> None:
+    for name, table, column, referred, ondelete in FOREIGN_KEYS:
+        op.drop_constraint(name, table, type_="foreignkey")
+        op.create_foreign_key(
+            name,
+            table,
+            referred,
+            [column],
+            ["id"],
+            ondelete=ondelete if with_ondelete else None,
+            postgresql_not_valid=True,
+        )
+    with op.get_context().autocommit_block():
+        for name, table, *_ in FOREIGN_KEYS:
+            op.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}")
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, column in INDEXES:
+            op.create_index(
+                name,
+                table,
+                [column],
+                postgresql_where=sa.text(f"{column} IS NOT NULL"),
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+    _swap_foreign_keys(with_ondelete=True)
+
+
+def downgrade() -> None:
+    _swap_foreign_keys(with_ondelete=False)
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,50 @@
+"""stored objects
+
+stored_objects: imágenes guardadas por contenido (clave carpeta/sha256) con su
+número de referencias y cuándo quedaron subidas (app/services/storage.py). El barrido de objetos sin
+referencias busca por ix_stored_objects_unreferenced (updated_at) WHERE
+refcount = 0:
+    python -m app.services.storage --sweep
+
+Tabla nueva, así que el índice se crea en la misma transacción. Las imágenes
+subidas antes (nombres con timestamp) no se registran aquí.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2025-12-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0009"
+down_revision: Union[str, None] = "0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "stored_objects",
+        sa.Column("key", sa.Text(), nullable=False),
+        sa.Column("content_type", sa.String(), nullable=True),
+        sa.Column("size", sa.BigInteger(), nullable=False),
+        sa.Column("refcount", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("uploaded_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("key", name="stored_objects_pkey"),
+    )
+    op.create_index(
+        "ix_stored_objects_unreferenced",
+        "stored_objects",
+        ["updated_at"],
+        postgresql_where=sa.text("refcount = 0"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("stored_objects")
@@ -0,0 +1,81 @@
+# tests/test_care_tasks.py
+"""
+POST /plants/tasks/{task_id}/done contra una base temporal de Postgres
+(benchmarks/_db.py, variables DB_*). Se salta si no hay servidor.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("fastapi")
+
+import benchmarks  # noqa: E402,F401  (entorno mínimo para Settings)
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from app.db import models  # noqa: E402
+from app.db.session import session_scope  # noqa: E402
+from app.main import app  # noqa: E402
+from benchmarks._db import throwaway_database  # noqa: E402
+
+
+@pytest.fixture
+def database():
+    try:
+        with throwaway_database() as engine:
+            yield engine
+    except OperationalError as exc:
+        pytest.skip(f"Postgres no disponible: {exc}")
+
+
+def _seed_task():
+    with session_scope() as db:
+        user = models.User(name="Ana", email="ana@example.com", username="ana", password_hash="x")
+        db.add(user)
+        db.flush()
+        plant = models.Plant(user_id=user.id, common_name="Monstera", nickname="Moni")
+        db.add(plant)
+        db.flush()
+        task = models.CareTask(
+            user_id=user.id,
+            plant_id=plant.id,
+            kind="riego",
+            frequency_text="cada 3 días",
+            interval_hours=72,
+            next_due_at=datetime.utcnow() - timedelta(hours=1),
+            notified_at=datetime.utcnow(),
+        )
+        db.add(task)
+        db.flush()
+        return user.id, task.id
+
+
+def test_mark_task_done_reschedules_and_returns_plant(database):
+    user_id, task_id = _seed_task()
+    client = TestClient(app)
+
+    before = datetime.utcnow()
+    response = client.post(f"/plants/tasks/{task_id}/done", params={"user_id": user_id})
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["id"] == task_id
+    assert body["plant_name"] == "Monstera"
+    assert body["plant_nickname"] == "Moni"
+    assert datetime.fromisoformat(body["last_done_at"]) >= before
+    assert datetime.fromisoformat(body["next_due_at"]) - datetime.fromisoformat(
+        body["last_done_at"]
+    ) == timedelta(hours=72)
+
+    with session_scope() as db:
+        assert db.get(models.CareTask, task_id).notified_at is None
+
+
+def test_mark_task_done_other_user_is_404(database):
+    user_id, task_id = _seed_task()
+    client = TestClient(app)
+
+    response = client.post(f"/plants/tasks/{task_id}/done", params={"user_id": user_id + 1})
+
+    assert response.status_code == 404